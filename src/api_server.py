@@ -0,0 +1,32 @@
+"""
+This module serves the HTTP/JSON query API of the chatbot without the Gradio UI, for other
+services to query the preprocessed documents.
+
+Endpoints:
+- POST /api/query: {"question": "...", "history": [["question", "answer"], ...], "temperature": 0}
+- POST /api/query/batch: {"questions": ["...", "..."], "temperature": 0}
+
+Both return the answers with their sources, page numbers and a breakdown of the latency of each
+stage. Latency histograms of the requests and their stages are served at /metrics. The
+interactive docs are served at /docs. The same endpoints are also served by
+`raggpt_app.py`, next to the UI.
+
+Run from the repository root:
+    python src/api_server.py
+"""
+
+import threading
+import uvicorn
+from fastapi import FastAPI
+from utils.chatbot import APPCFG, TRACER, ChatBot
+from utils.metrics_api import create_metrics_router
+from utils.query_api import create_query_router
+
+app = FastAPI(title="RAG-GPT query API")
+app.include_router(create_query_router())
+app.include_router(create_metrics_router(TRACER))
+
+
+if __name__ == "__main__":
+    threading.Thread(target=ChatBot.warm_up, name="warm-up", daemon=True).start()
+    uvicorn.run(app, host=APPCFG.app_host, port=APPCFG.api_port)
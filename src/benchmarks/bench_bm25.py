@@ -0,0 +1,53 @@
+"""
+Benchmark of `BM25Index` build throughput and query latency on a synthetic corpus.
+
+Chunks are drawn from a Zipf-distributed vocabulary, so a few terms are very common and most
+are rare, like real text. Queries mix one to four terms of varied frequency.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_bm25 --chunks 1000000
+"""
+
+import argparse
+import tempfile
+import time
+import numpy as np
+from utils.bm25_index import BM25Index
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200000)
+    parser.add_argument("--words-per-chunk", type=int, default=200)
+    parser.add_argument("--vocabulary", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocabulary = np.array([f"w{i}" for i in range(args.vocabulary)])
+    index = BM25Index(tempfile.mkdtemp())
+
+    start = time.perf_counter()
+    batch_size = 1000
+    for offset in range(0, args.chunks, batch_size):
+        words = vocabulary[np.minimum(rng.zipf(1.2, size=(batch_size, args.words_per_chunk)), args.vocabulary) - 1]
+        index.add([f"chunk-{offset + i}" for i in range(batch_size)], [" ".join(row) for row in words])
+    build_time = time.perf_counter() - start
+    print(f"indexed {len(index)} chunks in {build_time:.1f}s ({len(index) / build_time:.0f} chunks/s)")
+    start = time.perf_counter()
+    index.optimize()
+    print(f"merged the segments in {time.perf_counter() - start:.1f}s")
+
+    latencies = []
+    for _ in range(args.queries):
+        terms = vocabulary[np.minimum(rng.zipf(1.2, size=rng.integers(1, 5)), args.vocabulary) - 1]
+        start = time.perf_counter()
+        index.search(" ".join(terms), args.k)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.array(latencies)
+    print(f"query latency: p50 {np.percentile(latencies, 50):.2f} ms | p99 {np.percentile(latencies, 99):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of `ChatBot.clean_references` against the previous regex/ast implementation.
+
+The legacy formatter stringified each `Document`, regex-parsed `page_content=... metadata={...}`
+back out, ran `ast.literal_eval` on the metadata and then about ten normalization passes. The
+current one reads the fields directly and skips normalization for chunks normalized at ingest.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_clean_references --docs 5000
+"""
+
+import argparse
+import ast
+import html
+import os
+import random
+import re
+import time
+from langchain_core.documents import Document
+from utils.chatbot import ChatBot
+from utils.utilities import normalize_text
+
+
+def legacy_clean_references(documents) -> str:
+    server_url = "http://localhost:8000"
+    documents = [str(x) + "\n\n" for x in documents]
+    markdown_documents = ""
+    counter = 1
+    for doc in documents:
+        match = re.match(r"page_content=(.*?)(?:\s+)metadata=(\{.*\})", doc, re.DOTALL)
+        if not match:
+            continue
+        content, metadata = match.groups()
+        metadata_dict = ast.literal_eval(metadata)
+        content = bytes(content, "utf-8").decode("unicode_escape")
+        content = re.sub(r'\\n', '\n', content)
+        content = re.sub(r'\s*<EOS>\s*<pad>\s*', ' ', content)
+        content = re.sub(r'\s+', ' ', content).strip()
+        content = html.unescape(content)
+        content = content.encode('latin1').decode('utf-8', 'ignore')
+        content = re.sub(r'â', '-', content)
+        content = re.sub(r'â', '∈', content)
+        content = re.sub(r'Ã', '×', content)
+        content = re.sub(r'ï¬', 'fi', content)
+        content = re.sub(r'â', '∈', content)
+        content = re.sub(r'Â·', '·', content)
+        content = re.sub(r'ï¬', 'fl', content)
+        pdf_url = f"{server_url}/{os.path.basename(metadata_dict['source'])}"
+        markdown_documents += f"# Retrieved content {counter}:\n" + content + "\n\n" + \
+            f"Source: {os.path.basename(metadata_dict['source'])}" + " | " + \
+            f"Page number: {str(metadata_dict['page'])}" + " | " + \
+            f"[View PDF]({pdf_url})" "\n\n"
+        counter += 1
+    return markdown_documents
+
+
+def synthetic_documents(num_docs: int, normalized: bool):
+    words = ["attention", "softmax", "ﬁne-tuning", "startup", "founder", "d_model", "&amp;", "layer\n\n", "x≤y"]
+    docs = []
+    for i in range(num_docs):
+        text = " ".join(random.choices(words, k=250))
+        metadata = {"source": f"data/docs/doc_{i % 7}.pdf", "page": i % 40}
+        if normalized:
+            text = normalize_text(text)
+            metadata["normalized"] = True
+        docs.append(Document(page_content=text, metadata=metadata))
+    return docs
+
+
+def bench(fn, docs, k: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(docs), k):
+        fn(docs[i:i + k])
+    return (time.perf_counter() - start) * 1000 / (len(docs) / k)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    raw_docs = synthetic_documents(args.docs, normalized=False)
+    normalized_docs = synthetic_documents(args.docs, normalized=True)
+
+    dropped = sum(legacy_clean_references([doc]) == "" for doc in raw_docs)
+    print(f"legacy formatter silently dropped {dropped}/{len(raw_docs)} documents")
+    print(f"legacy regex/ast formatter:          {bench(legacy_clean_references, raw_docs, args.k):7.3f} ms per query")
+    print(f"direct access, normalized per query: {bench(ChatBot.clean_references, raw_docs, args.k):7.3f} ms per query")
+    print(f"direct access, normalized at ingest: {bench(ChatBot.clean_references, normalized_docs, args.k):7.3f} ms per query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark of the embedding scheduler against a local fake OpenAI embeddings server.
+
+The fake server answers `POST /v1/embeddings` with deterministic vectors after a fixed
+latency and rejects every Nth request with `429 Too Many Requests` and a `Retry-After`
+header, so batching, concurrency and rate-limit handling can be exercised without an API key.
+The same server can be used to test `AsyncBatchEmbeddings` by pointing `base_url` at it.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_embedding_scheduler --texts 2000 --latency 0.05 --reject-every 7
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.embedding_scheduler import AsyncBatchEmbeddings
+
+
+class FakeEmbeddingServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server that mimics the OpenAI embeddings endpoint.
+
+    Parameters:
+        port (int): The port to listen on (0 picks a free port).
+        latency (float): Seconds to wait before answering each request.
+        reject_every (int): Answer every Nth request with a 429 (0 disables rejections).
+        dim (int): The dimension of the returned vectors.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency: float = 0.05, reject_every: int = 0, dim: int = 8) -> None:
+        super().__init__(("127.0.0.1", port), FakeEmbeddingHandler)
+        self.latency = latency
+        self.reject_every = reject_every
+        self.dim = dim
+        self.requests = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> "FakeEmbeddingServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            reject = server.reject_every and server.requests % server.reject_every == 0
+            server.rejected += bool(reject)
+        time.sleep(server.latency)
+
+        if reject:
+            payload = {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+            self.__send(429, payload, {"Retry-After": "0.2"})
+            return
+
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, text in enumerate(inputs):
+            digest = hashlib.sha256(str(text).encode("utf-8")).digest()
+            data.append({"object": "embedding", "index": i,
+                         "embedding": [b / 255 for b in digest[:server.dim]]})
+        self.__send(200, {"object": "list", "data": data, "model": body["model"],
+                          "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def __send(self, status: int, payload: dict, headers: dict = None) -> None:
+        encoded = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--reject-every", type=int, default=7)
+    parser.add_argument("--batch-token-budget", type=int, default=8000)
+    args = parser.parse_args()
+
+    texts = [f"chunk {i}: " + "attention is all you need " * 40 for i in range(args.texts)]
+    server = FakeEmbeddingServer(latency=args.latency, reject_every=args.reject_every).start()
+    try:
+        expected = None
+        for concurrency in (1, 4, 16):
+            server.requests = server.rejected = 0
+            embedding = AsyncBatchEmbeddings(model="text-embedding-ada-002", api_key="fake", base_url=server.base_url,
+                                             batch_token_budget=args.batch_token_budget, max_concurrency=concurrency)
+            start = time.perf_counter()
+            vectors = embedding.embed_documents(texts)
+            elapsed = time.perf_counter() - start
+            expected = expected or vectors
+            assert vectors == expected, "results must not depend on concurrency"
+            print(f"concurrency {concurrency:>2}: {elapsed:6.2f} s | {len(texts) / elapsed:8.1f} texts/s | "
+                  f"{server.requests} requests, {server.rejected} rate-limited")
+        assert embedding.embed_query(texts[0]) == expected[0]
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
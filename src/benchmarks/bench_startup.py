@@ -0,0 +1,47 @@
+"""
+Benchmark of the cold start of the Gradio app: the time to import `raggpt_app`, which loads
+the config, imports the libraries and builds the UI.
+
+Every run is a fresh interpreter started with `-X importtime`; the median wall time is reported
+together with the modules with the largest cumulative import time in the last run.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_startup --runs 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--module", default="raggpt_app")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    wall_times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+                                capture_output=True, text=True, check=True)
+        wall_times.append(time.perf_counter() - start)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        imports.append((int(cumulative) / 1e6, name.rstrip()))
+    print(f"import {args.module}: median {statistics.median(wall_times):.2f}s "
+          f"(min {min(wall_times):.2f}s, max {max(wall_times):.2f}s) over {args.runs} runs")
+    print("largest cumulative imports:")
+    for seconds, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {seconds:6.2f}s {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark of the vector store backends: Chroma (HNSW), and the numpy backend with an exact
+(flat) or an IVF index.
+
+The corpus is made of synthetic embeddings drawn around a few hundred topic centers, like real
+chunk embeddings, and the queries are noisy copies of corpus vectors. Every backend is built
+from the same vectors; recall@k is measured against the exact nearest neighbours, and the
+latency of single queries as well as the throughput of batched queries are reported.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_vector_store --chunks 100000 --nprobe 16
+"""
+
+import argparse
+import tempfile
+import time
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from utils.vector_store import normalize_rows, get_vector_store
+
+
+class LookupEmbedding(Embeddings):
+    """
+    Returns the precomputed vector of every "chunk-<i>" text.
+    """
+
+    def __init__(self, vectors: np.ndarray) -> None:
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return self.vectors[[int(text.split("-")[1]) for text in texts]].tolist()
+
+    def embed_query(self, text):
+        return self.vectors[int(text.split("-")[1])].tolist()
+
+
+def build(persist_directory: str, embedding: LookupEmbedding, num_chunks: int, batch_size: int = 1000, **options):
+    store = get_vector_store(persist_directory, embedding, **options)
+    for start in range(0, num_chunks, batch_size):
+        ids = range(start, min(start + batch_size, num_chunks))
+        store.add_documents([Document(page_content=f"chunk-{i}", metadata={"source": f"doc_{i % 100}.pdf"}) for i in ids],
+                            [f"chunk-{i}" for i in ids])
+    store.optimize()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--backends", default="chroma,flat,ivf")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((args.topics, args.dim)).astype(np.float32)
+    vectors = normalize_rows(centers[rng.integers(0, args.topics, args.chunks)]
+                             + 0.6 * rng.standard_normal((args.chunks, args.dim)).astype(np.float32))
+    queries = normalize_rows(vectors[rng.integers(0, args.chunks, args.queries)]
+                             + 0.6 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+    exact = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    embedding = LookupEmbedding(vectors)
+
+    configurations = {"chroma": {"backend": "chroma"},
+                      "flat": {"backend": "numpy", "index": "flat"},
+                      "ivf": {"backend": "numpy", "index": "ivf", "ivf_nlist": args.nlist, "ivf_nprobe": args.nprobe}}
+    print(f"{args.chunks} chunks of {args.dim} dimensions, {args.queries} queries, k={args.k}")
+    for name in args.backends.split(","):
+        options = configurations[name]
+        persist_directory = tempfile.mkdtemp()
+        start = time.perf_counter()
+        build(persist_directory, embedding, args.chunks, **options)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store = get_vector_store(persist_directory, embedding, **options)
+        store.similarity_search_by_vector(queries[0].tolist(), args.k)
+        open_time = time.perf_counter() - start
+
+        latencies, results = [], []
+        for query in queries.tolist():
+            start = time.perf_counter()
+            results.append(store.similarity_search_by_vector(query, args.k))
+            latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        store.search_by_vectors(queries.tolist(), args.k)
+        batch_time = time.perf_counter() - start
+
+        recall = np.mean([len({doc.id for doc in docs} & {f"chunk-{i}" for i in truth}) / args.k
+                          for docs, truth in zip(results, exact)])
+        print(f"{name:>6}: build {build_time:6.1f}s | open + first query {open_time * 1000:7.1f} ms | "
+              f"recall@{args.k} {recall:.3f} | p50 {np.percentile(latencies, 50):6.2f} ms | "
+              f"p99 {np.percentile(latencies, 99):6.2f} ms | batch {args.queries / batch_time:7.0f} queries/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Microbenchmark: cold vs warm retrieval latency of the vector store.
+
+Cold reproduces the old behaviour of `ChatBot.respond` (a new `Chroma` handle per question),
+warm goes through the shared `VectorDBPool` handle. A deterministic fake embedding is used so
+the numbers only reflect the vector store and not the embedding API.
+
+Run from the `src` directory:
+    python -m benchmarks.bench_vectordb_pool --num-chunks 5000 --queries 200
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from utils.vectordb_pool import VectorDBPool
+
+
+def build_store(persist_directory: str, num_chunks: int, embedding) -> None:
+    words = ["attention", "startup", "founder", "transformer", "layer", "story", "market", "model"]
+    texts = [" ".join(random.choices(words, k=40)) for _ in range(num_chunks)]
+    metadatas = [{"source": f"doc_{i % 10}.pdf", "page": i % 50} for i in range(num_chunks)]
+    Chroma.from_texts(texts=texts, embedding=embedding, metadatas=metadatas,
+                      persist_directory=persist_directory)
+
+
+def time_queries(fn, queries) -> list:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(name: str, latencies: list) -> None:
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>5}: mean {statistics.mean(latencies):8.2f} ms | "
+          f"p50 {statistics.median(latencies):8.2f} ms | p99 {p99:8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-chunks", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=3)
+    args = parser.parse_args()
+
+    embedding = DeterministicFakeEmbedding(size=1536)
+    queries = [f"question number {i} about attention" for i in range(args.queries)]
+
+    with tempfile.TemporaryDirectory() as persist_directory:
+        print(f"Building a store with {args.num_chunks} chunks...")
+        build_store(persist_directory, args.num_chunks, embedding)
+
+        def cold(query):
+            vectordb = Chroma(persist_directory=persist_directory, embedding_function=embedding)
+            vectordb.similarity_search(query, k=args.k)
+
+        def warm(query):
+            VectorDBPool.get(persist_directory, embedding).similarity_search(query, k=args.k)
+
+        VectorDBPool.get(persist_directory, embedding)  # open once, like the first chat turn
+        report("cold", time_queries(cold, queries))
+        report("warm", time_queries(warm, queries))
+
+
+if __name__ == "__main__":
+    main()
@@ -13,19 +13,53 @@ The app has three main sections:
    - Clear the chat
 
 How it works:
-- If you upload a file, the app processes it and updates the chatbot and input box.
+- If you upload a file for RAG, it is indexed by a background ingestion job. The "Ingestion jobs"
+  panel polls its progress and can cancel it; the same jobs are served as JSON under /jobs,
+  where `upload_data_manually.py --submit` jobs can also be followed.
+- Other services can query the preprocessed documents through the JSON API under /api (see
+  `api_server.py`, which serves it without the UI).
 - If you type a message and submit, the chatbot replies, using your selected settings.
 - The reference bar may update based on the response.
+- Chat requests and uploads run in separate bounded worker pools, so long uploads never hold up
+  the chat. The "Queue status" panel shows the queue depth and wait times of both pools.
+- Files uploaded for RAG go to an in-memory index private to the browser session, dropped when
+  the tab is closed or after an idle timeout.
+- Heavy libraries (Chroma, the PDF parsers) are only imported when first needed; the vector store
+  is loaded right after the UI is up. Import and UI build times are printed at startup.
+- The latency of every chat turn is broken down by stage (retrieval, prompt build, LLM call, ...):
+  a sample of the traces is logged as JSON lines to `tracing.log_path`, and their histograms are
+  served at /metrics for Prometheus.
 
 You can run this module as a standalone app to interact with the chatbot in your browser.
 
 The code also has more detailed comments explaining each part.
 """
 
+import time
+START_TIME = time.perf_counter()
+
+import threading
 import gradio as gr
-from utils.upload_file import UploadFile
-from utils.chatbot import ChatBot
+import uvicorn
+from fastapi import FastAPI
+from utils.upload_file import INGEST_JOBS, UploadFile
+from utils.jobs_api import create_jobs_router
+from utils.query_api import create_query_router
+from upload_data_manually import run_build_job
+from utils.chatbot import TRACER, ChatBot
+from utils.metrics_api import create_metrics_router
 from utils.ui_settings import UISettings
+from utils.load_config import get_config
+from utils.worker_pools import WorkerPool
+
+IMPORT_TIME = time.perf_counter() - START_TIME
+APPCFG = get_config()
+CHAT_POOL = WorkerPool("chat", APPCFG.chat_concurrency, APPCFG.chat_max_queue_size)
+INGEST_POOL = WorkerPool("ingest", APPCFG.ingest_concurrency, APPCFG.ingest_max_queue_size)
+respond = CHAT_POOL.wrap_stream(ChatBot.respond)
+process_uploaded_files = INGEST_POOL.wrap(UploadFile.process_uploaded_files)
+INGEST_JOBS.register("session", UploadFile.index_session_files)
+INGEST_JOBS.register("build", run_build_job)
 
 with gr.Blocks() as demo:
     with gr.Tabs():
@@ -83,28 +117,68 @@ with gr.Blocks() as demo:
                     label="RAG with", choices=["Preprocessed doc", "Upload doc: Process for RAG", "Upload doc: Give Full Summary"], value="Preprocessed doc")
                 clear_button = gr.ClearButton([input_txt, chatbot])
 
+            ##############
+            # Fourth ROW:
+            ##############
+            with gr.Accordion("Queue status", open=False):
+                queue_status = gr.Markdown(WorkerPool.status_markdown())
+                gr.Timer(2).tick(WorkerPool.status_markdown, None, [queue_status], queue=False)
+            with gr.Accordion("Ingestion jobs", open=True):
+                jobs_status = gr.Markdown("No ingestion jobs.")
+                cancel_jobs_btn = gr.Button(value="Cancel indexing", size="sm")
+                cancel_jobs_btn.click(UploadFile.cancel_session_jobs, None, [jobs_status], queue=False)
+                gr.Timer(1).tick(UploadFile.jobs_markdown, None, [jobs_status], queue=False)
+
             ##############
             # Process:
             ##############
-            file_msg = upload_btn.upload(fn=UploadFile.process_uploaded_files, inputs=[
-                upload_btn, chatbot, rag_with_dropdown], outputs=[input_txt, chatbot], queue=False)
+            # Admission control is done by the worker pools, so Gradio itself does not cap these events
+            file_msg = upload_btn.upload(fn=process_uploaded_files, inputs=[
+                upload_btn, chatbot, rag_with_dropdown], outputs=[input_txt, chatbot], concurrency_limit=None)
 
-            txt_msg = input_txt.submit(fn=ChatBot.respond,
+            # Chat responses are streamed, which needs the Gradio queue
+            txt_msg = input_txt.submit(fn=respond,
                                        inputs=[chatbot, input_txt,
                                                rag_with_dropdown, temperature_bar],
                                        outputs=[input_txt,
                                                 chatbot, ref_output],
-                                       queue=False).then(lambda: gr.Textbox(interactive=True),
-                                                         None, [input_txt], queue=False)
+                                       concurrency_limit=None).then(lambda: gr.Textbox(interactive=True),
+                                                                    None, [input_txt], queue=False)
 
-            txt_msg = text_submit_btn.click(fn=ChatBot.respond,
+            txt_msg = text_submit_btn.click(fn=respond,
                                             inputs=[chatbot, input_txt,
                                                     rag_with_dropdown, temperature_bar],
                                             outputs=[input_txt,
                                                      chatbot, ref_output],
-                                            queue=False).then(lambda: gr.Textbox(interactive=True),
-                                                              None, [input_txt], queue=False)
+                                            concurrency_limit=None).then(lambda: gr.Textbox(interactive=True),
+                                                                         None, [input_txt], queue=False)
+
+    # the uploads of a session are only kept while its tab is open
+    demo.unload(UploadFile.end_session)
+
+# For a per-module breakdown of the imports: python -X importtime raggpt_app.py, or benchmarks/bench_startup.py
+UI_TIME = time.perf_counter() - START_TIME - IMPORT_TIME
 
 
 if __name__ == "__main__":
-    demo.launch()
\ No newline at end of file
+    # not recorded when the fork server of the ingestion workers imports this module
+    print(f"Startup: imports {IMPORT_TIME:.2f}s | UI {UI_TIME:.2f}s")
+    startup_trace = TRACER.start("startup", always_log=True, start=START_TIME)
+    # the configuration is loaded while importing the app modules
+    startup_trace.add_span("imports", IMPORT_TIME * 1000, START_TIME)
+    startup_trace.add_span("config_load", APPCFG.load_seconds * 1000)
+    startup_trace.add_span("ui_build", UI_TIME * 1000, START_TIME + IMPORT_TIME)
+    startup_trace.finish()
+
+    # clean up the upload indexes left by a previous run; only the app process owns that directory
+    APPCFG.remove_directory(APPCFG.custom_persist_directory)
+    INGEST_JOBS.start()
+    # the job status and query APIs are served by the same server as the UI
+    app = FastAPI()
+    app.include_router(create_jobs_router(INGEST_JOBS))
+    app.include_router(create_query_router())
+    app.include_router(create_metrics_router(TRACER))
+    app = gr.mount_gradio_app(app, demo, path="")
+    # load the vector store and tokenizer while the server starts, so the UI is usable right away
+    threading.Thread(target=ChatBot.warm_up, name="warm-up", daemon=True).start()
+    uvicorn.run(app, host=APPCFG.app_host, port=APPCFG.app_port)
\ No newline at end of file
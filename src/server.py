@@ -1,75 +1,253 @@
+"""
+This module serves the PDFs behind the "View PDF" links of the retrieved references.
+
+Files of the data directories are served by name (`/<file name>`) or by directory
+(`/<directory name>/<relative path>`), from a file name -> path index that is rebuilt when one of
+the directories changes, instead of probing the disk on every request. Every connection gets its
+own thread, so a slow download does not hold up the other users. Responses support HTTP Range
+requests (the browser's PDF viewer fetches only the parts of a large file it displays, e.g. for a
+`#page=` deep link), conditional GETs with ETag / Last-Modified (an already downloaded PDF is
+answered with 304 Not Modified), and are sent with `sendfile`, without copying the file through
+Python.
+
+Run from the repository root:
+    python src/server.py
+"""
+
+import email.utils
 import http.server
-import socketserver
-import yaml
+import mimetypes
 import os
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+import yaml
 from pyprojroot import here
 
 with open(here("configs/app_config.yml")) as cfg:
     app_config = yaml.load(cfg, Loader=yaml.FullLoader)
 
-PORT = app_config["server"]["port"]
-DIRECTORY1 = app_config["directories"]["data_directory"]
-DIRECTORY2 = app_config["directories"]["data_directory_2"]
+PORT = app_config["serve"]["port"]
+INDEX_REFRESH_SECONDS = app_config["serve"]["index_refresh_seconds"]
+CACHE_MAX_AGE = app_config["serve"]["cache_max_age"]
+DIRECTORY1 = str(here(app_config["directories"]["data_directory"]))
+DIRECTORY2 = str(here(app_config["directories"]["data_directory_2"]))
 
-class SingleDirectoryHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+
+class FileIndex:
     """
-    Custom HTTP request handler that serves files from a specific directory.
+    An index of the files of the served directories, by URL path.
+
+    Every file is indexed under `<directory name>/<relative path>` and under its file name; when
+    several directories hold a file of the same name, the first directory wins. The index is
+    rebuilt when the modification time of one of the indexed directories changes, which is
+    checked at most once every `refresh_seconds`.
 
-    This class extends SimpleHTTPRequestHandler to always serve files from DIRECTORY1.
+    Parameters:
+        directories (List[str]): The served directories, by priority.
+        refresh_seconds (float): The minimum time between two checks for changes.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, directories: List[str], refresh_seconds: float = 2.0) -> None:
+        self.directories = directories
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._paths: Dict[str, str] = {}
+        self._directory_mtimes: Dict[str, float] = {}
+        self._checked = 0.0
+        self.__build()
+
+    def __build(self) -> None:
+        """
+        Walk the directories and rebuild the index.
+        """
+        paths, directory_mtimes = {}, {}
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                try:
+                    directory_mtimes[root] = os.stat(root).st_mtime
+                except OSError:
+                    continue
+                for name in files:
+                    path = os.path.join(root, name)
+                    relative = os.path.relpath(path, directory).replace(os.sep, "/")
+                    paths.setdefault(f"{os.path.basename(os.path.normpath(directory))}/{relative}", path)
+                    paths.setdefault(name, path)
+        self._paths, self._directory_mtimes = paths, directory_mtimes
+        print(f"Indexed {len(set(paths.values()))} files")
+
+    def __changed(self) -> bool:
+        """
+        Check whether a directory was created, removed or modified since the index was built.
         """
-        Initializes the request handler to serve files from DIRECTORY1.
+        for directory in self.directories:
+            if os.path.isdir(directory) != (directory in self._directory_mtimes):
+                return True
+        for directory, mtime in self._directory_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def lookup(self, url_path: str) -> Optional[str]:
+        """
+        Returns the file served at a URL path.
 
         Args:
-            args: Extra positional arguments for the base class.
-            kwargs: Extra keyword arguments for the base class.
+            url_path (str): The decoded URL path, without query string.
+
+        Returns:
+            Optional[str]: The path of the file, or None if no file is served there.
         """
-        super().__init__(*args, directory=DIRECTORY1, **kwargs)
+        key = url_path.strip("/")
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked >= self.refresh_seconds:
+                self._checked = now
+                if self.__changed():
+                    self.__build()
+            return self._paths.get(key)
+
 
-class MultiDirectoryHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
+def parse_byte_range(header: str, size: int) -> Optional[Tuple[int, int]]:
     """
-    Custom HTTP request handler that serves files from two directories.
+    Parses a single-range `Range` header.
+
+    Args:
+        header (str): The value of the Range header, e.g. "bytes=0-1023", "bytes=1024-" or "bytes=-500".
+        size (int): The size of the file.
 
-    This handler extends SimpleHTTPRequestHandler and allows serving files from DIRECTORY1 or DIRECTORY2,
-    depending on the requested path.
+    Returns:
+        Optional[Tuple[int, int]]: The first and last byte of the range, or None if the header is
+        malformed or asks for several ranges, in which case the whole file is sent.
+
+    Raises:
+        ValueError: If the range is not satisfiable.
     """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, last = (part.strip() for part in ranges.partition("-")[::2])
+    if not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size:
+        raise ValueError("Range starts after the end of the file")
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
 
-    def translate_path(self, path):
+class PDFRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves the indexed files with Range, conditional GET and keep-alive support.
+    """
+
+    protocol_version = "HTTP/1.1"
+    index: FileIndex = None
+
+    def do_GET(self):
+        self.__serve(send_body=True)
+
+    def do_HEAD(self):
+        self.__serve(send_body=False)
+
+    def __serve(self, send_body: bool) -> None:
+        """
+        Send the file of the requested path, or the part of it asked for by a Range header.
         """
-        Converts the requested URL path to a real file system path.
+        path = self.index.lookup(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path))
+        if path is None:
+            self.send_error(404, "File not found")
+            return
+        try:
+            file = open(path, "rb")
+        except OSError:
+            self.send_error(404, "File not found")
+            return
 
-        Args:
-            path (str): The URL path requested by the client.
+        with file:
+            stat = os.fstat(file.fileno())
+            size, mtime = stat.st_size, int(stat.st_mtime)
+            etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+            if self.__not_modified(etag, mtime):
+                self.send_response(304)
+                self.__send_validators(etag, mtime)
+                self.end_headers()
+                return
 
-        Returns:
-            str: The full file system path to serve the requested file.
+            byte_range = None
+            range_header = self.headers.get("Range")
+            if range_header and self.__if_range_matches(etag, mtime):
+                try:
+                    byte_range = parse_byte_range(range_header, size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+            start, end = byte_range if byte_range is not None else (0, size - 1)
+            self.send_response(206 if byte_range is not None else 200)
+            self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            if byte_range is not None:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.__send_validators(etag, mtime)
+            self.end_headers()
+            if send_body and end >= start:
+                self.wfile.flush()
+                # zero-copy from the page cache to the socket where the OS supports it
+                self.connection.sendfile(file, offset=start, count=end - start + 1)
+
+    def __send_validators(self, etag: str, mtime: int) -> None:
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", email.utils.formatdate(mtime, usegmt=True))
+        self.send_header("Cache-Control", f"public, max-age={CACHE_MAX_AGE}")
+
+    def __not_modified(self, etag: str, mtime: int) -> bool:
+        """
+        Check the If-None-Match, or else the If-Modified-Since, header of the request.
+        """
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return self.__not_modified_since(self.headers.get("If-Modified-Since"), mtime)
+
+    def __if_range_matches(self, etag: str, mtime: int) -> bool:
         """
-        parts = path.split('/', 2)
-        if len(parts) > 1: 
-            frist_directory = parts[1]
-
-            # Check if the first directory matches any of your target directories
-            if frist_directory == os.path.basename(DIRECTORY1):
-                path = os.path.join(DIRECTORY1, *parts[2:]) 
-
-            elif frist_directory == os.path.basename(DIRECTORY2):
-                path = os.path.join(DIRECTORY2, *parts[2:]) 
-
-            else:
-                # If the first part of the path is not a directory, check both directories for the file
-                file_path1 = os.path.join(DIRECTORY1, frist_directory)
-                file_path2 = os.path.join(DIRECTORY2, frist_directory)
-
-                if os.path.isfile(file_path1):
-                    return file_path1
-                elif os.path.isfile(file_path2):
-                    return file_path2
-                
-        return super().translate_path(path)
-    
+        Check the If-Range header: a Range request for an outdated copy gets the whole file.
+        """
+        if_range = self.headers.get("If-Range")
+        if if_range is None:
+            return True
+        if if_range.strip().startswith(('"', "W/")):
+            return if_range.strip() == etag
+        return self.__not_modified_since(if_range, mtime)
+
+    @staticmethod
+    def __not_modified_since(date: Optional[str], mtime: int) -> bool:
+        if not date:
+            return False
+        try:
+            return mtime <= email.utils.parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+
 if __name__ == "__main__":
-    with socketserver.TCPServer(("",PORT), MultiDirectoryHTTPRequestHandler) as httpd:
+    PDFRequestHandler.index = FileIndex([DIRECTORY1, DIRECTORY2], INDEX_REFRESH_SECONDS)
+    with http.server.ThreadingHTTPServer(("", PORT), PDFRequestHandler) as httpd:
         print(f"Serving at port {PORT}")
-        httpd.serve_forever()
\ No newline at end of file
+        httpd.serve_forever()
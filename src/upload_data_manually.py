@@ -1,10 +1,13 @@
+import argparse
 import os
+from typing import Callable, Dict, Optional
 from utils.prepare_vectordb import PrepareVectorDB
-from utils.load_config import LoadConfig
+from utils.load_config import get_config
+from utils.ingest_jobs import IngestJobQueue, JobProgress
 
-CONFIG = LoadConfig()
+CONFIG = get_config()
 
-def upload_data_manually() -> None:
+def upload_data_manually(incremental: bool = False, progress_callback: Optional[Callable[[str, int], None]] = None) -> None:
 
     """
     Uploads data manually to the VectorDB.
@@ -12,9 +15,14 @@ def upload_data_manually() -> None:
     This function initializes a PrepareVectorDB instance with configuration parameters
     such as data_directory, persist_directory, embedding_model_engine, chunk_size,
     and chunk_overlap. It then checks if the VectorDB already exists in the specified
-    persist_directory. If not, it calls the prepare_and_save_vectordb method to
-    create and save the VectorDB. If the VectorDB already exists, a message is printed
-    indicating its presence.
+    persist_directory. If not, or if a previous build was interrupted, it calls the
+    prepare_and_save_vectordb method to create (or resume) and save the VectorDB. If the VectorDB already exists, a message is printed
+    indicating its presence, unless `incremental` is set: then the VectorDB is synchronized
+    with the data directory and only new, changed or removed files are processed.
+
+    Args:
+        incremental (bool): Sync an existing VectorDB instead of refusing to touch it.
+        progress_callback (Callable[[str, int], None], optional): Receives the progress of the build, see PrepareVectorDB.
 
     Returns:
         None
@@ -26,14 +34,47 @@ def upload_data_manually() -> None:
         embedding_model_engine=CONFIG.embedding_model_engine,
         chunk_size=CONFIG.chunk_size,
         chunk_overlap=CONFIG.chunk_overlap,
+        embedding_cache_directory=CONFIG.embedding_cache_directory,
+        embedding_cache_max_entries=CONFIG.embedding_cache_max_entries,
+        num_workers=CONFIG.num_workers,
+        batch_size=CONFIG.ingestion_batch_size,
+        max_memory_mb=CONFIG.ingestion_max_memory_mb,
+        embedding=CONFIG.embedding_model,
+        vectordb_backend=CONFIG.vectordb_backend,
+        vectordb_index=CONFIG.vectordb_index,
+        ivf_nlist=CONFIG.ivf_nlist,
+        progress_callback=progress_callback,
     )
 
-    if not len(os.listdir(CONFIG.persist_directory)) != 0:
+    if not len(os.listdir(CONFIG.persist_directory)) != 0 or PrepareVectorDB.has_unfinished_build(CONFIG.persist_directory):
         prepare_vectordb_instance.perpare_and_save_vectordb()
+    elif incremental:
+        prepare_vectordb_instance.sync_vectordb()
     else:
-        print(F"VectorDB alreadt exists in {CONFIG.persist_directory}")
+        print(F"VectorDB alreadt exists in {CONFIG.persist_directory}. Use --sync to update it incrementally.")
 
     return None
 
+def run_build_job(job: Dict, progress: JobProgress) -> None:
+    """
+    Runs a "build" ingestion job: builds or syncs the VectorDB from the data directory.
+
+    Args:
+        job (Dict): The job; its payload tells whether to sync incrementally.
+        progress (JobProgress): The progress counters of the job.
+    """
+    upload_data_manually(incremental=job["payload"]["incremental"], progress_callback=progress.add)
+
 if __name__ == "__main__":
-    upload_data_manually()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build or sync the VectorDB from the data directory.")
+    parser.add_argument("--sync", action="store_true",
+                        help="Incrementally sync an existing VectorDB with the data directory.")
+    parser.add_argument("--submit", action="store_true",
+                        help="Queue the build as an ingestion job run by the app instead of running it here.")
+    args = parser.parse_args()
+    if args.submit:
+        job_id = IngestJobQueue(CONFIG.ingest_jobs_path).submit("build", {"incremental": args.sync})
+        print(f"Submitted ingestion job {job_id}. Its progress is served at "
+              f"http://{CONFIG.app_host}:{CONFIG.app_port}/jobs/{job_id} while the app runs.")
+    else:
+        upload_data_manually(incremental=args.sync)
\ No newline at end of file
@@ -0,0 +1,227 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from typing import Iterable, List, Tuple
+import numpy as np
+
+_TOKEN_RE = re.compile(r"\w+(?:[.\-]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be been but by can for from had has have in into is it its of on or that the their "
+    "there these this those to was we were which will with".split())
+
+
+class BM25Index:
+    """
+    A persistent BM25 inverted index of the chunks of a vector store.
+
+    The index lives in an SQLite file next to the Chroma store. Every `add` call writes one
+    segment: for each term, the rows, term frequencies and chunk lengths of its postings are
+    packed into NumPy blobs, so scoring a term reads a few blobs instead of one SQL row per
+    posting. Removed chunks are dropped from the document table right away and their postings
+    are skipped at query time until `optimize` merges the segments of every term into one.
+    The document frequency of every term and the corpus totals are maintained incrementally.
+    Terms present in more than `max_df_ratio` of the chunks carry almost no signal and are
+    skipped at query time; a query made only of such terms is scored on the rarest one.
+
+    Tokens keep inner dots and hyphens ("3.2", "gpt-4", "d_model"), so the exact terms that
+    embeddings tend to blur (acronyms, numbers, section names) stay searchable.
+
+    Parameters:
+        persist_directory (str): The directory of the vector store.
+        k1 (float): The BM25 term frequency saturation.
+        b (float): The BM25 length normalization.
+        max_df_ratio (float): The document frequency ratio above which a query term is ignored.
+    """
+
+    FILE_NAME = "bm25.sqlite3"
+
+    def __init__(self, persist_directory: str, k1: float = 1.5, b: float = 0.75, max_df_ratio: float = 0.1) -> None:
+        os.makedirs(persist_directory, exist_ok=True)
+        self.k1 = k1
+        self.b = b
+        self.max_df_ratio = max_df_ratio
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(persist_directory, self.FILE_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS docs "
+                               "(row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, length INTEGER NOT NULL, terms TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, segment INTEGER NOT NULL, "
+                               "rows BLOB NOT NULL, tfs BLOB NOT NULL, lengths BLOB NOT NULL, "
+                               "PRIMARY KEY (term, segment)) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS totals (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.executemany("INSERT OR IGNORE INTO totals VALUES (?, 0)",
+                                   [("num_docs",), ("total_length",), ("segments",), ("removed",)])
+            # rows are never reused: postings of removed chunks may still point at old row numbers
+            self._conn.execute("INSERT OR IGNORE INTO totals SELECT 'next_row', COALESCE(MAX(row), 0) FROM docs")
+
+    @staticmethod
+    def exists(persist_directory: str) -> bool:
+        """
+        Check whether a vector store directory has a keyword index.
+        """
+        return os.path.exists(os.path.join(persist_directory, BM25Index.FILE_NAME))
+
+    @staticmethod
+    def tokenize(text: str) -> List[str]:
+        """
+        Split a text into lowercase index terms, without stopwords.
+
+        Args:
+            text (str): The text to tokenize.
+
+        Returns:
+            List[str]: The terms, in order of appearance.
+        """
+        return [token for token in _TOKEN_RE.findall(text.lower()) if token not in _STOPWORDS]
+
+    def add(self, ids: List[str], texts: List[str]) -> None:
+        """
+        Index chunks as a new segment, replacing chunks already indexed under the same IDs.
+
+        Args:
+            ids (List[str]): The chunk IDs, as stored in the vector store.
+            texts (List[str]): The chunk texts.
+        """
+        counts = [Counter(self.tokenize(text)) for text in texts]
+        with self._lock, self._conn:
+            self.__remove(ids)
+            postings, total_length = defaultdict(list), 0
+            first_row = self._conn.execute("SELECT value FROM totals WHERE name = 'next_row'").fetchone()[0] + 1
+            self.__update_totals(next_row=len(ids))
+            for row, (chunk_id, chunk_counts) in enumerate(zip(ids, counts), start=first_row):
+                length = sum(chunk_counts.values())
+                self._conn.execute("INSERT INTO docs (row, id, length, terms) VALUES (?, ?, ?, ?)",
+                                   (row, chunk_id, length, " ".join(chunk_counts)))
+                for term, tf in chunk_counts.items():
+                    postings[term].append((row, tf, length))
+                total_length += length
+            segment = self.__next_segment()
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?)",
+                                   [(term, segment) + self.__pack(entries) for term, entries in postings.items()])
+            self._conn.executemany("INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                                   [(term, len(entries)) for term, entries in postings.items()])
+            self.__update_totals(num_docs=len(ids), total_length=total_length)
+
+    @staticmethod
+    def __pack(entries: List[Tuple[int, int, int]]) -> Tuple[bytes, bytes, bytes]:
+        array = np.array(entries, dtype=np.int64).reshape(-1, 3)
+        return (array[:, 0].tobytes(), array[:, 1].astype(np.int32).tobytes(),
+                array[:, 2].astype(np.int32).tobytes())
+
+    def __next_segment(self) -> int:
+        self.__update_totals(segments=1)
+        return self._conn.execute("SELECT value FROM totals WHERE name = 'segments'").fetchone()[0]
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """
+        Remove chunks from the index in one transaction; unknown IDs are ignored.
+
+        Args:
+            ids (Iterable[str]): The chunk IDs to remove.
+        """
+        with self._lock, self._conn:
+            self.__remove(ids)
+
+    def __remove(self, ids: Iterable[str]) -> None:
+        removed, removed_length, df_updates = 0, 0, Counter()
+        for chunk_id in ids:
+            found = self._conn.execute("SELECT row, length, terms FROM docs WHERE id = ?", (chunk_id,)).fetchone()
+            if found is None:
+                continue
+            row, length, terms = found
+            df_updates.update(terms.split())
+            removed += 1
+            removed_length += length
+            self._conn.execute("DELETE FROM docs WHERE row = ?", (row,))
+        if not removed:
+            return
+        # the postings stay in their segments until `optimize`; queries skip rows missing from docs
+        self._conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?",
+                               [(count, term) for term, count in df_updates.items()])
+        self._conn.execute("DELETE FROM terms WHERE df <= 0")
+        self.__update_totals(num_docs=-removed, total_length=-removed_length, removed=removed)
+
+    def __update_totals(self, **deltas: int) -> None:
+        self._conn.executemany("UPDATE totals SET value = value + ? WHERE name = ?",
+                               [(delta, name) for name, delta in deltas.items()])
+
+    def optimize(self) -> None:
+        """
+        Merge the segments of every term into one and drop the postings of removed chunks.
+
+        Ingestion calls this at the end of a build or sync, so queries read one blob per term.
+        """
+        with self._lock, self._conn:
+            totals = dict(self._conn.execute("SELECT name, value FROM totals").fetchall())
+            if totals["segments"] <= 1 and not totals["removed"]:
+                return
+            alive = np.zeros(self._conn.execute("SELECT COALESCE(MAX(row), 0) + 1 FROM docs").fetchone()[0], dtype=bool)
+            alive[[row for row, in self._conn.execute("SELECT row FROM docs")]] = True
+            merged = []
+            for term, in self._conn.execute("SELECT term FROM terms").fetchall():
+                rows, tfs, lengths = self.__read_postings(term)
+                keep = alive[np.minimum(rows, len(alive) - 1)] & (rows < len(alive))
+                merged.append((term, 1, rows[keep].tobytes(), tfs[keep].tobytes(), lengths[keep].tobytes()))
+            self._conn.execute("DELETE FROM postings")
+            self._conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?)", merged)
+            self._conn.execute("UPDATE totals SET value = CASE name WHEN 'segments' THEN 1 ELSE 0 END "
+                               "WHERE name IN ('segments', 'removed')")
+
+    def __read_postings(self, term: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        blobs = self._conn.execute("SELECT rows, tfs, lengths FROM postings WHERE term = ?", (term,)).fetchall()
+        return tuple(np.concatenate([np.frombuffer(blob[i], dtype=dtype) for blob in blobs])
+                     for i, dtype in enumerate((np.int64, np.int32, np.int32)))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """
+        Return the `k` chunks with the highest BM25 score for a query.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of chunks to return.
+
+        Returns:
+            List[Tuple[str, float]]: The chunk IDs and their scores, best first.
+        """
+        terms = sorted(set(self.tokenize(query)))
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM totals").fetchall())
+            num_docs = totals["num_docs"]
+            if not terms or not num_docs:
+                return []
+            avg_length = totals["total_length"] / num_docs
+            placeholders = ",".join("?" * len(terms))
+            dfs = self._conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", terms).fetchall()
+
+            # common terms only count when the query has nothing more specific, and then only the rarest one
+            specific = [(term, df) for term, df in dfs if df <= self.max_df_ratio * num_docs]
+            rows, scores = [], []
+            for term, df in specific or sorted(dfs, key=lambda item: item[1])[:1]:
+                term_rows, tf, length = self.__read_postings(term)
+                idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+                rows.append(term_rows)
+                scores.append(idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_length)))
+            if not rows:
+                return []
+
+            # rows are dense integers, so scores are accumulated by row without sorting
+            row_scores = np.bincount(np.concatenate(rows), weights=np.concatenate(scores))
+            # removed chunks may still have postings: rank a few more candidates than needed
+            num_candidates = min(np.count_nonzero(row_scores), 2 * k + min(totals["removed"], 8 * k))
+            if num_candidates == 0:
+                return []
+            candidates = np.argpartition(-row_scores, num_candidates - 1)[:num_candidates]
+            candidates = [int(row) for row in candidates[np.argsort(-row_scores[candidates])]]
+            ids = dict(self._conn.execute(f"SELECT row, id FROM docs WHERE row IN ({','.join('?' * len(candidates))})",
+                                          candidates).fetchall())
+        return [(ids[row], float(row_scores[row])) for row in candidates if row in ids][:k]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT value FROM totals WHERE name = 'num_docs'").fetchone()[0]
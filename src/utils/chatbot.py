@@ -1,15 +1,37 @@
+import asyncio
 import gradio as gr
 import time 
-import openai
 import os
-from langchain_chroma import Chroma
-from typing import List, Tuple
-import re
-import ast
-import html
-from utils.load_config import LoadConfig
+import urllib.parse
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from utils.load_config import get_config
+from utils.vectordb_pool import VectorDBPool
+from utils.bm25_index import BM25Index
+from utils.vector_store import FanOutVectorStore, MemoryVectorStore, VectorStore
+from utils.session_indexes import SessionIndexes
+from utils.llm_client import get_async_openai_client
+from utils.utilities import normalize_text
+from utils.response_cache import CachedResponse, SemanticResponseCache
+from utils.embedding_cache import QueryEmbeddingCache
+from utils.retriever import Retriever
+from utils.reranker import get_reranker
+from utils.prompt_builder import PreparedPrompt, PromptBuilder
+from utils.tracing import Trace, Tracer
 
-APPCFG = LoadConfig()
+APPCFG = get_config()
+RETRIEVER = Retriever(APPCFG.embedding_model,
+                      QueryEmbeddingCache(APPCFG.embedding_model_engine, APPCFG.query_cache_max_entries),
+                      fetch_k=APPCFG.fetch_k, rrf_k=APPCFG.rrf_k,
+                      reranker=get_reranker(APPCFG.reranker, APPCFG.cross_encoder_model),
+                      mmr_lambda=APPCFG.mmr_lambda if APPCFG.mmr else None)
+PROMPT_BUILDER = PromptBuilder(APPCFG.llm_engine, APPCFG.prompt_token_budget, APPCFG.number_of_q_a_pairs)
+RESPONSE_CACHE = SemanticResponseCache(APPCFG.response_cache_similarity_threshold,
+                                       APPCFG.response_cache_ttl_seconds,
+                                       APPCFG.response_cache_max_entries)
+SESSION_INDEXES = SessionIndexes(APPCFG.session_ttl_seconds, APPCFG.session_max_memory_mb,
+                                 APPCFG.session_spill_mb, APPCFG.custom_persist_directory)
+TRACER = Tracer(APPCFG.tracing_enabled, APPCFG.trace_sample_rate, APPCFG.slow_trace_ms, APPCFG.trace_log_path,
+                APPCFG.trace_log_max_bytes, APPCFG.trace_log_backup_count)
 
 class ChatBot:
     """
@@ -22,65 +44,552 @@ class ChatBot:
 
     """
     @staticmethod
-    def respond(chatbot: List, message: str, data_type:str = "Preprocessed doc", temperature:float = 0.0) -> Tuple:
+    async def respond(chatbot: List, message: str, data_type:str = "Preprocessed doc", temperature:float = 0.0,
+                      request: gr.Request = None) -> AsyncIterator[Tuple]:
         """
         Generates a response to the user's question using document retrieval and a language model.
 
+        The completion is streamed: the chat history is yielded again every time a new piece of
+        the answer arrives, so Gradio renders it token by token. Retrieval runs in a worker thread
+        while the rest of the prompt is assembled. Stores with a keyword index are searched with
+        BM25 and vectors in parallel (hybrid search).
+
+        With a temperature of 0, answers go through the semantic response cache: a question
+        close enough to a previous one is answered from the cache, as long as the chunks that
+        answer was generated from have not been re-indexed since. Only the first question of a
+        conversation goes through the cache: the answer to a follow-up depends on the history.
+
+        Uploaded documents are searched in the in-memory index of the user's session, together
+        with the preprocessed documents if `session_search_preprocessed` is set. Those questions
+        are searched with vectors only and bypass the response cache.
+
+        Every turn is traced (see `utils.tracing`): the vector store open, query embedding,
+        response cache lookup, retrieval stages, reference formatting, prompt build and LLM call,
+        and the time Gradio spends rendering the streamed updates.
+
         Args:
             chatbot (List): The conversation history of the chatbot.
             message (str): The user's question.
             data_type (str): Type of document source ("Preprocessed doc" or "Upload doc: Process for RAG").
             temperature (float): Controls how creative the language model's response is (higher means more creative).
+            request (gr.Request): The request injected by Gradio, which identifies the session.
 
-        Returns:
+        Yields:
             Tuple: An empty string, the updated chat history, and any references from the retrieved documents.
         """
+        trace = TRACER.start("chat", data_type=data_type, temperature=temperature)
+        render_ms, updates = 0.0, 0
+        try:
+            async for update in ChatBot.__respond(chatbot, message, data_type, temperature, request, trace):
+                # the generator is suspended while Gradio sends the update to the browser
+                render_start = time.perf_counter()
+                yield update
+                render_ms += (time.perf_counter() - render_start) * 1000
+                updates += 1
+        except Exception as e:
+            trace.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            trace.add_span("gradio_render", render_ms, updates=updates)
+            trace.finish()
+
+    @staticmethod
+    async def __respond(chatbot: List, message: str, data_type: str, temperature: float, request: Optional[gr.Request],
+                        trace: Trace) -> AsyncIterator[Tuple]:
+        """
+        Generate the updates of a chat turn, see `respond`.
+        """
+        persist_directory = None
         if data_type == "Preprocessed doc":
             # directories
             if os.path.exists(APPCFG.persist_directory):
-                vectordb = Chroma(persist_directory=APPCFG.persist_directory,
-                                  embedding_function=APPCFG.embedding_model)
+                persist_directory = APPCFG.persist_directory
+                with trace.span("vectordb_open"):
+                    vectordb = ChatBot.open_vectordb(persist_directory)
             
             else:
                 chatbot.append(
                     (message, f"VectorDB does not exist. Please first execute the 'upload_data_manually.py' module."))
-                return "", chatbot, None
+                yield "", chatbot, None
+                return
             
         elif data_type == "Upload doc: Process for RAG":
-            if os.path.exists(APPCFG.custom_persist_directory):
-                vectordb = Chroma(persist_directory=APPCFG.persist_directory,
-                                  embedding_function=APPCFG.embedding_model)
-            else:
+            with trace.span("vectordb_open", session=True):
+                session_index = SESSION_INDEXES.get(request.session_hash) if request is not None else None
+                has_uploads = session_index is not None and session_index.count() > 0
+                if has_uploads:
+                    vectordb = ChatBot.open_session_vectordb(session_index)
+            if not has_uploads:
                 chatbot.append(
-                    (message, f"No file was uploaded. Please first upload your files using the 'upload' button.")
+                    (message, f"No file has been indexed yet. Please first upload your files using the 'upload' button "
+                              "and wait for the ingestion job to start.")
                 )
-                return "", chatbot, None
+                yield "", chatbot, None
+                return
             
 
-        docs = vectordb.similarity_search(message, k = APPCFG.k)
-        print(docs)
-        question = "# User new question:\n" + message
-        retrieved_content = ChatBot.clean_references(docs)
+        with trace.span("embedding") as span:
+            stats: Dict[str, int] = {}
+            query_vector = await RETRIEVER.aembed_query(message, stats)
+            span["cache_hit"] = stats["cache_hits"] > 0
+        # the uploads of a session are private to it, so their answers are not shared through the cache,
+        # nor are the answers to follow-up questions, which the cache key does not tell apart
+        use_cache = (APPCFG.response_cache_enabled and not temperature and persist_directory is not None
+                     and not chatbot)
+        if use_cache:
+            generation = VectorDBPool.generation(persist_directory)
+            with trace.span("response_cache") as span:
+                cached, _ = await ChatBot.__lookup_cache(vectordb, persist_directory, generation, query_vector)
+                span["cache_hit"] = cached is not None
+            if cached is not None:
+                trace.set(cached=True)
+                chatbot.append((message, cached.answer))
+                yield "", chatbot, cached.references
+                return
 
-        # Memory: Previous two Q&A Pairs
-        chat_history = f"Chat history:\n {str(chatbot[-APPCFG.number_of_q_a_pairs:])}\n\n"
-        prompt = f"{chat_history}{retrieved_content}{question}"
+        keyword_index = None
+        if APPCFG.hybrid_search and persist_directory is not None:
+            keyword_index = VectorDBPool.get_keyword_index(persist_directory)
+        timings: Dict[str, float] = {}
+        retrieval_start = time.perf_counter()
+        retrieval = asyncio.create_task(RETRIEVER.asearch(vectordb, keyword_index, message, query_vector, APPCFG.k,
+                                                          timings=timings))
+        # the question and the history do not depend on the retrieved chunks: render them, count
+        # their tokens and set up the client while the search runs
+        try:
+            with trace.span("prompt_prepare"):
+                prepared = await asyncio.to_thread(PROMPT_BUILDER.prepare, message, chatbot)
+            client = get_async_openai_client()
+        except BaseException:
+            retrieval.cancel()
+            raise
+        docs = await retrieval
+        trace.add_span("retrieval", (time.perf_counter() - retrieval_start) * 1000, retrieval_start, k=APPCFG.k)
+        ChatBot.__trace_timings(trace, timings)
+        prompt, retrieved_content = ChatBot.__build_prompt(message, docs, chatbot, trace, prepared)
 
-        print("========================")
-        print(prompt)
-        response = openai.chat.completions.create(
+        chatbot.append((message, ""))
+        llm_start = time.perf_counter()
+        stream = await client.chat.completions.create(
             model=APPCFG.llm_engine,
-            messages=[
-                {"role": "system", "content": APPCFG.llm_system_role},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,) 
-        
-        chatbot.append((message, response.choices[0].message.content))
-        time.sleep(2)
-
-        return "", chatbot, retrieved_content
+            messages=ChatBot.__messages(prompt),
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True})
+
+        answer = ""
+        time_to_first_token = None
+        usage = None
+        async for chunk in stream:
+            # the last chunk carries the token usage of the completion, without choices
+            usage = getattr(chunk, "usage", None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - llm_start
+            answer += delta
+            chatbot[-1] = (message, answer)
+            yield "", chatbot, retrieved_content
+
+        if time_to_first_token is None:
+            # the model returned an empty completion
+            yield "", chatbot, retrieved_content
+        elif use_cache:
+            ChatBot.__cache_answer(query_vector, persist_directory, generation, answer, retrieved_content, docs)
+        # the wall time of the stream, which includes the time Gradio takes to render its updates
+        trace.add_span("llm", (time.perf_counter() - llm_start) * 1000, llm_start, model=APPCFG.llm_engine,
+                       time_to_first_token_ms=time_to_first_token * 1000 if time_to_first_token is not None else None,
+                       **ChatBot.__usage(usage))
+
+    @staticmethod
+    async def answer(question: str, history: List[Tuple] = (), temperature: float = 0.0) -> Dict:
+        """
+        Answers a question about the preprocessed documents, for the HTTP API.
+
+        Same pipeline as `respond` (response cache, hybrid retrieval, reranking, prompt budget),
+        without streaming and without the Gradio chat history format. A question asked with a
+        history bypasses the response cache, since its answer depends on the conversation.
+
+        Args:
+            question (str): The question.
+            history (List[Tuple]): Previous (question, answer) pairs of the conversation.
+            temperature (float): The temperature of the language model.
+
+        Returns:
+            Dict: The question, answer, sources (file, page, chunk ID and content), whether the
+            answer came from the response cache, and the latency of each stage in milliseconds.
+
+        Raises:
+            FileNotFoundError: If the preprocessed VectorDB was not built.
+        """
+        start_time = time.perf_counter()
+        trace = TRACER.start("api.query", temperature=temperature)
+        try:
+            vectordb, keyword_index = ChatBot.__open_preprocessed()
+            timings: Dict[str, float] = {}
+            stats: Dict[str, int] = {}
+            query_vector = await ChatBot.__timed(timings, "embedding", RETRIEVER.aembed_query(question, stats))
+
+            # a follow-up question is answered from the conversation, which the cache key ignores
+            use_cache = APPCFG.response_cache_enabled and not temperature and not history
+            generation = VectorDBPool.generation(APPCFG.persist_directory)
+            cached = None
+            if use_cache:
+                cached, cached_docs = await ChatBot.__lookup_cache(vectordb, APPCFG.persist_directory, generation,
+                                                                   query_vector)
+                trace.set(cached=cached is not None)
+            if cached is not None:
+                result = ChatBot.__result(question, cached.answer, cached_docs, True, timings, start_time)
+            else:
+                docs = await ChatBot.__timed(timings, "retrieval", RETRIEVER.asearch(
+                    vectordb, keyword_index, question, query_vector, APPCFG.k, timings=timings))
+                result = await ChatBot.__generate(question, list(history), temperature, query_vector, docs, generation,
+                                                  use_cache, timings, start_time, trace)
+            ChatBot.__trace_timings(trace, timings, embedding={"cache_hit": stats["cache_hits"] > 0})
+            return result
+        except Exception as e:
+            trace.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            trace.finish()
+
+    @staticmethod
+    async def answer_batch(questions: List[str], temperature: float = 0.0) -> List[Dict]:
+        """
+        Answers many questions about the preprocessed documents, pipelining retrieval and generation.
+
+        The questions are processed in micro-batches of `api_batch_size`: each micro-batch is
+        embedded in one request and searched with one vector store query, and the completions of
+        its questions are started right away, so they run while the next micro-batch is being
+        retrieved. At most `api_max_concurrency` completions run at once. A question whose
+        completion fails gets an "error" instead of an answer; the others are still answered.
+
+        Args:
+            questions (List[str]): The questions.
+            temperature (float): The temperature of the language model.
+
+        Returns:
+            List[Dict]: One result per question, in order, as returned by `answer`.
+
+        Raises:
+            FileNotFoundError: If the preprocessed VectorDB was not built.
+        """
+        start_time = time.perf_counter()
+        batch_trace = TRACER.start("api.batch", questions=len(questions), temperature=temperature)
+        completions = []
+        try:
+            vectordb, keyword_index = ChatBot.__open_preprocessed()
+            use_cache = APPCFG.response_cache_enabled and not temperature
+            generation = VectorDBPool.generation(APPCFG.persist_directory)
+            semaphore = asyncio.Semaphore(APPCFG.api_max_concurrency)
+            results: List = [None] * len(questions)
+
+            async def generate(i: int, query_vector: List[float], docs: List, timings: Dict[str, float]) -> None:
+                async with semaphore:
+                    # the retrieval of the micro-batch is traced once, by the batch trace
+                    trace = TRACER.start("api.batch_query", temperature=temperature)
+                    try:
+                        results[i] = await ChatBot.__generate(questions[i], [], temperature, query_vector, docs,
+                                                              generation, use_cache, timings, start_time, trace)
+                    except Exception as e:
+                        trace.set(error=f"{type(e).__name__}: {e}")
+                        results[i] = {"question": questions[i], "error": f"{type(e).__name__}: {e}"}
+                    finally:
+                        trace.finish()
+
+            for offset in range(0, len(questions), APPCFG.api_batch_size):
+                batch = range(offset, min(offset + APPCFG.api_batch_size, len(questions)))
+                timings: Dict[str, float] = {}
+                stats: Dict[str, int] = {}
+                vectors = await ChatBot.__timed(timings, "embedding",
+                                                RETRIEVER.aembed_queries([questions[i] for i in batch], stats))
+                misses = []
+                for i, query_vector in zip(batch, vectors):
+                    cached, cached_docs = (await ChatBot.__lookup_cache(vectordb, APPCFG.persist_directory, generation,
+                                                                        query_vector) if use_cache else (None, None))
+                    if cached is not None:
+                        results[i] = ChatBot.__result(questions[i], cached.answer, cached_docs, True, dict(timings),
+                                                      start_time)
+                    else:
+                        misses.append((i, query_vector))
+                if misses:
+                    # the query embeddings are cached, so the batch search does not request them again
+                    retrieved = await ChatBot.__timed(timings, "retrieval", RETRIEVER.abatch_search(
+                        vectordb, [questions[i] for i, _ in misses], APPCFG.k, keyword_index, timings=timings))
+                    for (i, query_vector), docs in zip(misses, retrieved):
+                        completions.append(asyncio.create_task(generate(i, query_vector, docs, dict(timings))))
+                ChatBot.__trace_timings(batch_trace, timings, embedding={"queries": len(batch), **stats},
+                                        retrieval={"queries": len(misses)})
+
+            await asyncio.gather(*completions)
+            batch_trace.set(cached=sum(1 for result in results if result.get("cached")),
+                            errors=sum(1 for result in results if "error" in result))
+            return results
+        except BaseException as e:
+            batch_trace.set(error=f"{type(e).__name__}: {e}")
+            # the completions already started would otherwise run on for nothing
+            for completion in completions:
+                completion.cancel()
+            raise
+        finally:
+            batch_trace.finish()
+
+    @staticmethod
+    async def __generate(question: str, history: List[Tuple], temperature: float, query_vector: List[float],
+                         docs: List, generation: int, use_cache: bool, timings: Dict[str, float],
+                         start_time: float, trace: Trace) -> Dict:
+        """
+        Generate the answer of a question from its retrieved chunks and cache it, for the HTTP API.
+        """
+        prompt, retrieved_content = ChatBot.__build_prompt(question, docs, history, trace)
+        llm_start = time.perf_counter()
+        completion = await ChatBot.__timed(timings, "generation", get_async_openai_client().chat.completions.create(
+            model=APPCFG.llm_engine, messages=ChatBot.__messages(prompt), temperature=temperature))
+        trace.add_span("llm", (time.perf_counter() - llm_start) * 1000, llm_start, model=APPCFG.llm_engine,
+                       **ChatBot.__usage(getattr(completion, "usage", None)))
+        answer = completion.choices[0].message.content or ""
+        if use_cache and answer:
+            ChatBot.__cache_answer(query_vector, APPCFG.persist_directory, generation, answer, retrieved_content, docs)
+        return ChatBot.__result(question, answer, docs, False, timings, start_time)
+
+    @staticmethod
+    def __result(question: str, answer: str, docs: List, cached: bool, timings: Dict[str, float],
+                 start_time: float) -> Dict:
+        """
+        Build the JSON result of a question for the HTTP API.
+        """
+        timings["total"] = (time.perf_counter() - start_time) * 1000
+        return {"question": question,
+                "answer": answer,
+                "sources": [{"source": os.path.basename(doc.metadata.get("source", "")),
+                             "page": doc.metadata.get("page"),
+                             "chunk_id": doc.id,
+                             "content": doc.page_content} for doc in docs],
+                "cached": cached,
+                "timings": {stage: round(ms, 1) for stage, ms in timings.items()}}
+
+    @staticmethod
+    async def __timed(timings: Dict[str, float], stage: str, awaitable):
+        """
+        Await a stage and add its latency to the timings, in milliseconds.
+        """
+        start = time.perf_counter()
+        result = await awaitable
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+        return result
+
+    @staticmethod
+    def __trace_timings(trace: Trace, timings: Dict[str, float], **attributes: Dict) -> None:
+        """
+        Add the stage latencies collected by the retriever or `__timed` to a trace, as spans with
+        the attributes given by stage name. The generation is traced with its token counts by
+        `__generate` and the total by the trace itself, so they are left out.
+        """
+        for stage, ms in timings.items():
+            if stage not in ("generation", "total"):
+                trace.add_span(stage, ms, **attributes.get(stage, {}))
+
+    @staticmethod
+    def __usage(usage) -> Dict[str, int]:
+        """
+        Return the token counts of an OpenAI completion usage, which may be missing.
+        """
+        if usage is None:
+            return {}
+        return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+    @staticmethod
+    def __open_preprocessed() -> Tuple[VectorStore, Optional[BM25Index]]:
+        """
+        Open the preprocessed VectorDB and its keyword index (if hybrid search is enabled).
+        """
+        if not ChatBot.__has_preprocessed_vectordb():
+            raise FileNotFoundError("VectorDB does not exist. Please first execute the 'upload_data_manually.py' module.")
+        keyword_index = VectorDBPool.get_keyword_index(APPCFG.persist_directory) if APPCFG.hybrid_search else None
+        return ChatBot.open_vectordb(APPCFG.persist_directory), keyword_index
+
+    @staticmethod
+    def __build_prompt(message: str, docs: List, history: List[Tuple], trace: Trace,
+                       prepared: Optional[PreparedPrompt] = None) -> Tuple[str, str]:
+        """
+        Build the prompt of a question from its retrieved chunks, and the references shown with the answer.
+        """
+        with trace.span("format_references", chunks=len(docs)) as span:
+            context_docs = ChatBot.merge_overlapping_chunks(docs) if APPCFG.merge_overlapping_chunks else docs
+            references = ChatBot.format_references(context_docs)
+            span["spans"] = len(context_docs)
+        with trace.span("prompt_build") as span:
+            prompt = PROMPT_BUILDER.build(message, references, history, prepared, stats=span)
+        return prompt, "".join(references)
+
+    @staticmethod
+    def __messages(prompt: str) -> List[Dict]:
+        return [{"role": "system", "content": APPCFG.llm_system_role},
+                {"role": "user", "content": prompt}]
+
+    @staticmethod
+    async def __lookup_cache(vectordb: VectorStore, persist_directory: str, generation: int,
+                             query_vector: List[float]) -> Tuple[Optional[CachedResponse], Optional[List]]:
+        """
+        Return the cached answer of a similar question if its chunks are still indexed unchanged,
+        together with those chunks; a stale entry is discarded.
+        """
+        cached = RESPONSE_CACHE.lookup(query_vector, persist_directory, generation)
+        if cached is None:
+            return None, None
+        docs = await asyncio.to_thread(ChatBot.__fresh_chunks, vectordb, cached)
+        if docs is None:
+            RESPONSE_CACHE.discard(cached)
+            return None, None
+        return cached, docs
+
+    @staticmethod
+    def __cache_answer(query_vector: List[float], persist_directory: str, generation: int, answer: str,
+                       references: str, docs: List) -> None:
+        RESPONSE_CACHE.put(query_vector, CachedResponse(
+            namespace=persist_directory, answer=answer, references=references,
+            chunk_ids=[doc.id for doc in docs], fingerprint=SemanticResponseCache.fingerprint(docs),
+            generation=generation, created=time.time()))
+
+    @staticmethod
+    def open_vectordb(persist_directory: str):
+        """
+        Returns the shared handle of a vector store, opened with the configured backend.
+
+        Args:
+            persist_directory (str): The directory of the vector store.
+
+        Returns:
+            VectorStore: The shared vector store handle.
+        """
+        return VectorDBPool.get(persist_directory, APPCFG.embedding_model, APPCFG.vectordb_backend,
+                                index=APPCFG.vectordb_index, ivf_nlist=APPCFG.ivf_nlist, ivf_nprobe=APPCFG.ivf_nprobe)
+
+    @staticmethod
+    def open_session_vectordb(session_index: MemoryVectorStore) -> VectorStore:
+        """
+        Returns the vector store to search for questions about the uploads of a session.
+
+        Args:
+            session_index (MemoryVectorStore): The upload index of the session.
+
+        Returns:
+            VectorStore: The session index, fanned out with the preprocessed documents when they are built
+            and `session_search_preprocessed` is set.
+        """
+        if APPCFG.session_search_preprocessed and ChatBot.__has_preprocessed_vectordb():
+            return FanOutVectorStore([session_index, ChatBot.open_vectordb(APPCFG.persist_directory)])
+        return session_index
+
+    @staticmethod
+    def __has_preprocessed_vectordb() -> bool:
+        """
+        Check that the preprocessed VectorDB was built, without creating it.
+        """
+        return os.path.isdir(APPCFG.persist_directory) and bool(os.listdir(APPCFG.persist_directory))
+
+    @staticmethod
+    def warm_up() -> None:
+        """
+        Loads what the first chat turn would otherwise wait for: the preprocessed vector store and
+        its keyword index (and the libraries behind them), and the tokenizer of the chat model.
+
+        The app calls this once the UI is up. A persist directory that was never built is left
+        untouched, so it is not mistaken for a built VectorDB afterwards.
+        """
+        trace = TRACER.start("warm_up", always_log=True)
+        if ChatBot.__has_preprocessed_vectordb():
+            with trace.span("vectordb_open"):
+                ChatBot.open_vectordb(APPCFG.persist_directory)
+            if APPCFG.hybrid_search:
+                with trace.span("keyword_index_open"):
+                    VectorDBPool.get_keyword_index(APPCFG.persist_directory)
+        with trace.span("tokenizer_load"):
+            PROMPT_BUILDER.load()
+        trace.finish()
+        print(f"Warm-up: {trace.duration_ms / 1000:.2f}s")
+
+    @staticmethod
+    def retrieve_batch(messages: List[str], persist_directory: str = None) -> List[List]:
+        """
+        Retrieves the chunks of many questions at once, e.g. for offline evaluation.
+
+        All the questions are embedded in as few requests as possible and searched with a
+        single collection query, instead of one `respond` call per question.
+
+        Args:
+            messages (List[str]): The questions.
+            persist_directory (str): The vector store to search; defaults to the preprocessed documents.
+
+        Returns:
+            List[List]: The `k` retrieved documents of each question.
+        """
+        persist_directory = persist_directory or APPCFG.persist_directory
+        vectordb = ChatBot.open_vectordb(persist_directory)
+        keyword_index = VectorDBPool.get_keyword_index(persist_directory) if APPCFG.hybrid_search else None
+        return RETRIEVER.batch_search(vectordb, messages, APPCFG.k, keyword_index)
+
+    @staticmethod
+    def merge_overlapping_chunks(docs: List) -> List:
+        """
+        Merges overlapping neighbour chunks into single spans.
+
+        Args:
+            docs (List): The retrieved chunks, best first.
+
+        Returns:
+            List: The deduplicated spans, best first.
+        """
+        return Retriever.merge_overlapping(docs)
+
+    @staticmethod
+    def __fresh_chunks(vectordb, cached: CachedResponse) -> Optional[List]:
+        """
+        Return the chunks a cached answer was generated from, or None if they were re-indexed since.
+        """
+        try:
+            docs = vectordb.get_by_ids(cached.chunk_ids)
+        except Exception:
+            return None
+        if SemanticResponseCache.fingerprint(docs) != cached.fingerprint:
+            return None
+        by_id = {doc.id: doc for doc in docs}
+        return [by_id[chunk_id] for chunk_id in cached.chunk_ids if chunk_id in by_id]
     
+    @staticmethod
+    def format_references(documents: List) -> List[str]:
+        """
+        Formats each retrieved document as a Markdown reference.
+
+        The content and metadata are read directly from each document. Chunks ingested by
+        PrepareVectorDB are already normalized; older chunks are normalized here. The "View PDF"
+        link opens the PDF server (`server.py`) at the page of the chunk.
+
+        Args:
+            documents (List): List of retrieved document results.
+
+        Returns:
+            List[str]: One formatted reference per document, in order.
+        """
+
+        server_url = f"http://localhost:{APPCFG.serve_port}"
+        markdown_documents = []
+        for counter, doc in enumerate(documents, start=1):
+            content = doc.page_content if doc.metadata.get("normalized") else normalize_text(doc.page_content)
+            source = os.path.basename(doc.metadata.get("source", ""))
+            pdf_url = f"{server_url}/{urllib.parse.quote(source)}"
+            if isinstance(doc.metadata.get("page"), int):
+                # PDF pages are 0-based in the metadata and 1-based in the viewer's #page= fragment
+                pdf_url += f"#page={doc.metadata['page'] + 1}"
+
+            # Each reference ends with two newlines so they can be concatenated
+            markdown_documents.append(
+                f"# Retrieved content {counter}:\n{content}\n\n"
+                f"Source: {source} | Page number: {doc.metadata.get('page', '')} | [View PDF]({pdf_url})\n\n")
+
+        return markdown_documents
+
     @staticmethod
     def clean_references(documents: List) -> str:
         """
@@ -92,55 +601,4 @@ class ChatBot:
         Returns:
             str: A cleaned and nicely formatted string of references.
         """
-
-        server_url = "http://localhost:8000"
-        documents = [str(x)+"\n\n" for x in documents]
-        markdown_documents = ""
-        counter = 1
-        for doc in documents:
-            print(f"Raw doc:\n{doc}\n")  # Debug, remove later
-            match = re.match(r"page_content=(.*?)(?:\s+)metadata=(\{.*\})", doc, re.DOTALL)
-    
-            if not match:
-                print(f"[WARN] Regex did not match for document:\n{doc}\n")
-                continue  # or handle as needed
-            
-            content, metadata = match.groups()
-            metadata_dict = ast.literal_eval(metadata)
-
-            # Decode newlines and other escape sequences
-            content = bytes(content, "utf-8").decode("unicode_escape")
-
-            # Replace escaped newlines with actual newlines
-            content = re.sub(r'\\n', '\n', content)
-            # Remove special tokens
-            content = re.sub(r'\s*<EOS>\s*<pad>\s*', ' ', content)
-            # Remove any remaining multiple spaces
-            content = re.sub(r'\s+', ' ', content).strip()
-
-            # Decode HTML entities
-            content = html.unescape(content)
-
-            # Replace incorrect unicode characters with correct ones
-            content = content.encode('latin1').decode('utf-8', 'ignore')
-
-            # Remove or replace special characters and mathematical symbols
-            # This step may need to be customized based on the specific symbols in your documents
-            content = re.sub(r'â', '-', content)
-            content = re.sub(r'â', '∈', content)
-            content = re.sub(r'Ã', '×', content)
-            content = re.sub(r'ï¬', 'fi', content)
-            content = re.sub(r'â', '∈', content)
-            content = re.sub(r'Â·', '·', content)
-            content = re.sub(r'ï¬', 'fl', content)
-
-            pdf_url = f"{server_url}/{os.path.basename(metadata_dict['source'])}"
-
-            # Append cleaned content to the markdown string with two newlines between documents
-            markdown_documents += f"# Retrieved content {counter}:\n" + content + "\n\n" + \
-                f"Source: {os.path.basename(metadata_dict['source'])}" + " | " +\
-                f"Page number: {str(metadata_dict['page'])}" + " | " +\
-                f"[View PDF]({pdf_url})" "\n\n"
-            counter += 1
-
-        return markdown_documents
\ No newline at end of file
+        return "".join(ChatBot.format_references(documents))
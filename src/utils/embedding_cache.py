@@ -0,0 +1,416 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of document embeddings.
+
+    Vectors are stored in a memory-mapped float32 matrix (`vectors.f32`) and looked up through
+    an SQLite index (`index.sqlite3`) that maps the hash of (embedding model, chunk text) to a row
+    of the matrix. The cache holds at most `max_entries` vectors; when it is full the least
+    recently used rows are evicted and reused.
+
+    The cache may be filled by several ingestion jobs at once, and by `upload_data_manually.py`
+    next to the app. Rows are reserved in a write transaction of the index before their vector
+    is written, and published once it is; a lookup drops the hits whose row was evicted while it
+    copied them. The index is written once per batch. Use `shared` to get the instance of a
+    directory, so all the jobs of a process share it.
+
+    Parameters:
+        cache_directory (str): The directory holding the matrix and the index.
+        model (str): The embedding model name, part of every cache key.
+        max_entries (int): The maximum number of cached vectors.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    INDEX_FILE = "index.sqlite3"
+    LEGACY_INDEX_FILE = "index.json"
+    # rows reserved by a writer that never published them (it died) are reused after this delay
+    STALE_RESERVATION_SECONDS = 600
+
+    _instances: Dict[Tuple[str, str], "EmbeddingCache"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, cache_directory: str, model: str, max_entries: int) -> None:
+        self.cache_directory = cache_directory
+        self.model = model
+        self.max_entries = int(max_entries)
+        self.dim = None
+        self._vectors = None
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_directory, exist_ok=True)
+        # transactions are explicit: BEGIN IMMEDIATE takes the write lock before rows are allocated
+        self._conn = sqlite3.connect(os.path.join(self.cache_directory, self.INDEX_FILE), check_same_thread=False,
+                                     timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, "
+                           "last_used REAL NOT NULL, ready INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_by_last_used ON entries (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)")
+        with self.__transaction():
+            self.__import_legacy_index()
+            self.__resize()
+
+    @classmethod
+    def shared(cls, cache_directory: str, model: str, max_entries: int) -> "EmbeddingCache":
+        """
+        Returns the process-wide cache of a directory and model, opening it on first use.
+
+        Args:
+            cache_directory (str): The directory holding the matrix and the index.
+            model (str): The embedding model name.
+            max_entries (int): The maximum number of cached vectors.
+
+        Returns:
+            EmbeddingCache: The shared cache.
+        """
+        key = (os.path.normcase(os.path.abspath(cache_directory)), model)
+        with cls._instances_lock:
+            cache = cls._instances.get(key)
+            if cache is None:
+                cache = cls._instances[key] = cls(cache_directory, model, max_entries)
+            return cache
+
+    def __vectors_path(self) -> str:
+        return os.path.join(self.cache_directory, self.VECTORS_FILE)
+
+    @contextmanager
+    def __transaction(self) -> Iterator[None]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def __meta(self, name: str) -> Optional[int]:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def __set_meta(self, name: str, value: int) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)", (name, value))
+
+    def __map(self) -> bool:
+        """
+        Map the vector matrix if the cache has one (it may have been created by another process).
+        """
+        if self._vectors is None:
+            dim = self.__meta("dim")
+            if dim is None or not os.path.exists(self.__vectors_path()):
+                return False
+            self.dim = dim
+            self._vectors = np.memmap(self.__vectors_path(), dtype=np.float32, mode="r+",
+                                      shape=(self.__meta("capacity"), dim))
+        return True
+
+    def __create_matrix(self, dim: int) -> None:
+        """
+        Create an empty matrix of `max_entries` rows; call it inside a write transaction.
+        """
+        self._vectors = None
+        self.dim = dim
+        self._conn.execute("DELETE FROM entries")
+        self._conn.execute("DELETE FROM free_rows")
+        for name, value in (("dim", dim), ("capacity", self.max_entries), ("next_row", 0)):
+            self.__set_meta(name, value)
+        self._vectors = np.memmap(self.__vectors_path(), dtype=np.float32, mode="w+", shape=(self.max_entries, dim))
+
+    def __import_legacy_index(self) -> None:
+        """
+        Import the entries of a cache written with the former JSON index, then remove it.
+        """
+        legacy_path = os.path.join(self.cache_directory, self.LEGACY_INDEX_FILE)
+        if not os.path.exists(legacy_path):
+            return
+        with open(legacy_path) as f:
+            index = json.load(f)
+        if self.__meta("dim") is None and index.get("dim") and os.path.exists(self.__vectors_path()):
+            entries = index.get("entries", {})
+            used = {row for row, _ in entries.values()}
+            next_row = max(used) + 1 if used else 0
+            for name, value in (("dim", index["dim"]), ("capacity", index.get("capacity", self.max_entries)),
+                                ("next_row", next_row)):
+                self.__set_meta(name, value)
+            self._conn.executemany("INSERT INTO entries (key, row, last_used, ready) VALUES (?, ?, ?, 1)",
+                                   [(key, row, last_used) for key, (row, last_used) in entries.items()])
+            self._conn.executemany("INSERT INTO free_rows (row) VALUES (?)",
+                                   [(row,) for row in range(next_row) if row not in used])
+        os.remove(legacy_path)
+
+    def __resize(self) -> None:
+        """
+        Compact the most recent entries into a new matrix if max_entries changed in the config.
+        """
+        if not self.__map() or self._vectors.shape[0] == self.max_entries:
+            return
+        kept = self._conn.execute("SELECT key, row, last_used FROM entries WHERE ready = 1 "
+                                  "ORDER BY last_used DESC LIMIT ?", (self.max_entries,)).fetchall()
+        rows = np.array(self._vectors[[row for _, row, _ in kept]], dtype=np.float32).reshape(-1, self.dim)
+        self.__create_matrix(self.dim)
+        self._vectors[:len(kept)] = rows
+        self._conn.executemany("INSERT INTO entries (key, row, last_used, ready) VALUES (?, ?, ?, 1)",
+                               [(key, new_row, last_used) for new_row, (key, _, last_used) in enumerate(kept)])
+        self.__set_meta("next_row", len(kept))
+
+    def __rows(self, keys: List[str], ready_only: bool = True) -> Dict[str, int]:
+        """
+        Look up the matrix rows of the given keys.
+        """
+        rows = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            query = (f"SELECT key, row FROM entries WHERE key IN ({', '.join('?' * len(batch))})"
+                     + (" AND ready = 1" if ready_only else ""))
+            rows.update(self._conn.execute(query, batch).fetchall())
+        return rows
+
+    def __reserve(self, keys: List[str]) -> Dict[str, int]:
+        """
+        Reserve a row for each key that is not cached yet, evicting the least recently used
+        entries if the cache is full; call it inside a write transaction.
+        """
+        existing = self.__rows(keys, ready_only=False)
+        missing = [key for key in dict.fromkeys(keys) if key not in existing]
+        if not missing:
+            return {}
+        rows = [row for (row,) in self._conn.execute("SELECT row FROM free_rows LIMIT ?", (len(missing),))]
+        self._conn.executemany("DELETE FROM free_rows WHERE row = ?", [(row,) for row in rows])
+        next_row = self.__meta("next_row")
+        fresh = min(len(missing) - len(rows), self.max_entries - next_row)
+        rows += range(next_row, next_row + fresh)
+        self.__set_meta("next_row", next_row + fresh)
+        if len(rows) < len(missing):
+            now = time.time()
+            oldest = self._conn.execute(
+                "SELECT key, row FROM entries WHERE ready = 1 OR last_used < ? ORDER BY last_used LIMIT ?",
+                (now - self.STALE_RESERVATION_SECONDS, max(len(missing) - len(rows), self.max_entries // 20))).fetchall()
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in oldest])
+            evicted = [row for _, row in oldest]
+            needed = len(missing) - len(rows)
+            rows += evicted[:needed]
+            self._conn.executemany("INSERT INTO free_rows (row) VALUES (?)", [(row,) for row in evicted[needed:]])
+        reserved = dict(zip(missing, rows))
+        now = time.time()
+        self._conn.executemany("INSERT INTO entries (key, row, last_used, ready) VALUES (?, ?, ?, 0)",
+                               [(key, row, now) for key, row in reserved.items()])
+        return reserved
+
+    def key(self, text: str) -> str:
+        """
+        Returns the cache key of a chunk text for this embedding model.
+
+        Args:
+            text (str): The chunk text.
+
+        Returns:
+            str: The hex digest identifying (model, text).
+        """
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up the embeddings of the given texts.
+
+        Args:
+            texts (List[str]): The chunk texts.
+
+        Returns:
+            List[Optional[List[float]]]: The cached vector of each text, or None on a miss.
+        """
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            if not self.__map():
+                return [None] * len(texts)
+            rows = self.__rows(list(dict.fromkeys(keys)))
+            vectors = {key: self._vectors[row].tolist() for key, row in rows.items()}
+            # an entry evicted by another process is freed before its row is rewritten
+            current = self.__rows(list(vectors))
+            vectors = {key: vector for key, vector in vectors.items() if current.get(key) == rows[key]}
+            if vectors:
+                with self.__transaction():
+                    now = time.time()
+                    self._conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                           [(now, key) for key in vectors])
+        return [vectors.get(key) for key in keys]
+
+    def put(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Stores embeddings in the cache, evicting the least recently used entries if it is full.
+
+        Texts that are already cached are skipped.
+
+        Args:
+            texts (List[str]): The chunk texts.
+            vectors (List[List[float]]): The embedding of each text.
+        """
+        if not texts:
+            return
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            with self.__transaction():
+                if not self.__map():
+                    self.__create_matrix(len(vectors[0]))
+                reserved = self.__reserve(keys)
+            if not reserved:
+                return
+            for key, vector in zip(keys, vectors):
+                if key in reserved:
+                    self._vectors[reserved[key]] = vector
+            with self.__transaction():
+                now = time.time()
+                self._conn.executemany("UPDATE entries SET ready = 1, last_used = ? WHERE key = ? AND row = ?",
+                                       [(now, key, row) for key, row in reserved.items()])
+
+    def save(self) -> None:
+        """
+        Flushes the vector matrix to disk; the index is committed by every `put`.
+        """
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries WHERE ready = 1").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves document embeddings from an `EmbeddingCache`.
+
+    Only the cache misses of an `embed_documents` call are sent to the wrapped embedding model.
+    Query embeddings are passed through unchanged.
+
+    Parameters:
+        embedding (Embeddings): The wrapped embedding model.
+        cache (EmbeddingCache): The cache to read from and write to.
+    """
+
+    def __init__(self, embedding: Embeddings, cache: EmbeddingCache) -> None:
+        self.embedding = embedding
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.cache.get(texts)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+
+        self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+        self.misses += sum(len(positions) for positions in missing.values())
+        if missing:
+            missing_texts = list(missing)
+            new_vectors = self.embedding.embed_documents(missing_texts)
+            self.cache.put(missing_texts, new_vectors)
+            self.cache.save()
+            for text, vector in zip(missing_texts, new_vectors):
+                for i in missing[text]:
+                    vectors[i] = list(vector)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding.embed_query(text)
+
+
+class QueryEmbeddingCache:
+    """
+    An in-process LRU cache of query embeddings.
+
+    Queries are keyed by the embedding model and their normalized text (NFKC, whitespace
+    collapsed), so exact repeats and retries after an error skip the embedding request. Vectors
+    live in a preallocated float32 matrix of `max_entries` rows; the least recently used row is
+    reused when the cache is full.
+
+    Parameters:
+        model (str): The embedding model name, part of every cache key.
+        max_entries (int): The maximum number of cached vectors.
+    """
+
+    def __init__(self, model: str, max_entries: int) -> None:
+        self.model = model
+        self.max_entries = int(max_entries)
+        self._vectors = None
+        self._rows: "OrderedDict[str, int]" = OrderedDict()  # key -> row, in LRU order
+        self._free_rows = list(range(self.max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        """
+        Returns the cache key of a query for this embedding model.
+
+        Args:
+            text (str): The query text.
+
+        Returns:
+            str: The model name and the normalized query text.
+        """
+        return f"{self.model}\0{' '.join(unicodedata.normalize('NFKC', text).split())}"
+
+    def get(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up the embeddings of the given queries.
+
+        Args:
+            texts (List[str]): The query texts.
+
+        Returns:
+            List[Optional[List[float]]]: The cached vector of each query, or None on a miss.
+        """
+        results = []
+        with self._lock:
+            for text in texts:
+                key = self.key(text)
+                row = self._rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self._rows.move_to_end(key)
+                results.append(self._vectors[row].tolist())
+        return results
+
+    def put(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Stores query embeddings, evicting the least recently used entries if the cache is full.
+
+        Args:
+            texts (List[str]): The query texts.
+            vectors (List[List[float]]): The embedding of each query.
+        """
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                key = self.key(text)
+                row = self._rows.get(key)
+                if row is None:
+                    if not self._free_rows:
+                        _, oldest_row = self._rows.popitem(last=False)
+                        self._free_rows.append(oldest_row)
+                    row = self._free_rows.pop()
+                    self._rows[key] = row
+                self._rows.move_to_end(key)
+                self._vectors[row] = vector
+
+    def __len__(self) -> int:
+        return len(self._rows)
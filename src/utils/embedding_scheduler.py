@@ -0,0 +1,235 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from typing import List, Optional, Tuple
+import openai
+import tiktoken
+from langchain_core.embeddings import Embeddings
+from utils.token_counter import count_tokens_batch, get_encoding
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket used to pace requests (or tokens) per minute.
+
+    The refill rate adapts to the server: `penalize` halves it and blocks the bucket for the
+    server's retry-after delay, `reward` slowly brings it back towards the configured rate.
+
+    Parameters:
+        per_minute (float): The configured capacity and refill rate per minute.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.max_rate = self.capacity / 60.0
+        self.rate = self.max_rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def __reserve(self, amount: float) -> float:
+        """
+        Take `amount` tokens (going into debt if needed) and return how long to wait for them.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # a single request larger than the bucket would otherwise wait forever
+            self.tokens -= min(amount, self.capacity)
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.blocked_until - now)
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        wait = self.__reserve(amount)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def acquire_sync(self, amount: float = 1.0) -> None:
+        wait = self.__reserve(amount)
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, retry_after: float) -> None:
+        with self._lock:
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def reward(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * 1.05)
+
+
+class AsyncBatchEmbeddings(Embeddings):
+    """
+    OpenAI embeddings with token-budgeted batching, bounded concurrency and rate-limit pacing.
+
+    Texts are packed into batches of at most `batch_token_budget` tokens (counted with tiktoken)
+    and up to `max_concurrency` batches are in flight at once. Requests and tokens are paced by
+    token buckets; a 429 response blocks the buckets for the server's retry-after delay and
+    halves their rate. It is a drop-in `Embeddings` implementation, so it can be passed wherever
+    an embedding function is accepted (Chroma, PrepareVectorDB, CachedEmbeddings...).
+
+    Parameters:
+        model (str): The embedding model name.
+        api_key (str, optional): The API key; read from OPENAI_API_KEY if None.
+        base_url (str, optional): The API base URL, e.g. a local fake server for tests.
+        batch_token_budget (int): The maximum number of tokens per request.
+        max_batch_size (int): The maximum number of texts per request.
+        max_concurrency (int): The maximum number of requests in flight.
+        requests_per_minute (int): The request rate limit.
+        tokens_per_minute (int): The token rate limit.
+        max_retries (int): The number of retries of a failed or rate-limited request.
+    """
+
+    def __init__(self, model: str, api_key: Optional[str] = None, base_url: Optional[str] = None,
+                 batch_token_budget: int = 8000, max_batch_size: int = 2048, max_concurrency: int = 4,
+                 requests_per_minute: int = 3000, tokens_per_minute: int = 1000000, max_retries: int = 6) -> None:
+        self.model = model
+        self.api_key = api_key
+        self.base_url = base_url
+        self.batch_token_budget = batch_token_budget
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._sync_client = None
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncOpenAI
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        # loaded on first use: building the encoder reads (and may download) its BPE ranks
+        return get_encoding(self.model)
+
+    def __client(self) -> openai.OpenAI:
+        if self._sync_client is None:
+            self._sync_client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+        return self._sync_client
+
+    def __async_client(self) -> openai.AsyncOpenAI:
+        # httpx connection pools are bound to the event loop they were created in
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self._async_clients[loop] = client
+        return client
+
+    def batches(self, texts: List[str]) -> List[Tuple[List[int], int]]:
+        """
+        Packs texts into batches that fit the token budget, keeping the input order.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[Tuple[List[int], int]]: The indices of the texts of every batch and its token count.
+        """
+        token_counts = count_tokens_batch(texts, self.model)
+        batches, current, current_tokens = [], [], 0
+        for i, num_tokens in enumerate(token_counts):
+            if current and (current_tokens + num_tokens > self.batch_token_budget or len(current) >= self.max_batch_size):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += num_tokens
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    def __retry_delay(self, error: Exception, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after is not None:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    async def __embed_batch(self, texts: List[str], num_tokens: int, semaphore: asyncio.Semaphore) -> List[List[float]]:
+        async with semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(num_tokens)
+                try:
+                    response = await self.__async_client().embeddings.create(model=self.model, input=texts)
+                    self.request_bucket.reward()
+                    self.token_bucket.reward()
+                    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+                except openai.RateLimitError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    delay = self.__retry_delay(e, attempt)
+                    self.request_bucket.penalize(delay)
+                    self.token_bucket.penalize(delay)
+                except (openai.APIConnectionError, openai.InternalServerError) as e:
+                    if attempt == self.max_retries:
+                        raise
+                    await asyncio.sleep(self.__retry_delay(e, attempt))
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batches = self.batches(texts)
+        results = await asyncio.gather(*[
+            self.__embed_batch([texts[i] for i in indices], num_tokens, semaphore) for indices, num_tokens in batches])
+        vectors = [None] * len(texts)
+        for (indices, _), batch_vectors in zip(batches, results):
+            for i, vector in zip(indices, batch_vectors):
+                vectors[i] = vector
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.__run_and_close(texts))
+        # called from inside an event loop: run the scheduler on its own loop in a helper thread
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(vectors=asyncio.run(self.__run_and_close(texts))))
+        thread.start()
+        thread.join()
+        return result["vectors"]
+
+    async def __run_and_close(self, texts: List[str]) -> List[List[float]]:
+        try:
+            return await self.aembed_documents(texts)
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        """
+        Closes the async client of the running event loop, before a short-lived loop ends.
+        """
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def embed_query(self, text: str) -> List[float]:
+        # a single query goes through the pooled sync client instead of spinning up an event loop
+        num_tokens = len(self.encoding.encode_ordinary(text))
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire_sync(1)
+            self.token_bucket.acquire_sync(num_tokens)
+            try:
+                return self.__client().embeddings.create(model=self.model, input=[text]).data[0].embedding
+            except openai.RateLimitError as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.__retry_delay(e, attempt)
+                self.request_bucket.penalize(delay)
+                self.token_bucket.penalize(delay)
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.__retry_delay(e, attempt))
@@ -0,0 +1,318 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Dict, List, Optional
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside a running job once its cancellation was requested.
+    """
+
+
+class JobProgress:
+    """
+    The progress counters of a running job.
+
+    Handlers report their progress with `add`; the counters are written to the job table at most
+    every `flush_seconds`, and each write also checks whether the job was cancelled, in which
+    case `add` raises `JobCancelled` so the handler stops at its next progress report.
+
+    Parameters:
+        queue (IngestJobQueue): The queue running the job.
+        job_id (str): The ID of the job.
+        flush_seconds (float): The minimum time between two writes of the counters.
+    """
+
+    def __init__(self, queue: "IngestJobQueue", job_id: str, flush_seconds: float = 0.5) -> None:
+        self.queue = queue
+        self.job_id = job_id
+        self.flush_seconds = flush_seconds
+        self.counters = {stage: 0 for stage in IngestJobQueue.STAGES}
+        self._last_flush = 0.0
+
+    def add(self, stage: str, count: int = 1) -> None:
+        """
+        Adds to a progress counter.
+
+        Args:
+            stage (str): One of `IngestJobQueue.STAGES`.
+            count (int): The amount to add.
+
+        Raises:
+            JobCancelled: If the job was cancelled.
+        """
+        self.counters[stage] += count
+        if time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self, check_cancelled: bool = True) -> None:
+        """
+        Writes the counters to the job table.
+
+        Args:
+            check_cancelled (bool): Whether to raise if the job was cancelled; the final write of a
+                job that finished its work does not.
+
+        Raises:
+            JobCancelled: If the job was cancelled.
+        """
+        self._last_flush = time.monotonic()
+        if self.queue._save_progress(self.job_id, self.counters) and check_cancelled:
+            raise JobCancelled(self.job_id)
+
+
+class IngestJobQueue:
+    """
+    A persistent queue of ingestion jobs, stored in SQLite and run by background worker threads.
+
+    A job is a `kind` (e.g. "session" for files uploaded in the UI, "build" for the data
+    directory), a JSON payload and, for uploads, the session it belongs to. Jobs are run by the
+    handler registered for their kind, outside of any request, so a long build is not tied to
+    a browser connection. Workers also poll the table, so jobs submitted by another process (e.g.
+    `upload_data_manually.py --submit`) are picked up by the app.
+
+    Each job records its status ("queued", "running", "done", "failed" or "cancelled") and the
+    progress counters of `STAGES`. On `start`, jobs left running by a previous process are
+    queued again if they are resumable (not tied to a session), and failed otherwise. A single
+    process should run the workers of a given job table.
+
+    Parameters:
+        db_path (str): The path of the SQLite job table.
+        num_workers (int): The number of jobs run at once.
+        poll_seconds (float): How often idle workers look for jobs submitted by other processes.
+    """
+
+    STAGES = ("files_loaded", "pages_parsed", "chunks_created", "chunks_embedded", "vectors_written")
+    ACTIVE = ("queued", "running")
+
+    def __init__(self, db_path: str, num_workers: int = 1, poll_seconds: float = 2.0) -> None:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.num_workers = num_workers
+        self.poll_seconds = poll_seconds
+        self.handlers: Dict[str, Callable[[Dict, JobProgress], None]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers: List[threading.Thread] = []
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        counters = ", ".join(f"{stage} INTEGER NOT NULL DEFAULT 0" for stage in self.STAGES)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                           "payload TEXT NOT NULL, session_id TEXT, status TEXT NOT NULL, "
+                           "cancel_requested INTEGER NOT NULL DEFAULT 0, error TEXT, files_total INTEGER, "
+                           f"created REAL NOT NULL, started REAL, finished REAL, {counters})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (status, created)")
+        self._conn.commit()
+
+    def register(self, kind: str, handler: Callable[[Dict, JobProgress], None]) -> None:
+        """
+        Registers the handler that runs the jobs of a kind.
+
+        Args:
+            kind (str): The job kind.
+            handler (Callable): Called with the job (as returned by `get`) and its `JobProgress`.
+        """
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, payload: Dict, session_id: Optional[str] = None, files_total: Optional[int] = None) -> str:
+        """
+        Adds a job to the queue.
+
+        Args:
+            kind (str): The job kind.
+            payload (Dict): The JSON-serializable arguments of the handler.
+            session_id (str, optional): The session the job belongs to.
+            files_total (int, optional): The number of files of the job, if known.
+
+        Returns:
+            str: The ID of the job.
+        """
+        job_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._conn.execute("INSERT INTO jobs (id, kind, payload, session_id, status, files_total, created) "
+                               "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                               (job_id, kind, json.dumps(payload), session_id, files_total, time.time()))
+            self._conn.commit()
+        self._wakeup.set()
+        print(f"Ingestion job {job_id} ({kind}) queued")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """
+        Returns a job with its status and progress counters.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            Optional[Dict]: The job, or None if it does not exist.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return self.__to_dict(row) if row is not None else None
+
+    def list(self, session_id: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        """
+        Returns the most recent jobs, newest first.
+
+        Args:
+            session_id (str, optional): Only return the jobs of this session.
+            limit (int): The maximum number of jobs.
+
+        Returns:
+            List[Dict]: The jobs.
+        """
+        with self._lock:
+            if session_id is None:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY created DESC LIMIT ?", (limit,))
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs WHERE session_id = ? ORDER BY created DESC LIMIT ?",
+                                          (session_id, limit))
+            return [self.__to_dict(row) for row in rows.fetchall()]
+
+    def has_active_jobs(self, session_id: str) -> bool:
+        """
+        Tells whether a session has queued or running jobs.
+
+        Args:
+            session_id (str): The session ID.
+
+        Returns:
+            bool: True if a job of the session is not finished yet.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM jobs WHERE session_id = ? AND status IN ('queued', 'running') "
+                                     "LIMIT 1", (session_id,)).fetchone()
+            return row is not None
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels a job: a queued job is cancelled right away, a running one at its next progress report.
+
+        Args:
+            job_id (str): The ID of the job.
+
+        Returns:
+            bool: True if the job was still queued or running.
+        """
+        with self._lock:
+            queued = self._conn.execute("UPDATE jobs SET status = 'cancelled', finished = ? "
+                                        "WHERE id = ? AND status = 'queued'", (time.time(), job_id)).rowcount
+            running = self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'",
+                                         (job_id,)).rowcount
+            self._conn.commit()
+        return bool(queued or running)
+
+    def start(self) -> None:
+        """
+        Recovers the jobs interrupted by a previous process and starts the worker threads.
+        """
+        with self._lock:
+            requeued = self._conn.execute("UPDATE jobs SET status = 'queued', started = NULL "
+                                          "WHERE status = 'running' AND session_id IS NULL AND cancel_requested = 0").rowcount
+            failed = self._conn.execute("UPDATE jobs SET status = 'failed', finished = ?, "
+                                        "error = 'Interrupted by a restart of the app' WHERE status = 'running'",
+                                        (time.time(),)).rowcount
+            self._conn.commit()
+        if requeued or failed:
+            print(f"Ingestion jobs interrupted by a restart: {requeued} queued again, {failed} failed")
+        for i in range(self.num_workers - len(self._workers)):
+            worker = threading.Thread(target=self.__work, name=f"ingest-job-worker-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @staticmethod
+    def __to_dict(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def __claim(self) -> Optional[Dict]:
+        """
+        Mark the oldest queued job with a registered handler as running and return it.
+        """
+        if not self.handlers:
+            return None
+        kinds = list(self.handlers)
+        with self._lock:
+            row = self._conn.execute(f"SELECT * FROM jobs WHERE status = 'queued' AND kind IN ({', '.join('?' * len(kinds))}) "
+                                     "ORDER BY created LIMIT 1", kinds).fetchone()
+            if row is None:
+                return None
+            job = self.__to_dict(row)
+            claimed = self._conn.execute("UPDATE jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                                         (time.time(), job["id"])).rowcount
+            self._conn.commit()
+            return job if claimed else None
+
+    def _save_progress(self, job_id: str, counters: Dict[str, int]) -> bool:
+        """
+        Write the progress counters of a running job and return whether it was cancelled.
+        """
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {', '.join(f'{stage} = ?' for stage in self.STAGES)} WHERE id = ?",
+                               [counters[stage] for stage in self.STAGES] + [job_id])
+            self._conn.commit()
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return bool(row and row[0])
+
+    def __finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?",
+                               (status, error, time.time(), job_id))
+            self._conn.commit()
+
+    def __work(self) -> None:
+        while True:
+            job = self.__claim()
+            if job is None:
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+                continue
+
+            start = time.perf_counter()
+            progress = JobProgress(self, job["id"])
+            print(f"Ingestion job {job['id']} ({job['kind']}) started")
+            try:
+                self.handlers[job["kind"]](job, progress)
+                # the work is done: a cancellation requested now comes too late to undo it
+                progress.flush(check_cancelled=False)
+            except JobCancelled:
+                self.__finish(job["id"], "cancelled")
+                print(f"Ingestion job {job['id']} cancelled after {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                traceback.print_exc()
+                self.__finish(job["id"], "failed", f"{type(e).__name__}: {e}")
+                print(f"Ingestion job {job['id']} failed after {time.perf_counter() - start:.1f}s")
+            else:
+                self.__finish(job["id"], "done")
+                print(f"Ingestion job {job['id']} done in {time.perf_counter() - start:.1f}s")
+
+    @staticmethod
+    def format_markdown(jobs: List[Dict]) -> str:
+        """
+        Formats jobs as a Markdown table for the UI.
+
+        Args:
+            jobs (List[Dict]): The jobs, as returned by `list`.
+
+        Returns:
+            str: The Markdown table, or a note if there are no jobs.
+        """
+        if not jobs:
+            return "No ingestion jobs."
+        lines = ["| Job | Status | Files | Pages parsed | Chunks embedded | Vectors written |",
+                 "|---|---|---|---|---|---|"]
+        for job in jobs:
+            files = f"{job['files_loaded']}/{job['files_total']}" if job["files_total"] else str(job["files_loaded"])
+            chunks = f"{job['chunks_embedded']}/{job['chunks_created']}"
+            status = job["status"] + (f": {job['error']}" if job["error"] else "")
+            lines.append(f"| {job['id']} | {status} | {files} | {job['pages_parsed']} | {chunks} | "
+                         f"{job['vectors_written']} |")
+        return "\n".join(lines)
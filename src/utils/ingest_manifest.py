@@ -0,0 +1,120 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Tuple
+
+
+class IngestManifest:
+    """
+    A per-file manifest of what has been ingested into a persist directory.
+
+    For every ingested file the manifest keeps its size, modification time, content hash and the
+    IDs of the chunks it produced. It is stored as `ingest_manifest.json` inside the persist
+    directory and lets an incremental sync skip unchanged files and delete the chunks of changed
+    or removed ones. Since a file is only recorded once all its chunks are written, the manifest
+    also serves as the checkpoint of a build; `in_progress` is set while a build is running.
+
+    Parameters:
+        persist_directory (str): The persist directory of the VectorDB.
+    """
+
+    FILE_NAME = "ingest_manifest.json"
+
+    def __init__(self, persist_directory: str) -> None:
+        self.path = os.path.join(persist_directory, self.FILE_NAME)
+        self.files: Dict[str, Dict] = {}
+        self.in_progress = False
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            self.files = manifest.get("files", {})
+            self.in_progress = manifest.get("in_progress", False)
+
+    @staticmethod
+    def file_hash(file_path: str) -> str:
+        """
+        Returns the sha256 hex digest of a file's content.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            str: The content hash.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def diff(self, file_paths: List[str]) -> Tuple[List[str], List[str], List[str], List[str]]:
+        """
+        Compares the given files with the manifest.
+
+        Files whose size and modification time match the manifest are not read at all. Files
+        whose stat changed are hashed, and only count as changed if the content hash differs.
+
+        Args:
+            file_paths (List[str]): The files currently present in the data directory.
+
+        Returns:
+            Tuple: Lists of new, changed, unchanged and removed file paths.
+        """
+        new, changed, unchanged = [], [], []
+        for file_path in file_paths:
+            entry = self.files.get(file_path)
+            if entry is None:
+                new.append(file_path)
+                continue
+            stat = os.stat(file_path)
+            if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+                unchanged.append(file_path)
+            elif self.file_hash(file_path) == entry["sha256"]:
+                # touched but identical: refresh the stat so the next sync skips the hash
+                entry["size"], entry["mtime"] = stat.st_size, stat.st_mtime
+                unchanged.append(file_path)
+            else:
+                changed.append(file_path)
+        present = set(file_paths)
+        removed = [file_path for file_path in self.files if file_path not in present]
+        return new, changed, unchanged, removed
+
+    def record(self, file_path: str, chunk_ids: List[str], sha256: str = None) -> None:
+        """
+        Records (or replaces) the manifest entry of an ingested file.
+
+        Args:
+            file_path (str): The path of the ingested file.
+            chunk_ids (List[str]): The IDs of the chunks written for the file.
+            sha256 (str, optional): The content hash, computed if not given.
+        """
+        stat = os.stat(file_path)
+        self.files[file_path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": sha256 or self.file_hash(file_path),
+            "chunk_ids": chunk_ids,
+        }
+
+    def forget(self, file_path: str) -> List[str]:
+        """
+        Removes a file from the manifest.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            List[str]: The chunk IDs that were recorded for the file.
+        """
+        entry = self.files.pop(file_path, None)
+        return entry["chunk_ids"] if entry else []
+
+    def save(self) -> None:
+        """
+        Atomically writes the manifest to the persist directory.
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"in_progress": self.in_progress, "files": self.files}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,84 @@
+import asyncio
+import json
+from typing import Dict, List, Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from utils.ingest_jobs import IngestJobQueue
+
+# fields that identify a session or the files of its uploads, never sent over the API
+PRIVATE_FIELDS = ("session_id", "payload")
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+
+def create_jobs_router(queue: IngestJobQueue, stream_interval: float = 1.0) -> APIRouter:
+    """
+    Builds the HTTP status API of the ingestion jobs, to be mounted next to the Gradio app.
+
+    Routes:
+        GET /jobs?session_id=&limit=: The most recent jobs of a session, newest first.
+        GET /jobs/{job_id}: The status and progress counters of a job.
+        GET /jobs/{job_id}/events: A server-sent event with the job every `stream_interval` seconds
+            while it changes, until it is finished.
+        POST /jobs/{job_id}/cancel?session_id=: Cancels a queued or running job of a session.
+
+    The session ID keys the private upload index of a session, so it is never returned, nor are
+    the uploaded file paths. Listing and cancelling the jobs of a session takes its ID; listing
+    all the jobs and cancelling jobs that belong to no session (`upload_data_manually.py --submit`)
+    is only allowed from the local host.
+
+    Args:
+        queue (IngestJobQueue): The job queue.
+        stream_interval (float): The polling interval of the event stream, in seconds.
+
+    Returns:
+        APIRouter: The router.
+    """
+    router = APIRouter(prefix="/jobs", tags=["ingestion jobs"])
+
+    def public(job: Dict) -> Dict:
+        return {key: value for key, value in job.items() if key not in PRIVATE_FIELDS}
+
+    def get_or_404(job_id: str) -> Dict:
+        job = queue.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+        return job
+
+    def check_session(request: Request, session_id: Optional[str], job_session_id: Optional[str] = None) -> None:
+        if session_id is None or session_id != job_session_id:
+            if request.client is None or request.client.host not in LOCAL_HOSTS:
+                raise HTTPException(status_code=403, detail="Not a job of this session.")
+
+    @router.get("")
+    def list_jobs(request: Request, session_id: Optional[str] = None, limit: int = 20) -> List[Dict]:
+        if session_id is None:
+            check_session(request, None)
+        return [public(job) for job in queue.list(session_id=session_id, limit=limit)]
+
+    @router.get("/{job_id}")
+    def get_job(job_id: str) -> Dict:
+        return public(get_or_404(job_id))
+
+    @router.get("/{job_id}/events")
+    async def job_events(job_id: str) -> StreamingResponse:
+        get_or_404(job_id)
+
+        async def events():
+            last = None
+            while True:
+                job = public(await asyncio.to_thread(queue.get, job_id))
+                if job != last:
+                    yield f"data: {json.dumps(job)}\n\n"
+                    last = job
+                if job["status"] not in IngestJobQueue.ACTIVE:
+                    return
+                await asyncio.sleep(stream_interval)
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @router.post("/{job_id}/cancel")
+    def cancel_job(request: Request, job_id: str, session_id: Optional[str] = None) -> Dict:
+        check_session(request, session_id, get_or_404(job_id)["session_id"])
+        return {"id": job_id, "cancelled": queue.cancel(job_id)}
+
+    return router
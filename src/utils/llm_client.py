@@ -0,0 +1,35 @@
+import asyncio
+import weakref
+import openai
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """
+    Return the AsyncOpenAI client of the running event loop, creating it on first use.
+
+    The client keeps a pool of HTTP connections, which is bound to the event loop it was created
+    in, so one client is shared by all the requests handled by the same loop.
+
+    Returns:
+        openai.AsyncOpenAI: The shared async client.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = openai.AsyncOpenAI(api_key=openai.api_key)
+        _async_clients[loop] = client
+    return client
+
+
+async def close_async_openai_client() -> None:
+    """
+    Close the AsyncOpenAI client of the running event loop, if it has one.
+
+    Call it before a loop started with `asyncio.run` ends, so that the connection pool of its
+    client is not left open.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
@@ -1,13 +1,39 @@
 import openai 
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import yaml
-from langchain_openai import OpenAIEmbeddings
+from utils.embedding_scheduler import AsyncBatchEmbeddings
 from pyprojroot.here import here
 import shutil
 
 load_dotenv()
 
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config() -> "LoadConfig":
+    """
+    Return the configuration shared by the whole process, loading it on first use.
+
+    The app modules all import this instance instead of creating their own `LoadConfig`, so the
+    YAML file is parsed and the OpenAI credentials are set once per process. The upload directory
+    is cleaned up by the app at startup, not here: other processes (`upload_data_manually.py
+    --submit`, `api_server.py`) load the configuration while the app memory-maps session indexes
+    there.
+
+    Returns:
+        LoadConfig: The shared configuration.
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = LoadConfig()
+        return _config
+
+
 class LoadConfig:
     """
     A class for loading configuration settings and managing directories.
@@ -16,6 +42,7 @@ class LoadConfig:
     including language model (LLM) configurations, retrieval configurations, summarizer
     configurations, and memory configurations. It also sets up OpenAI API credentials
     and performs directory-related operations such as creating and removing directories.
+    Use `get_config()` to share one instance across modules.
 
     
     ...
@@ -24,32 +51,128 @@ class LoadConfig:
             The language model engine specified in the configuration.
         llm_system_role : str
             The role of the language model system specified in the configuration.
+        prompt_token_budget : int
+            The maximum number of tokens of a chat prompt (question, retrieved content and history).
         persist_directory : str
             The path to the persist directory where data is stored.
         custom_persist_directory : str
-            The path to the custom persist directory.
-        embedding_model : OpenAIEmbeddings
-            An instance of the OpenAIEmbeddings class for language model embeddings.
+            The directory where large upload indexes of the chat sessions are memory-mapped.
+        embedding_cache_directory : str
+            The path to the on-disk embedding cache.
+        summary_cache_path : str
+            The path to the SQLite summary cache.
+        ingest_jobs_path : str
+            The path to the SQLite table of the ingestion jobs.
+        embedding_model : AsyncBatchEmbeddings
+            The batched, rate-limit-aware embedding client shared by retrieval and ingestion.
         data_directory : str
             The path to the data directory.
+        vectordb_backend : str
+            The vector store backend: "chroma" or "numpy".
+        vectordb_index : str
+            The index of the numpy backend: "flat" (exact) or "ivf" (approximate).
+        ivf_nlist : int
+            The number of IVF clusters of the numpy backend; 0 to size it from the store.
+        ivf_nprobe : int
+            The number of IVF clusters scored per query by the numpy backend.
         k : int
             The value of 'k' specified in the retrieval configuration.
+        query_cache_max_entries : int
+            The maximum number of query embeddings kept in memory.
+        hybrid_search : bool
+            Whether stores with a BM25 keyword index are searched with BM25 and vectors.
+        fetch_k : int
+            The number of candidates fetched from each search before fusion and reranking.
+        rrf_k : int
+            The rank offset of reciprocal rank fusion.
+        reranker : str
+            The reranker of the candidates: "cosine", "cross-encoder" or "none".
+        cross_encoder_model : str
+            The model of the cross-encoder reranker.
+        mmr : bool
+            Whether the final chunks are picked by maximal marginal relevance.
+        mmr_lambda : float
+            The relevance weight of maximal marginal relevance (1 ignores diversity).
+        merge_overlapping_chunks : bool
+            Whether overlapping neighbour chunks are merged into one span before prompt assembly.
+        response_cache_enabled : bool
+            Whether answers at temperature 0 go through the semantic response cache.
+        response_cache_similarity_threshold : float
+            The minimum cosine similarity between questions for a response cache hit.
+        response_cache_ttl_seconds : float
+            The maximum age of a cached answer.
+        response_cache_max_entries : int
+            The maximum number of cached answers.
         embedding_model_engine : str
             The engine specified in the embedding model configuration.
+        embedding_cache_max_entries : int
+            The maximum number of vectors kept in the embedding cache.
         chunk_size : int
             The chunk size specified in the splitter configuration.
         chunk_overlap : int
             The chunk overlap specified in the splitter configuration.
+        num_workers : int
+            The number of processes used to load and chunk documents during ingestion.
+        ingestion_batch_size : int
+            The number of chunks embedded and written to the VectorDB at once during ingestion.
+        ingestion_max_memory_mb : int
+            The resident memory ceiling of the ingestion pipeline.
         max_final_token : int
             The maximum number of final tokens specified in the summarizer configuration.
         token_threshold : float
             The token threshold specified in the summarizer configuration.
         summarizer_llm_system_role : str
             The role of the summarizer language model system specified in the configuration.
+        summarizer_max_concurrency : int
+            The maximum number of page summaries requested at once.
+        reduce_token_budget : int
+            The maximum number of tokens sent to a single reduce call of the summarizer.
+        summary_cache_max_entries : int
+            The maximum number of page (and of final) summaries kept in the summary cache.
         temperature : float
             The temperature specified in the LLM configuration.
         number_of_q_a_pairs : int
             The number of question-answer pairs specified in the memory configuration.
+        session_ttl_seconds : float
+            The idle time after which the upload index of a chat session is dropped.
+        session_max_memory_mb : int
+            The memory budget of the upload indexes of all the chat sessions.
+        session_spill_mb : int
+            The size above which the upload index of a session is memory-mapped.
+        session_search_preprocessed : bool
+            Whether questions about uploads also search the preprocessed documents.
+        ingest_job_workers : int
+            The number of ingestion jobs run at once in the background.
+        ingest_job_poll_seconds : float
+            How often idle ingestion workers look for jobs submitted by other processes.
+        serve_port : int
+            The port of the PDF server (`server.py`) behind the "View PDF" links.
+        app_host, app_port : str, int
+            The address the app (UI and HTTP API) listens on.
+        api_batch_size : int
+            The number of questions of a batch API request embedded and searched together.
+        api_max_concurrency : int
+            The number of completions a batch API request runs at once.
+        api_max_batch_questions : int
+            The maximum number of questions of a batch API request.
+        api_port : int
+            The port of the headless API server (`api_server.py`).
+        tracing_enabled : bool
+            Whether the latency of the requests and of their stages is recorded.
+        trace_sample_rate : float
+            The fraction of the request traces written to the trace log.
+        slow_trace_ms : float
+            The latency above which a request trace is always written to the trace log.
+        trace_log_path : str
+            The rotating JSON lines log of the request traces.
+        trace_log_max_bytes, trace_log_backup_count : int
+            The size at which the trace log is rotated, and the number of rotated logs kept.
+        load_seconds : float
+            The time it took to load the configuration.
+        chat_concurrency, ingest_concurrency : int
+            The number of chat and upload jobs that may run at once.
+        chat_max_queue_size, ingest_max_queue_size : int
+            The number of chat and upload jobs that may wait for a free slot.
 
     Methods:
         load_openai_cfg():
@@ -61,24 +184,57 @@ class LoadConfig:
     """
 
     def __init__(self) -> None:
+        start = time.perf_counter()
         with open(here("configs/app_config.yml")) as cfg:
             app_config = yaml.load(cfg, Loader=yaml.FullLoader)
 
         # LLM config
         self.llm_engine = app_config["llm_config"]["engine"]
         self.llm_system_role = app_config["llm_config"]["llm_system_role"]
+        self.prompt_token_budget = app_config["llm_config"]["prompt_token_budget"]
         self.persist_directory = str(here(
             app_config["directories"]["persist_directory"]))  # needs to be strin for summation in chromadb backend: self._settings.require("persist_directory") + "/chroma.sqlite3"
         self.custom_persist_directory = str(here(
             app_config["directories"]["custom_persist_directory"]))
-        self.embedding_model = OpenAIEmbeddings()
+        self.embedding_cache_directory = str(here(
+            app_config["directories"]["embedding_cache_directory"]))
+        self.summary_cache_path = str(here(app_config["directories"]["summary_cache_path"]))
+        self.ingest_jobs_path = str(here(app_config["directories"]["ingest_jobs_path"]))
+        self.embedding_model = AsyncBatchEmbeddings(
+            model=app_config["embedding_model_config"]["engine"],
+            batch_token_budget=app_config["embedding_model_config"]["batch_token_budget"],
+            max_concurrency=app_config["embedding_model_config"]["max_concurrency"],
+            requests_per_minute=app_config["embedding_model_config"]["requests_per_minute"],
+            tokens_per_minute=app_config["embedding_model_config"]["tokens_per_minute"],
+            max_retries=app_config["embedding_model_config"]["max_retries"])
 
         # Retrieval configs
         self.data_directory = app_config["directories"]["data_directory"]
+        self.vectordb_backend = app_config["vectordb_config"]["backend"]
+        self.vectordb_index = app_config["vectordb_config"]["index"]
+        self.ivf_nlist = app_config["vectordb_config"]["ivf_nlist"]
+        self.ivf_nprobe = app_config["vectordb_config"]["ivf_nprobe"]
         self.k = app_config["retrieval_config"]["k"]
+        self.query_cache_max_entries = app_config["retrieval_config"]["query_cache_max_entries"]
+        self.hybrid_search = app_config["retrieval_config"]["hybrid_search"]
+        self.fetch_k = app_config["retrieval_config"]["fetch_k"]
+        self.rrf_k = app_config["retrieval_config"]["rrf_k"]
+        self.reranker = app_config["retrieval_config"]["reranker"]
+        self.cross_encoder_model = app_config["retrieval_config"]["cross_encoder_model"]
+        self.mmr = app_config["retrieval_config"]["mmr"]
+        self.mmr_lambda = app_config["retrieval_config"]["mmr_lambda"]
+        self.merge_overlapping_chunks = app_config["retrieval_config"]["merge_overlapping_chunks"]
+        self.response_cache_enabled = app_config["response_cache"]["enabled"]
+        self.response_cache_similarity_threshold = app_config["response_cache"]["similarity_threshold"]
+        self.response_cache_ttl_seconds = app_config["response_cache"]["ttl_seconds"]
+        self.response_cache_max_entries = app_config["response_cache"]["max_entries"]
         self.embedding_model_engine = app_config["embedding_model_config"]["engine"]
+        self.embedding_cache_max_entries = app_config["embedding_model_config"]["cache_max_entries"]
         self.chunk_size = app_config["splitter_config"]["chunk_size"]
         self.chunk_overlap = app_config["splitter_config"]["chunk_overlap"]
+        self.num_workers = app_config["ingestion_config"]["num_workers"]
+        self.ingestion_batch_size = app_config["ingestion_config"]["batch_size"]
+        self.ingestion_max_memory_mb = app_config["ingestion_config"]["max_memory_mb"]
 
         # Summarizer config
         self.max_final_token = app_config["summarizer_config"]["max_final_token"]
@@ -86,17 +242,56 @@ class LoadConfig:
         self.summarizer_llm_system_role = app_config["summarizer_config"]["summarizer_llm_system_role"]
         self.character_overlap = app_config["summarizer_config"]["character_overlap"]
         self.final_summarizer_llm_system_role = app_config["summarizer_config"]["final_summarizer_llm_system_role"]
+        self.summarizer_max_concurrency = app_config["summarizer_config"]["max_concurrency"]
+        self.reduce_token_budget = app_config["summarizer_config"]["reduce_token_budget"]
+        self.summary_cache_max_entries = app_config["summarizer_config"]["cache_max_entries"]
         self.temperature = app_config["llm_config"]["temperature"]
 
         # Memory
         self.number_of_q_a_pairs = app_config["memory"]["number_of_q_a_pairs"]
 
+        # Upload sessions
+        self.session_ttl_seconds = app_config["upload_sessions"]["ttl_seconds"]
+        self.session_max_memory_mb = app_config["upload_sessions"]["max_memory_mb"]
+        self.session_spill_mb = app_config["upload_sessions"]["spill_mb"]
+        self.session_search_preprocessed = app_config["upload_sessions"]["search_preprocessed"]
+
+        # Ingestion jobs
+        self.ingest_job_workers = app_config["ingest_jobs"]["num_workers"]
+        self.ingest_job_poll_seconds = app_config["ingest_jobs"]["poll_seconds"]
+
+        # PDF server
+        self.serve_port = app_config["serve"]["port"]
+
+        # App server
+        self.app_host = app_config["app_server"]["host"]
+        self.app_port = app_config["app_server"]["port"]
+
+        # Query API
+        self.api_batch_size = app_config["query_api"]["batch_size"]
+        self.api_max_concurrency = app_config["query_api"]["max_concurrency"]
+        self.api_max_batch_questions = app_config["query_api"]["max_batch_questions"]
+        self.api_port = app_config["query_api"]["port"]
+
+        # Tracing
+        self.tracing_enabled = app_config["tracing"]["enabled"]
+        self.trace_sample_rate = app_config["tracing"]["sample_rate"]
+        self.slow_trace_ms = app_config["tracing"]["slow_trace_ms"]
+        self.trace_log_path = str(here(app_config["tracing"]["log_path"]))
+        self.trace_log_max_bytes = app_config["tracing"]["max_log_mb"] << 20
+        self.trace_log_backup_count = app_config["tracing"]["log_backup_count"]
+
+        # Queue
+        self.chat_concurrency = app_config["queue_config"]["chat_concurrency"]
+        self.chat_max_queue_size = app_config["queue_config"]["chat_max_queue_size"]
+        self.ingest_concurrency = app_config["queue_config"]["ingest_concurrency"]
+        self.ingest_max_queue_size = app_config["queue_config"]["ingest_max_queue_size"]
+
         # Load OpenAI credentials
         self.load_openai_cfg()
 
-        # clean up the upload doc vectordb if it exists
         self.create_directory(self.persist_directory)
-        self.remove_directory(self.custom_persist_directory)
+        self.load_seconds = time.perf_counter() - start
 
     def load_openai_cfg(self):
         """
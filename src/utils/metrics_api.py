@@ -0,0 +1,26 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from utils.tracing import Tracer
+
+
+def create_metrics_router(tracer: Tracer) -> APIRouter:
+    """
+    Builds the metrics endpoint of the request traces, to be scraped by Prometheus.
+
+    Routes:
+        GET /metrics: Latency histograms of the requests and of their stages (retrieval, prompt
+            build, LLM call, ...), with counters of cache hits and tokens.
+
+    Args:
+        tracer (Tracer): The tracer recording the requests.
+
+    Returns:
+        APIRouter: The router.
+    """
+    router = APIRouter(tags=["metrics"])
+
+    @router.get("/metrics", response_class=PlainTextResponse)
+    def metrics() -> str:
+        return tracer.metrics_text()
+
+    return router
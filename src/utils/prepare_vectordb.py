@@ -1,9 +1,80 @@
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import gc
+import hashlib
+import multiprocessing
 import os
-from typing import List
-from langchain_openai import OpenAIEmbeddings
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from utils.embedding_cache import EmbeddingCache, CachedEmbeddings
+from utils.vectordb_pool import VectorDBPool
+from utils.vector_store import VectorStore, get_vector_store
+from utils.bm25_index import BM25Index
+from utils.ingest_manifest import IngestManifest
+from utils.utilities import current_rss_mb, normalize_text
+from utils.token_counter import count_tokens_batch
+
+
+def process_pool_context() -> Optional[multiprocessing.context.BaseContext]:
+    """
+    Pick how the loader processes are started.
+
+    Forking a process that runs other threads (the server, job and worker pool threads of the
+    app) copies the locks those threads hold, which can deadlock the children. In that case the
+    workers are forked from a fork server (spawned where it is not available) instead. The fork
+    server imports the main module once, so the workers do not each run it again.
+
+    Returns:
+        Optional[multiprocessing.context.BaseContext]: The context, or None for the default start method.
+    """
+    if threading.active_count() == 1:
+        return None
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__"])
+    return context
+
+
+def load_and_chunk_file(file_path: str, chunk_size: int, chunk_overlap: int) -> Tuple:
+    """
+    Load a PDF, split its pages into chunks and normalize the text of every chunk.
+
+    This is a module-level function so it can run in a worker process. The PDF loader and the
+    splitter are imported here, so importing this module (and starting the app) does not load them.
+
+    Args:
+        file_path (str): The path of the PDF.
+        chunk_size (int): The size of the chunks.
+        chunk_overlap (int): The overlap between chunks.
+
+    Returns:
+        Tuple: The file path, the number of pages, the chunks, and the error message (None on success).
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    # other options: CharacterTextSplitter, TokenTextSplitter, etc.
+    textsplitter = RecursiveCharacterTextSplitter(
+        chunk_size = chunk_size,
+        chunk_overlap = chunk_overlap,
+        separators=["\n\n", "\n", " ", ""],
+        add_start_index=True
+    )
+    try:
+        pages = PyPDFLoader(file_path).load()
+        chunks = textsplitter.split_documents(pages)
+    except Exception as e:
+        return file_path, 0, [], f"{type(e).__name__}: {e}"
+
+    # normalized once here instead of on every query that retrieves the chunk; the character
+    # range of the raw chunk in its page lets retrieval merge overlapping neighbours
+    for chunk in chunks:
+        chunk.metadata["end_index"] = chunk.metadata["start_index"] + len(chunk.page_content)
+        chunk.page_content = normalize_text(chunk.page_content)
+        chunk.metadata["normalized"] = True
+    return file_path, len(pages), chunks, None
 
 class PrepareVectorDB:
     """
@@ -12,15 +83,37 @@ class PrepareVectorDB:
     This class facilitates the process of loading documents, chunking them, and creating a VectorDB
     with OpenAI embeddings. It provides methods to prepare and save the VectorDB.
 
+    Documents are streamed through the pipeline file by file: chunks are embedded and written in
+    batches of `batch_size`, and no more files are loaded ahead of the writer than the memory
+    ceiling allows. Every finished file is checkpointed in the ingest manifest, so an interrupted
+    build resumes where it stopped.
+
     Parameters:
         data_directory (str or List[str]): The directory or list of directories containing the documents.
         persist_directory (str): The directory to save the VectorDB.
         embedding_model_engine (str): The engine for OpenAI embeddings.
         chunk_size (int): The size of the chunks for document processing.
         chunk_overlap (int): The overlap between chunks.
+        embedding_cache_directory (str, optional): The directory of the on-disk embedding cache. Disabled if None.
+        embedding_cache_max_entries (int): The maximum number of vectors kept in the embedding cache.
+        num_workers (int): The number of processes used to load and chunk the documents.
+        batch_size (int): The number of chunks embedded and written to the VectorDB at once.
+        max_memory_mb (int, optional): Resident memory ceiling; above it files are loaded one at a time.
+        embedding (Embeddings, optional): The embedding function. Defaults to OpenAIEmbeddings.
+        vectordb_backend (str): The vector store backend, "chroma" or "numpy".
+        vectordb_index (str): The index of the numpy backend, "flat" or "ivf".
+        ivf_nlist (int): The number of IVF clusters of the numpy backend; 0 to size it from the store.
+        progress_callback (Callable[[str, int], None], optional): Called with a stage ("files_loaded",
+            "pages_parsed", "chunks_created", "chunks_embedded" or "vectors_written") and a count as
+            the build progresses. An exception it raises aborts the build.
     """
 
-    def __init__(self, data_directory:str, persist_directory: str, embedding_model_engine: str, chunk_size: int, chunk_overlap: int) -> None:
+    def __init__(self, data_directory:str, persist_directory: str, embedding_model_engine: str, chunk_size: int, chunk_overlap: int,
+                 embedding_cache_directory: Optional[str] = None, embedding_cache_max_entries: int = 100000,
+                 num_workers: int = 1, batch_size: int = 256, max_memory_mb: Optional[int] = None,
+                 embedding: Optional[Embeddings] = None, vectordb_backend: str = "chroma",
+                 vectordb_index: str = "flat", ivf_nlist: int = 0,
+                 progress_callback: Optional[Callable[[str, int], None]] = None) -> None:
         """
         Initialize the PrepareVectorDB instance.
 
@@ -30,85 +123,351 @@ class PrepareVectorDB:
             embedding_model_engine (str): The engine for OpenAI embeddings.
             chunk_size (int): The size of the chunks for document processing.
             chunk_overlap (int): The overlap between chunks.
+            embedding_cache_directory (str, optional): The directory of the on-disk embedding cache. Disabled if None.
+            embedding_cache_max_entries (int): The maximum number of vectors kept in the embedding cache.
+            num_workers (int): The number of processes used to load and chunk the documents.
+            batch_size (int): The number of chunks embedded and written to the VectorDB at once.
+            max_memory_mb (int, optional): Resident memory ceiling; above it files are loaded one at a time.
+            embedding (Embeddings, optional): The embedding function. Defaults to OpenAIEmbeddings.
+            vectordb_backend (str): The vector store backend, "chroma" or "numpy".
+            vectordb_index (str): The index of the numpy backend, "flat" or "ivf".
+            ivf_nlist (int): The number of IVF clusters of the numpy backend; 0 to size it from the store.
+            progress_callback (Callable[[str, int], None], optional): Called with a stage and a count as the build progresses.
         """
 
         self.embedding_model_engine = embedding_model_engine
-        self.textsplitter = RecursiveCharacterTextSplitter(
-            chunk_size = chunk_size,
-            chunk_overlap = chunk_overlap,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        """Other options: CharacterTextSplitter, TokenTextSplitter, etc."""
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.num_workers = max(1, int(num_workers))
+        self.batch_size = max(1, int(batch_size))
+        self.max_memory_mb = max_memory_mb
 
         self.data_directory = data_directory
         self.persist_directory = persist_directory
-        self.embedding = OpenAIEmbeddings()
+        self.vectordb_backend = vectordb_backend
+        self.vectordb_index = vectordb_index
+        self.ivf_nlist = ivf_nlist
+        self.progress_callback = progress_callback
+        if embedding is None:
+            from langchain_openai import OpenAIEmbeddings
+            embedding = OpenAIEmbeddings()
+        self.embedding = embedding
+        if embedding_cache_directory is not None:
+            # Only chunks whose (model, text) hash is not cached yet are sent to the embedding API
+            self.embedding = CachedEmbeddings(
+                self.embedding,
+                EmbeddingCache.shared(embedding_cache_directory, embedding_model_engine, embedding_cache_max_entries))
 
-    def __load_all_documents(self) -> List:
+    def __open_vectordb(self) -> VectorStore:
+        """
+        Open the VectorDB of the persist directory with the configured backend, for writing.
         """
-        Load all documents from the specified directory or directories.
+        return get_vector_store(self.persist_directory, self.embedding, self.vectordb_backend,
+                                index=self.vectordb_index, ivf_nlist=self.ivf_nlist)
+
+    def __list_files(self) -> List[str]:
+        """
+        List the files to ingest from the specified directory or list of files.
 
         Returns:
-            List: A list of loaded documents.
+            List[str]: The file paths, as they are stored in the chunks' "source" metadata.
         """
+        if isinstance(self.data_directory, list):
+            return list(self.data_directory)
+        # sorted, so chunk order and IDs do not depend on the file system listing order
+        return [os.path.join(self.data_directory, doc_name) for doc_name in sorted(os.listdir(self.data_directory))]
 
-        doc_counter = 0 
+    def __over_memory_ceiling(self) -> bool:
+        """
+        Check whether the process is above the configured memory ceiling.
+        """
+        return self.max_memory_mb is not None and current_rss_mb() > self.max_memory_mb
 
-        if isinstance(self.data_directory, list):
-            print("loading the uploaded documents....")
-            docs = []
-            for doc_dir in self.data_directory:
-                docs.extend(PyPDFLoader(doc_dir).load())
-                doc_counter += 1
+    def __iter_loaded(self, file_paths: List[str], stats: Dict) -> Iterator[Tuple[str, List]]:
+        """
+        Lazily load and chunk the given files, in parallel when more than one worker is configured.
 
-            print("Number of loaded documents:", doc_counter)
-            print("Number of pages:", len(docs), "\n\n")
+        Files are yielded in the order of `file_paths` whatever order the workers finish in. At
+        most `num_workers` files are loaded ahead of the consumer, and only one while the process
+        is above the memory ceiling, so a slow writer holds back the loaders. A file that fails to
+        load is reported and skipped instead of aborting the whole build.
 
-        else:
-            print("loading documents manually...")
-            document_list = os.listdir(self.data_directory)
-            docs = []
-            for doc_name in document_list:
-                docs.extend(PyPDFLoader(os.path.join(
-                    self.data_directory, doc_name)).load())
-                doc_counter += 1 
-            print("Number of loaded documents:", doc_counter)
-            print("Number of pages:", len(docs), "\n\n")
+        Parameters:
+            file_paths (List[str]): The files to load.
+            stats (Dict): Counters of loaded, failed, pages and chunks, updated in place.
+
+        Yields:
+            Tuple[str, List]: The file path and chunks of every file that loaded successfully.
+        """
+        executor = None
+        if self.num_workers > 1 and len(file_paths) > 1:
+            executor = ProcessPoolExecutor(max_workers=min(self.num_workers, len(file_paths)),
+                                           mp_context=process_pool_context())
+        remaining = iter(file_paths)
+        pending = deque()
+        try:
+            while True:
+                window = self.num_workers
+                if self.__over_memory_ceiling():
+                    gc.collect()
+                    window = 1
+                while len(pending) < window:
+                    file_path = next(remaining, None)
+                    if file_path is None:
+                        break
+                    pending.append(executor.submit(load_and_chunk_file, file_path, self.chunk_size, self.chunk_overlap)
+                                   if executor else file_path)
+                if not pending:
+                    break
+
+                item = pending.popleft()
+                if executor:
+                    file_path, pages, chunks, error = item.result()
+                else:
+                    file_path, pages, chunks, error = load_and_chunk_file(item, self.chunk_size, self.chunk_overlap)
+                if error is not None:
+                    print(f"[WARN] Could not load {file_path}: {error}")
+                    stats["failed"] += 1
+                    continue
+                stats["loaded"] += 1
+                stats["pages"] += pages
+                stats["chunks"] += len(chunks)
+                self.__report("files_loaded", 1)
+                self.__report("pages_parsed", pages)
+                self.__report("chunks_created", len(chunks))
+                yield file_path, chunks
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+    def __report(self, stage: str, count: int) -> None:
+        """
+        Report the progress of a stage to the progress callback, if any.
+        """
+        if self.progress_callback is not None and count:
+            self.progress_callback(stage, count)
+
+    def __add_batch(self, vectordb: VectorStore, chunks: List, ids: List[str]) -> None:
+        """
+        Embed a batch of chunks and write them to the VectorDB.
+        """
+        embeddings = self.embedding.embed_documents([chunk.page_content for chunk in chunks])
+        self.__report("chunks_embedded", len(chunks))
+        vectordb.add_documents(chunks, ids, embeddings=embeddings)
+        self.__report("vectors_written", len(chunks))
+
+    @staticmethod
+    def chunk_ids(file_path: str, num_chunks: int) -> List[str]:
+        """
+        Build deterministic chunk IDs for a file, so its chunks can later be replaced or deleted.
+
+        Parameters:
+            file_path (str): The path of the file.
+            num_chunks (int): The number of chunks produced for the file.
+
+        Returns:
+            List[str]: One ID per chunk.
+        """
+        prefix = hashlib.sha1(file_path.encode("utf-8")).hexdigest()[:16]
+        return [f"{prefix}-{i}" for i in range(num_chunks)]
 
-        return docs
-    
-    def __chunk_documents(self, docs:List) -> List:
+    def __ingest(self, vectordb: VectorStore, keyword_index: BM25Index, manifest: IngestManifest, file_paths: List[str],
+                 purge_legacy: bool = False) -> Dict:
         """
-        Chunk the loaded documents using the specified text splitter.
+        Stream the given files into the VectorDB and its keyword index, replacing any chunks they had before.
 
         Parameters:
-            docs (List): The list of loaded documents.
+            vectordb (VectorStore): The VectorDB to write to.
+            keyword_index (BM25Index): The keyword index of the VectorDB.
+            manifest (IngestManifest): The manifest, updated and saved after every file.
+            file_paths (List[str]): The files to ingest.
+            purge_legacy (bool): Delete chunks by source for files unknown to the manifest.
 
         Returns:
-            List: A list of chunked documents.
+            Dict: Counters of loaded, failed, pages, chunks and chunk tokens.
+        """
+        stats = {"loaded": 0, "failed": 0, "pages": 0, "chunks": 0, "tokens": 0}
+        for file_path, chunks in self.__iter_loaded(file_paths, stats):
+            old_ids = manifest.forget(file_path)
+            if not old_ids and purge_legacy:
+                # stores built before the manifest existed have random chunk IDs
+                old_ids = vectordb.get_ids_by_source(file_path)
+            if old_ids:
+                vectordb.delete(ids=old_ids)
+                keyword_index.remove(old_ids)
+
+            file_ids = self.chunk_ids(file_path, len(chunks))
+            for start in range(0, len(chunks), self.batch_size):
+                # IDs are deterministic, so a file interrupted halfway is simply upserted again
+                self.__add_batch(vectordb, chunks[start:start + self.batch_size],
+                                 file_ids[start:start + self.batch_size])
+                keyword_index.add(file_ids[start:start + self.batch_size],
+                                  [chunk.page_content for chunk in chunks[start:start + self.batch_size]])
+            manifest.record(file_path, file_ids)
+            manifest.save()
+            num_tokens = sum(count_tokens_batch([chunk.page_content for chunk in chunks], self.embedding_model_engine))
+            stats["tokens"] += num_tokens
+            print(f"Ingested {os.path.basename(file_path)}: {len(chunks)} chunks, {num_tokens} tokens")
+
+        print("Number of loaded documents:", stats["loaded"])
+        if stats["failed"]:
+            print("Number of failed documents:", stats["failed"])
+        print("Number of pages:", stats["pages"])
+        print("Number of chunks:", stats["chunks"])
+        print("Number of chunk tokens:", stats["tokens"], "\n\n")
+        return stats
+
+    def __backfill_keyword_index(self, vectordb: VectorStore, keyword_index: BM25Index) -> None:
+        """
+        Index the chunks of a VectorDB built before it had a keyword index.
+        """
+        total = vectordb.count()
+        if len(keyword_index) > 0 or total == 0:
+            return
+        print(f"Building the keyword index of {total} existing chunks...")
+        for offset in range(0, total, self.batch_size):
+            keyword_index.add(*vectordb.get_texts(self.batch_size, offset))
 
+    def __print_summary(self, vectordb: VectorStore) -> None:
         """
-        print("Chunking documents...")
-        chunked_documents = self.textsplitter.split_documents(docs)
-        print("Number of chunks:", len(chunked_documents), "\n\n")
-        return chunked_documents
-    
+        Print the size of the VectorDB and the embedding cache statistics.
+        """
+        print("Number of vector in vectordb: ", vectordb.count())
+        if isinstance(self.embedding, CachedEmbeddings):
+            print(f"Embedding cache: {self.embedding.hits} hits, {self.embedding.misses} misses, "
+                  f"{len(self.embedding.cache)} cached vectors")
+        print("\n")
+
+    def __read_manifest(self, vectordb: VectorStore) -> IngestManifest:
+        """
+        Read the ingest manifest, forgetting its files if the VectorDB is empty.
+
+        This happens when the vector store backend is switched: the new store of the persist
+        directory must be built from all the files again.
+        """
+        manifest = IngestManifest(self.persist_directory)
+        if manifest.files and vectordb.count() == 0:
+            print(f"The {self.vectordb_backend} VectorDB is empty: ingesting all the files again")
+            manifest.files = {}
+        return manifest
+
+    @staticmethod
+    def has_unfinished_build(persist_directory: str) -> bool:
+        """
+        Check whether a build of the persist directory was interrupted and can be resumed.
+
+        Parameters:
+            persist_directory (str): The directory of the VectorDB.
+
+        Returns:
+            bool: True if the last build did not complete.
+        """
+        return IngestManifest(persist_directory).in_progress
+
+    @staticmethod
+    def __purge_removed(vectordb: VectorStore, keyword_index: BM25Index, manifest: IngestManifest,
+                        removed: List[str]) -> None:
+        """
+        Delete the chunks, keyword postings and manifest entries of the files removed from the data directory.
+        """
+        for file_path in removed:
+            old_ids = manifest.forget(file_path)
+            if old_ids:
+                vectordb.delete(ids=old_ids)
+                keyword_index.remove(old_ids)
+            manifest.save()
+
     def perpare_and_save_vectordb(self):
         """
         Load, chunk, and create a VectorDB with OpenAI embeddings, and save it.
 
+        Files already recorded in the ingest manifest with an unchanged content are skipped, so
+        calling this again after an interrupted build resumes it. The chunks of files that were
+        removed from the data directory are purged.
+
         Returns:
-            Chroma: The created VectorDB.
+            VectorStore: The created VectorDB.
         """
-        docs = self.__load_all_documents()
-        chunked_documents = self.__chunk_documents(docs=docs)
+        if isinstance(self.data_directory, list):
+            print("loading the uploaded documents....")
+        else:
+            print("loading documents manually...")
+
+        vectordb = self.__open_vectordb()
+        manifest = self.__read_manifest(vectordb)
+        new, changed, unchanged, removed = manifest.diff(self.__list_files())
+        if manifest.in_progress and unchanged:
+            print(f"Resuming the interrupted build: {len(unchanged)} files are already ingested")
+        manifest.in_progress = True
+        manifest.save()
 
         print("Preparing vectordb...")
-        vectordb = Chroma.from_documents(
-            documents=chunked_documents,
-            embedding=self.embedding,
-            persist_directory=self.persist_directory
-        )
+        keyword_index = BM25Index(self.persist_directory)
+        self.__purge_removed(vectordb, keyword_index, manifest, removed)
+        self.__ingest(vectordb, keyword_index, manifest, new + changed)
+        vectordb.optimize()
+        keyword_index.optimize()
+        manifest.in_progress = False
+        manifest.save()
+
+        # Shared read handles of this directory now point at the old collection
+        VectorDBPool.invalidate(self.persist_directory)
         print("VectorDB is created and saved.")
-        print("Number of vector in vectordb: ", vectordb._collection.count(), "\n\n")
-        return vectordb
\ No newline at end of file
+        self.__print_summary(vectordb)
+        return vectordb
+
+    def sync_vectordb(self):
+        """
+        Incrementally synchronize the VectorDB with the data directory.
+
+        The files are compared with the ingest manifest of the persist directory: new files are
+        chunked and added, changed files have their old chunks deleted before the new ones are
+        upserted, and removed files are purged. Unchanged files are not loaded at all.
+
+        Returns:
+            VectorStore: The synchronized VectorDB.
+        """
+        vectordb = self.__open_vectordb()
+        manifest = self.__read_manifest(vectordb)
+        new, changed, unchanged, removed = manifest.diff(self.__list_files())
+        print(f"Sync: {len(new)} new, {len(changed)} changed, {len(unchanged)} unchanged, {len(removed)} removed files")
+
+        has_legacy_chunks = not manifest.files and vectordb.count() > 0
+        keyword_index = BM25Index(self.persist_directory)
+        self.__backfill_keyword_index(vectordb, keyword_index)
+
+        self.__purge_removed(vectordb, keyword_index, manifest, removed)
+        self.__ingest(vectordb, keyword_index, manifest, new + changed, purge_legacy=has_legacy_chunks)
+        vectordb.optimize()
+        keyword_index.optimize()
+        manifest.in_progress = False
+        manifest.save()
+        if new or changed or removed:
+            VectorDBPool.invalidate(self.persist_directory)
+        self.__print_summary(vectordb)
+        return vectordb
+
+    def add_to_vectordb(self, vectordb: VectorStore) -> VectorStore:
+        """
+        Load, chunk and add the files to an existing VectorDB, such as the in-memory index of a chat session.
+
+        Nothing is written to the persist directory: there is no ingest manifest and no keyword
+        index, and the files are always ingested again.
+
+        Parameters:
+            vectordb (VectorStore): The VectorDB to add the chunks to.
+
+        Returns:
+            VectorStore: The VectorDB.
+        """
+        stats = {"loaded": 0, "failed": 0, "pages": 0, "chunks": 0}
+        for file_path, chunks in self.__iter_loaded(self.__list_files(), stats):
+            file_ids = self.chunk_ids(file_path, len(chunks))
+            for start in range(0, len(chunks), self.batch_size):
+                self.__add_batch(vectordb, chunks[start:start + self.batch_size],
+                                 file_ids[start:start + self.batch_size])
+            print(f"Ingested {os.path.basename(file_path)}: {len(chunks)} chunks")
+        if stats["failed"]:
+            print("Number of failed documents:", stats["failed"])
+        self.__print_summary(vectordb)
+        return vectordb
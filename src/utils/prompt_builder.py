@@ -0,0 +1,165 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+import tiktoken
+from utils.token_counter import get_encoding
+
+# A chunk cut below this many tokens carries too little context to be worth including
+MIN_TRUNCATED_CHUNK_TOKENS = 64
+
+
+@dataclass
+class PreparedPrompt:
+    """
+    The parts of a prompt that do not depend on the retrieved chunks, with their token counts.
+    """
+    question_section: str
+    question_tokens: int
+    pairs: List[str]
+    pair_tokens: List[int]
+
+
+class PromptBuilder:
+    """
+    Assembles the user prompt of a chat turn within a token budget.
+
+    The budget is filled in priority order: the question first, then the retrieved chunks in
+    rank order, then the chat history from the most recent pair backwards. The last chunk that
+    does not fit is cut at a token boundary if enough of it fits, and the remaining chunks and
+    older history pairs are dropped. History is rendered as plain "User:"/"Assistant:" lines
+    instead of the repr of the Gradio history, and the token composition of every prompt can be
+    reported to the caller.
+
+    Parameters:
+        model (str): The chat model, used to pick the tokenizer.
+        token_budget (int): The maximum number of tokens of the user prompt.
+        number_of_q_a_pairs (int): The maximum number of previous Q&A pairs to include.
+    """
+
+    def __init__(self, model: str, token_budget: int, number_of_q_a_pairs: int) -> None:
+        self.model = model
+        self.token_budget = token_budget
+        self.number_of_q_a_pairs = number_of_q_a_pairs
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        # loaded on first use and shared with the rest of the process
+        return get_encoding(self.model)
+
+    def load(self) -> None:
+        """
+        Loads the tokenizer of the model now instead of on the first prompt.
+        """
+        get_encoding(self.model)
+
+    def count(self, text: str) -> int:
+        """
+        Returns the number of tokens of a text.
+        """
+        return len(self.encoding.encode_ordinary(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cuts a text to at most `max_tokens` tokens, marking the cut with an ellipsis.
+
+        Args:
+            text (str): The text to cut.
+            max_tokens (int): The maximum number of tokens to keep.
+
+        Returns:
+            str: The text, cut at a token boundary if it was longer.
+        """
+        tokens = self.encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max(max_tokens - 1, 0)]).rstrip() + " …\n\n"
+
+    @staticmethod
+    def format_history(pairs: List[Tuple]) -> List[str]:
+        """
+        Renders Gradio history pairs as plain text, one string per pair.
+
+        Args:
+            pairs (List[Tuple]): The (user message, assistant answer) pairs.
+
+        Returns:
+            List[str]: The rendered pairs.
+        """
+        return [f"User: {user}\nAssistant: {assistant}\n\n" for user, assistant in pairs]
+
+    def prepare(self, question: str, history: List[Tuple]) -> PreparedPrompt:
+        """
+        Renders the question and the history of a chat turn and counts their tokens, which can be
+        done while the chunks are being retrieved.
+
+        Args:
+            question (str): The user's new question.
+            history (List[Tuple]): The Gradio chat history before the question.
+
+        Returns:
+            PreparedPrompt: The question section and the history pairs, with their token counts.
+        """
+        question_section = self.truncate("# User new question:\n" + question, self.token_budget)
+        pairs = self.format_history(history[-self.number_of_q_a_pairs:]) if self.number_of_q_a_pairs else []
+        return PreparedPrompt(question_section, self.count(question_section), pairs,
+                              [self.count(pair) for pair in pairs])
+
+    def build(self, question: str, references: List[str], history: List[Tuple],
+              prepared: Optional[PreparedPrompt] = None, stats: Optional[Dict] = None) -> str:
+        """
+        Builds the prompt of a chat turn.
+
+        Args:
+            question (str): The user's new question.
+            references (List[str]): The formatted retrieved chunks, best first.
+            history (List[Tuple]): The Gradio chat history before the question.
+            prepared (PreparedPrompt, optional): The result of `prepare` for the question and the
+                history, if it was computed ahead.
+            stats (Dict, optional): Receives the token counts of the question, the chunks and the
+                history ("question_tokens", "chunk_tokens", "history_tokens"), the number of chunks
+                and history pairs kept, and whether the last chunk was truncated.
+
+        Returns:
+            str: The prompt, at most `token_budget` tokens long.
+        """
+        if prepared is None:
+            prepared = self.prepare(question, history)
+        question_section = prepared.question_section
+        question_tokens = prepared.question_tokens
+        remaining = self.token_budget - question_tokens
+
+        chunks, chunk_tokens, truncated = [], 0, False
+        for reference in references:
+            tokens = self.count(reference)
+            if tokens > remaining:
+                if remaining >= MIN_TRUNCATED_CHUNK_TOKENS:
+                    reference = self.truncate(reference, remaining)
+                    tokens = self.count(reference)
+                    chunks.append(reference)
+                    chunk_tokens += tokens
+                    remaining -= tokens
+                    truncated = True
+                break
+            chunks.append(reference)
+            chunk_tokens += tokens
+            remaining -= tokens
+
+        header = "# Chat history:\n"
+        pairs = prepared.pairs
+        kept_pairs, history_tokens = [], 0
+        if pairs and remaining > self.count(header):
+            remaining -= self.count(header)
+            history_tokens = self.count(header)
+            for pair, tokens in zip(reversed(pairs), reversed(prepared.pair_tokens)):
+                if tokens > remaining:
+                    break
+                kept_pairs.insert(0, pair)
+                history_tokens += tokens
+                remaining -= tokens
+        if not kept_pairs:
+            history_tokens = 0
+        chat_history = header + "".join(kept_pairs) if kept_pairs else ""
+
+        if stats is not None:
+            stats.update(question_tokens=question_tokens, chunk_tokens=chunk_tokens, history_tokens=history_tokens,
+                         chunks=len(chunks), history_pairs=len(kept_pairs), truncated=truncated)
+        return f"{chat_history}{''.join(chunks)}{question_section}"
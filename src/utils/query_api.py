@@ -0,0 +1,63 @@
+import time
+from typing import Dict, List, Tuple
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from utils.chatbot import APPCFG, ChatBot
+
+
+class QueryRequest(BaseModel):
+    """
+    A question about the preprocessed documents, with the previous turns of the conversation.
+    """
+
+    question: str = Field(min_length=1)
+    history: List[Tuple[str, str]] = []
+    temperature: float = Field(default=0.0, ge=0.0, le=1.0)
+
+
+class BatchQueryRequest(BaseModel):
+    """
+    Independent questions about the preprocessed documents.
+    """
+
+    questions: List[str] = Field(min_length=1)
+    temperature: float = Field(default=0.0, ge=0.0, le=1.0)
+
+
+def create_query_router() -> APIRouter:
+    """
+    Builds the HTTP/JSON query API of the chatbot, served next to the Gradio app or on its own
+    by `api_server.py`.
+
+    Routes:
+        POST /api/query: Answers one question.
+        POST /api/query/batch: Answers many questions, pipelining retrieval and generation.
+
+    Every answer comes with its sources (file, page, chunk ID and content), whether it was served
+    from the response cache, and the latency of each stage in milliseconds. The handlers are
+    async and share the retriever, caches and pooled OpenAI client of the chat UI.
+
+    Returns:
+        APIRouter: The router.
+    """
+    router = APIRouter(prefix="/api", tags=["query"])
+
+    @router.post("/query")
+    async def query(request: QueryRequest) -> Dict:
+        try:
+            return await ChatBot.answer(request.question, request.history, request.temperature)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+    @router.post("/query/batch")
+    async def query_batch(request: BatchQueryRequest) -> Dict:
+        if len(request.questions) > APPCFG.api_max_batch_questions:
+            raise HTTPException(status_code=413, detail=f"A batch holds at most {APPCFG.api_max_batch_questions} questions.")
+        start = time.perf_counter()
+        try:
+            results = await ChatBot.answer_batch(request.questions, request.temperature)
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        return {"results": results, "timings": {"total": round((time.perf_counter() - start) * 1000, 1)}}
+
+    return router
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional
+import numpy as np
+
+
+@dataclass
+class CachedResponse:
+    """
+    An answer stored in the semantic response cache.
+    """
+    namespace: str
+    answer: str
+    references: str
+    chunk_ids: List[str]
+    fingerprint: str
+    generation: int
+    created: float
+
+
+class SemanticResponseCache:
+    """
+    An in-process cache of answers, looked up by the similarity of question embeddings.
+
+    Question embeddings are kept L2-normalized in a NumPy matrix, so a lookup is a single
+    matrix-vector product. An entry is returned when the best cosine similarity within the same
+    namespace (the persist directory) reaches `similarity_threshold` and the entry is younger
+    than `ttl_seconds`. Callers must still check that the retrieved chunks were not re-indexed,
+    using the stored chunk IDs and fingerprint. The least recently used entries are evicted
+    beyond `max_entries`.
+
+    Parameters:
+        similarity_threshold (float): The minimum cosine similarity of a cache hit.
+        ttl_seconds (float): The maximum age of an entry.
+        max_entries (int): The maximum number of cached answers.
+    """
+
+    def __init__(self, similarity_threshold: float, ttl_seconds: float, max_entries: int) -> None:
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._vectors = None
+        self._entries: "OrderedDict[int, CachedResponse]" = OrderedDict()  # row -> entry, in LRU order
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(documents: List) -> str:
+        """
+        Returns an order-independent fingerprint of the IDs and contents of retrieved chunks.
+
+        Args:
+            documents (List): The retrieved documents.
+
+        Returns:
+            str: The sha1 hex digest of the chunk IDs and contents.
+        """
+        digest = hashlib.sha1()
+        for doc in sorted(documents, key=lambda doc: doc.id or ""):
+            digest.update(f"{doc.id}\0{doc.page_content}\0".encode("utf-8"))
+        return digest.hexdigest()
+
+    def lookup(self, vector: List[float], namespace: str, generation: int) -> Optional[CachedResponse]:
+        """
+        Returns the cached answer of the most similar question, if it is similar and fresh enough.
+
+        Args:
+            vector (List[float]): The embedding of the new question.
+            namespace (str): The persist directory the question is asked against.
+            generation (int): The current invalidation counter of the persist directory.
+
+        Returns:
+            Optional[CachedResponse]: The cached answer, or None on a miss.
+        """
+        with self._lock:
+            self.__expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+            rows = np.fromiter((row for row, entry in self._entries.items()
+                                if entry.namespace == namespace and entry.generation == generation), dtype=np.int64)
+            if rows.size == 0:
+                self.misses += 1
+                return None
+            query = np.asarray(vector, dtype=np.float32)
+            similarities = self._vectors[rows] @ (query / (np.linalg.norm(query) or 1.0))
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            row = int(rows[best])
+            self._entries.move_to_end(row)
+            self.hits += 1
+            return self._entries[row]
+
+    def put(self, vector: List[float], entry: CachedResponse) -> None:
+        """
+        Stores an answer, evicting the least recently used entry if the cache is full.
+
+        Args:
+            vector (List[float]): The embedding of the question.
+            entry (CachedResponse): The answer and the chunks it was generated from.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, query.shape[0]), dtype=np.float32)
+            if not self._free_rows:
+                oldest_row, _ = self._entries.popitem(last=False)
+                self._free_rows.append(oldest_row)
+            row = self._free_rows.pop()
+            self._vectors[row] = query / (np.linalg.norm(query) or 1.0)
+            self._entries[row] = entry
+
+    def discard(self, entry: CachedResponse) -> None:
+        """
+        Removes an entry, e.g. after finding that its chunks were re-indexed.
+
+        Args:
+            entry (CachedResponse): The entry returned by `lookup`.
+        """
+        with self._lock:
+            for row, cached in list(self._entries.items()):
+                if cached is entry:
+                    del self._entries[row]
+                    self._free_rows.append(row)
+
+    def __expire(self) -> None:
+        now = time.time()
+        # entries are in LRU order, not creation order, so every entry is checked
+        for row in [row for row, entry in self._entries.items() if now - entry.created > self.ttl_seconds]:
+            del self._entries[row]
+            self._free_rows.append(row)
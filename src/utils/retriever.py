@@ -0,0 +1,363 @@
+import asyncio
+import time
+import numpy as np
+from typing import Callable, Dict, List, Optional
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from utils.embedding_cache import QueryEmbeddingCache
+from utils.bm25_index import BM25Index
+from utils.llm_client import close_async_openai_client
+from utils.reranker import CosineReranker, Reranker, maximal_marginal_relevance, stored_embeddings
+from utils.vector_store import VectorStore
+
+
+class Retriever:
+    """
+    Embeds queries through a `QueryEmbeddingCache` and searches a vector store with the vectors.
+
+    Cache misses of a call are deduplicated and embedded together in one `aembed_documents`
+    request (the OpenAI embedding models embed queries and documents the same way). Searching
+    many queries sends all their vectors to the store in a single search, so an offline
+    evaluation of thousands of questions costs a handful of embedding requests instead of one
+    round trip per question.
+
+    Retrieval runs in stages, and the latency of each one is logged:
+        - search: the vector search, and the BM25 search in parallel when the store has a
+          keyword index. Each returns `fetch_k` candidates when there is a later stage to
+          narrow them down, otherwise `k`.
+        - fusion: the rankings of a hybrid search are merged with reciprocal rank fusion.
+        - rerank: the candidates are re-scored by the reranker and the best `k` are kept.
+        - mmr: instead of keeping the best `k`, maximal marginal relevance picks `k` candidates
+          that are relevant (reranker scores, or cosine similarity) but not near-duplicates of
+          each other, using the stored embeddings of the candidates.
+    After a hybrid search, the ranking of the reranker (or of the cosine similarity) is fused
+    again with the fused BM25 + vector ranking, so the later stages do not discard the keyword
+    signal.
+
+    Parameters:
+        embedding (Embeddings): The embedding model of the vector store.
+        cache (QueryEmbeddingCache): The cache of query embeddings.
+        fetch_k (int): The number of candidates fetched from each search before fusion and reranking.
+        rrf_k (int): The rank offset of reciprocal rank fusion; higher values flatten the rank weights.
+        reranker (Reranker, optional): The reranker of the candidates; None keeps the search order.
+        mmr_lambda (float, optional): The relevance weight of maximal marginal relevance; None disables it.
+    """
+
+    def __init__(self, embedding: Embeddings, cache: QueryEmbeddingCache, fetch_k: int = 10,
+                 rrf_k: int = 60, reranker: Optional[Reranker] = None, mmr_lambda: Optional[float] = None) -> None:
+        self.embedding = embedding
+        self.cache = cache
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.mmr_lambda = mmr_lambda
+
+    async def aembed_queries(self, queries: List[str], stats: Optional[Dict[str, int]] = None) -> List[List[float]]:
+        """
+        Returns the embedding of each query, requesting only the cache misses.
+
+        Args:
+            queries (List[str]): The query texts.
+            stats (Dict[str, int], optional): Receives the number of queries answered from the
+                cache ("cache_hits") and of embeddings requested ("requested").
+
+        Returns:
+            List[List[float]]: The embedding of each query, in order.
+        """
+        vectors = self.cache.get(queries)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(self.cache.key(queries[i]), []).append(i)
+        if missing:
+            missing_texts = [queries[positions[0]] for positions in missing.values()]
+            new_vectors = await self.embedding.aembed_documents(missing_texts)
+            self.cache.put(missing_texts, new_vectors)
+            for positions, vector in zip(missing.values(), new_vectors):
+                for i in positions:
+                    vectors[i] = list(vector)
+        if stats is not None:
+            stats["cache_hits"] = len(queries) - sum(len(positions) for positions in missing.values())
+            stats["requested"] = len(missing)
+        return vectors
+
+    async def aembed_query(self, query: str, stats: Optional[Dict[str, int]] = None) -> List[float]:
+        """
+        Returns the embedding of a single query, from the cache when possible.
+
+        Args:
+            query (str): The query text.
+            stats (Dict[str, int], optional): Receives the cache statistics, as in `aembed_queries`.
+
+        Returns:
+            List[float]: The query embedding.
+        """
+        return (await self.aembed_queries([query], stats))[0]
+
+    @staticmethod
+    def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[str]:
+        """
+        Merges rankings of chunk IDs by summing 1 / (rrf_k + rank) over the rankings.
+
+        Args:
+            rankings (List[List[str]]): The chunk IDs of each search, best first.
+            rrf_k (int): The rank offset.
+
+        Returns:
+            List[str]: The fused chunk IDs, best first.
+        """
+        scores: Dict[str, float] = {}
+        for ranking in rankings:
+            for rank, chunk_id in enumerate(ranking, start=1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+        return sorted(scores, key=scores.get, reverse=True)
+
+    def __fuse(self, vectordb: VectorStore, vector_docs: List[Document], keyword_ids: List[str], k: int) -> List[Document]:
+        """
+        Fuse the rankings of one query and load the keyword-only hits from the store.
+        """
+        fused_ids = self.reciprocal_rank_fusion([[doc.id for doc in vector_docs], keyword_ids], self.rrf_k)[:k]
+        docs = {doc.id: doc for doc in vector_docs}
+        missing = [chunk_id for chunk_id in fused_ids if chunk_id not in docs]
+        if missing:
+            docs.update({doc.id: doc for doc in vectordb.get_by_ids(missing)})
+        return [docs[chunk_id] for chunk_id in fused_ids if chunk_id in docs]
+
+    def __has_selection_stage(self) -> bool:
+        return self.reranker is not None or self.mmr_lambda is not None
+
+    def __selection_stage(self) -> str:
+        return "mmr" if self.mmr_lambda is not None else "rerank"
+
+    def __select(self, vectordb: VectorStore, query: str, vector: List[float], candidates: List[Document],
+                 k: int, fused: bool) -> List[Document]:
+        """
+        Keep `k` candidates, by reranker score or by maximal marginal relevance. Candidates in
+        fused (hybrid) order have their scores fused with that order, see `__fuse_with_order`.
+        """
+        if len(candidates) <= 1:
+            return candidates[:k]
+        if self.mmr_lambda is None and not fused:
+            return self.reranker.rerank(vectordb, query, vector, candidates, k)
+        embeddings = None
+        if self.reranker is None or isinstance(self.reranker, CosineReranker):
+            embeddings = stored_embeddings(vectordb, candidates)
+            query_vector = np.asarray(vector, dtype=np.float32)
+            scores = embeddings @ (query_vector / (np.linalg.norm(query_vector) or 1.0))
+            cosine = True
+        else:
+            scores = self.reranker.score(vectordb, query, vector, candidates)
+            cosine = False
+        if fused:
+            scores = self.__fuse_with_order(scores)
+        if self.mmr_lambda is None:
+            return [candidates[i] for i in np.argsort(-scores, kind="stable")[:k]]
+        # MMR trades relevance against similarity, so relevance must be on the [0, 1] scale of cosine
+        relevance = scores if cosine and not fused else (scores - scores.min()) / ((scores.max() - scores.min()) or 1.0)
+        embeddings = stored_embeddings(vectordb, candidates) if embeddings is None else embeddings
+        return [candidates[i] for i in maximal_marginal_relevance(relevance, embeddings, k, self.mmr_lambda)]
+
+    def __fuse_with_order(self, scores: np.ndarray) -> np.ndarray:
+        """
+        Reciprocal rank fusion of the ranking by score with the current order of the candidates.
+        """
+        ranks = np.empty(len(scores), dtype=np.int64)
+        ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1)
+        return 1.0 / (self.rrf_k + np.arange(1, len(scores) + 1)) + 1.0 / (self.rrf_k + ranks)
+
+    @staticmethod
+    async def __timed(timings: Dict[str, float], stage: str, fn: Callable, *args, **kwargs):
+        """
+        Run a blocking stage in a worker thread and record its latency in milliseconds.
+        """
+        start = time.perf_counter()
+        result = await asyncio.to_thread(fn, *args, **kwargs)
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+        return result
+
+    @staticmethod
+    def __log_timings(timings: Dict[str, float], num_queries: int, num_candidates: int, k: int) -> None:
+        stages = " | ".join(f"{stage} {ms:.1f} ms" for stage, ms in timings.items())
+        queries = f"{num_queries} queries, " if num_queries > 1 else ""
+        print(f"Retrieval ({queries}{num_candidates} candidates -> {k}): {stages}")
+
+    async def asearch(self, vectordb: VectorStore, keyword_index: Optional[BM25Index], query: str,
+                      vector: List[float], k: int, timings: Optional[Dict[str, float]] = None) -> List[Document]:
+        """
+        Retrieves the `k` best chunks of a query, with hybrid search when a keyword index is given
+        and reranking when the retriever has a reranker.
+
+        Args:
+            vectordb (VectorStore): The vector store to search.
+            keyword_index (BM25Index, optional): The keyword index of the store, or None for vector search only.
+            query (str): The query text.
+            vector (List[float]): The query embedding.
+            k (int): The number of chunks to return.
+            timings (Dict[str, float], optional): Receives the latency of each stage, in milliseconds;
+                without it, the latencies are printed.
+
+        Returns:
+            List[Document]: The retrieved chunks, best first.
+        """
+        log_timings = timings is None
+        timings = {} if timings is None else timings
+        fetch_k = max(k, self.fetch_k)
+        num_candidates = fetch_k if self.__has_selection_stage() else k
+        if keyword_index is None:
+            candidates = await self.__timed(timings, "vector", vectordb.similarity_search_by_vector,
+                                            vector, k=num_candidates)
+        else:
+            vector_docs, keyword_hits = await asyncio.gather(
+                self.__timed(timings, "vector", vectordb.similarity_search_by_vector, vector, k=fetch_k),
+                self.__timed(timings, "keyword", keyword_index.search, query, fetch_k))
+            candidates = await self.__timed(timings, "fusion", self.__fuse, vectordb, vector_docs,
+                                            [chunk_id for chunk_id, _ in keyword_hits], num_candidates)
+        num_fetched = len(candidates)
+        if self.__has_selection_stage():
+            candidates = await self.__timed(timings, self.__selection_stage(), self.__select, vectordb, query, vector,
+                                            candidates, k, keyword_index is not None)
+        if log_timings:
+            self.__log_timings(timings, 1, num_fetched, k)
+        return candidates
+
+    async def abatch_search(self, vectordb: VectorStore, queries: List[str], k: int,
+                            keyword_index: Optional[BM25Index] = None,
+                            timings: Optional[Dict[str, float]] = None) -> List[List[Document]]:
+        """
+        Embeds many queries in one request and searches them together.
+
+        Args:
+            vectordb (VectorStore): The vector store to search.
+            queries (List[str]): The query texts.
+            k (int): The number of chunks per query.
+            keyword_index (BM25Index, optional): The keyword index of the store, for hybrid search.
+            timings (Dict[str, float], optional): Receives the latency of each stage, in milliseconds;
+                without it, the latencies are printed.
+
+        Returns:
+            List[List[Document]]: The retrieved chunks of each query, best first.
+        """
+        log_timings = timings is None
+        timings = {} if timings is None else timings
+        start = time.perf_counter()
+        vectors = await self.aembed_queries(queries)
+        timings["embedding"] = timings.get("embedding", 0.0) + (time.perf_counter() - start) * 1000
+        fetch_k = max(k, self.fetch_k)
+        num_candidates = fetch_k if self.__has_selection_stage() else k
+
+        if keyword_index is None:
+            results = await self.__timed(timings, "vector", vectordb.search_by_vectors, vectors, num_candidates)
+        else:
+            def keyword_search() -> List[List[str]]:
+                return [[chunk_id for chunk_id, _ in keyword_index.search(query, fetch_k)] for query in queries]
+
+            def fuse_all(vector_results: List[List[Document]], keyword_results: List[List[str]]) -> List[List[Document]]:
+                return [self.__fuse(vectordb, vector_docs, keyword_ids, num_candidates)
+                        for vector_docs, keyword_ids in zip(vector_results, keyword_results)]
+
+            vector_results, keyword_results = await asyncio.gather(
+                self.__timed(timings, "vector", vectordb.search_by_vectors, vectors, fetch_k),
+                self.__timed(timings, "keyword", keyword_search))
+            results = await self.__timed(timings, "fusion", fuse_all, vector_results, keyword_results)
+
+        if self.__has_selection_stage():
+            def select_all(results: List[List[Document]]) -> List[List[Document]]:
+                return [self.__select(vectordb, query, vector, candidates, k, keyword_index is not None)
+                        for query, vector, candidates in zip(queries, vectors, results)]
+            results = await self.__timed(timings, self.__selection_stage(), select_all, results)
+        if log_timings:
+            self.__log_timings(timings, len(queries), num_candidates, k)
+        return results
+
+    def batch_search(self, vectordb: VectorStore, queries: List[str], k: int,
+                     keyword_index: Optional[BM25Index] = None) -> List[List[Document]]:
+        """
+        Blocking version of `abatch_search`, for scripts that do not run an event loop.
+
+        The async clients opened in the temporary event loop are closed before it ends.
+        """
+        async def run() -> List[List[Document]]:
+            try:
+                return await self.abatch_search(vectordb, queries, k, keyword_index)
+            finally:
+                aclose = getattr(self.embedding, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+                await close_async_openai_client()
+
+        return asyncio.run(run())
+
+    @staticmethod
+    def __text_overlap(first: str, second: str) -> int:
+        """
+        Return the length of the longest suffix of `first` that is a prefix of `second`.
+        """
+        probe = second[:64]
+        position = first.rfind(probe) if probe else -1
+        while position >= 0:
+            if second.startswith(first[position:]):
+                return len(first) - position
+            position = first.rfind(probe, 0, position)
+        return 0
+
+    @staticmethod
+    def merge_overlapping(documents: List[Document]) -> List[Document]:
+        """
+        Merges retrieved chunks that overlap on the same page into single spans.
+
+        Chunks are split with an overlap, so neighbouring chunks repeat part of each other's
+        text. Chunks of the same source and page are ordered by their start index and merged
+        when their character ranges overlap (chunks ingested before start indexes were stored
+        are merged when the end of one is the beginning of the other). Each span takes the rank
+        of its best chunk.
+
+        Args:
+            documents (List[Document]): The retrieved chunks, best first.
+
+        Returns:
+            List[Document]: The deduplicated spans, best first.
+        """
+        groups: Dict[tuple, List[tuple]] = {}
+        for rank, doc in enumerate(documents):
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            groups.setdefault(key, []).append((rank, doc))
+
+        spans = []  # [rank, text, end_index, first chunk]
+        for members in groups.values():
+            members.sort(key=lambda member: member[1].metadata.get("start_index", -1))
+            group_spans = []
+            for rank, doc in members:
+                content, start, end = doc.page_content, doc.metadata.get("start_index"), doc.metadata.get("end_index")
+                span = group_spans[-1] if group_spans else None
+                if span is None:
+                    merged = False
+                elif content in span[1]:
+                    merged = True
+                elif (overlap := Retriever.__text_overlap(span[1], content)):
+                    span[1] += content[overlap:]
+                    merged = True
+                elif start is not None and span[2] is not None and start < span[2]:
+                    # the ranges overlap but normalization changed the shared text: only the part
+                    # of the chunk past the end of the span is appended
+                    tail = content[span[2] - start:].strip()
+                    if tail:
+                        span[1] += " " + tail
+                    merged = True
+                elif start is None and (overlap := Retriever.__text_overlap(content, span[1])):
+                    # chunks without a start index may come in reverse order
+                    span[1] = content + span[1][overlap:]
+                    merged = True
+                else:
+                    merged = False
+
+                if merged:
+                    span[0] = min(span[0], rank)
+                    if end is not None:
+                        span[2] = max(span[2] or 0, end)
+                else:
+                    group_spans.append([rank, content, end, doc])
+            spans.extend(group_spans)
+
+        spans.sort(key=lambda span: span[0])
+        return [Document(page_content=text, metadata={**doc.metadata, "end_index": end} if end is not None else doc.metadata,
+                         id=doc.id) for _, text, end, doc in spans]
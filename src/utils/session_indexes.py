@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from langchain_core.embeddings import Embeddings
+from utils.vector_store import MemoryVectorStore
+
+
+class SessionIndexes:
+    """
+    Process-wide registry of the upload indexes of the chat sessions, keyed by Gradio session hash.
+
+    Every session gets its own `MemoryVectorStore`, so concurrent users never see or overwrite
+    each other's uploads, and nothing is written to a shared persist directory. An index lives
+    until its session closes (`drop`), or until it has not been used for `ttl_seconds`. When the
+    indexes together hold more than `max_memory_mb`, the least recently used ones are evicted
+    first; the index of the session being served is only evicted if it alone exceeds the budget.
+    The indexes of sessions for which `pinned` returns True (those with queued or running
+    ingestion jobs) are never evicted, so a job does not keep adding files to a dropped index.
+    Eviction is done lazily, on every access.
+
+    Parameters:
+        ttl_seconds (float): The idle time after which a session index is dropped.
+        max_memory_mb (int): The memory budget of all the session indexes.
+        spill_mb (int): The size above which the matrix of an index is memory-mapped.
+        spill_directory (str, optional): Where the memory-mapped matrices are written.
+        pinned (Callable[[str], bool], optional): Tells whether the index of a session must be kept.
+    """
+
+    def __init__(self, ttl_seconds: float, max_memory_mb: int, spill_mb: int = 64,
+                 spill_directory: Optional[str] = None, pinned: Optional[Callable[[str], bool]] = None) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_memory_mb << 20
+        self.spill_bytes = spill_mb << 20
+        self.spill_directory = spill_directory
+        self.pinned = pinned
+        self._lock = threading.Lock()
+        self._indexes: "OrderedDict[str, MemoryVectorStore]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self.evicted = 0
+
+    def get(self, session_id: str) -> Optional[MemoryVectorStore]:
+        """
+        Returns the upload index of a session, if it has one.
+
+        Args:
+            session_id (str): The Gradio session hash.
+
+        Returns:
+            Optional[MemoryVectorStore]: The index, or None if nothing was uploaded or it expired.
+        """
+        with self._lock:
+            self.__evict(keep=session_id)
+            return self.__touch(session_id)
+
+    def get_or_create(self, session_id: str, embedding: Embeddings) -> MemoryVectorStore:
+        """
+        Returns the upload index of a session, creating an empty one if needed.
+
+        Args:
+            session_id (str): The Gradio session hash.
+            embedding (Embeddings): The embedding function of a new index.
+
+        Returns:
+            MemoryVectorStore: The index of the session.
+        """
+        with self._lock:
+            self.__evict(keep=session_id)
+            index = self.__touch(session_id)
+            if index is None:
+                spill_directory = os.path.join(self.spill_directory, session_id) if self.spill_directory else None
+                index = MemoryVectorStore(embedding, spill_directory, self.spill_bytes)
+                self._indexes[session_id] = index
+                self._last_used[session_id] = time.monotonic()
+            return index
+
+    def drop(self, session_id: str) -> None:
+        """
+        Drops the upload index of a session, e.g. when its browser tab is closed.
+
+        Args:
+            session_id (str): The Gradio session hash.
+        """
+        with self._lock:
+            self.__remove(session_id)
+
+    def stats(self) -> Dict:
+        """
+        Returns the number of session indexes, their memory use and the number of evictions.
+
+        Returns:
+            Dict: The registry statistics; memory is in MB.
+        """
+        with self._lock:
+            return {"sessions": len(self._indexes),
+                    "memory_mb": sum(index.nbytes for index in self._indexes.values()) / (1 << 20),
+                    "evicted": self.evicted}
+
+    def __touch(self, session_id: str) -> Optional[MemoryVectorStore]:
+        index = self._indexes.get(session_id)
+        if index is not None:
+            self._indexes.move_to_end(session_id)
+            self._last_used[session_id] = time.monotonic()
+        return index
+
+    def __remove(self, session_id: str) -> None:
+        index = self._indexes.pop(session_id, None)
+        self._last_used.pop(session_id, None)
+        if index is not None:
+            index.close()
+
+    def __pinned(self, session_id: str) -> bool:
+        return self.pinned is not None and self.pinned(session_id)
+
+    def __evict(self, keep: str) -> None:
+        """
+        Drop the expired indexes, then the least recently used ones while over the memory budget,
+        skipping the pinned ones.
+        """
+        now = time.monotonic()
+        for session_id in [session_id for session_id, last_used in self._last_used.items()
+                           if now - last_used > self.ttl_seconds and not self.__pinned(session_id)]:
+            self.__remove(session_id)
+            self.evicted += 1
+            print(f"Session index {session_id} expired")
+
+        total = sum(index.nbytes for index in self._indexes.values())
+        for session_id in [session_id for session_id in self._indexes if session_id != keep] + [keep]:
+            if total <= self.max_bytes or session_id not in self._indexes or self.__pinned(session_id):
+                continue
+            total -= self._indexes[session_id].nbytes
+            self.__remove(session_id)
+            self.evicted += 1
+            print(f"Session index {session_id} evicted: the session indexes are over {self.max_bytes >> 20} MB")
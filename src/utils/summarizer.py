@@ -1,13 +1,20 @@
-from langchain_community.document_loaders import PyPDFLoader
-from utils.utilities import count_num_tokens
+from utils.token_counter import count_tokens, count_tokens_batch
+from utils.summary_cache import SummaryCache
+from utils.ingest_manifest import IngestManifest
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+import os
 import openai
 
+MIN_PAGE_SUMMARY_TOKENS = 50
+MAX_REDUCE_LEVELS = 5
+
 class Summarizer:
     """
     A class for summarizing PDF files using OpenAI's ChatGPT.
 
     Features:
-        - summarize_the_pdf: Reads a PDF and returns a short summary using ChatGPT.
+        - summarize_the_pdf: Reads a PDF and returns a short summary using ChatGPT (parallel map-reduce).
         - get_llm_response: Sends a prompt to ChatGPT and returns the response.
 
     Note:
@@ -23,11 +30,20 @@ class Summarizer:
         temperature: float,
         summarizer_llm_system_role: str,
         final_summarizer_llm_system_role: str,
-        character_overlap: int):
+        character_overlap: int,
+        max_concurrency: int = 4,
+        reduce_token_budget: int = 12000,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cache: Optional[SummaryCache] = None):
 
         """
         Summarizes the content of a PDF using OpenAI's ChatGPT.
 
+        Pages are summarized concurrently (map) and reassembled in page order. If the page
+        summaries together exceed `reduce_token_budget`, they are summarized again in groups
+        that fit the budget, level after level, before the final summary call (reduce).
+        The prompt and completion tokens of all requests sent for the document are reported.
+
         Args:
             file_dir (str): Path to the PDF file.
             max_final_token (int): Maximum number of tokens allowed in the final summary.
@@ -35,22 +51,47 @@ class Summarizer:
             gpt_model (str): Name of the ChatGPT model to use.
             temperature (float): Controls how creative or random the response is (higher means more creative).
             summarizer_llm_system_role (str): System role or instruction for the summarizer.
+            final_summarizer_llm_system_role (str): System role or instruction for the final summary.
+            character_overlap (int): Number of characters of the neighbouring pages added to each page.
+            max_concurrency (int): Maximum number of summary requests in flight.
+            reduce_token_budget (int): Maximum number of tokens sent to a single reduce call.
+            progress_callback (Callable, optional): Called with (fraction done, description) as pages are summarized.
+            cache (SummaryCache, optional): Cache of page and final summaries; only missing summaries are requested.
 
         Returns:
             str: The summarized text from the PDF.
         """
 
+        def report(fraction: float, description: str) -> None:
+            if progress_callback is not None:
+                progress_callback(fraction, description)
+
+        final_key = None
+        if cache is not None:
+            final_key = SummaryCache.key(IngestManifest.file_hash(file_dir), gpt_model, temperature, max_final_token,
+                                         token_threshold, summarizer_llm_system_role, final_summarizer_llm_system_role,
+                                         character_overlap, reduce_token_budget)
+            final_summary = cache.get("final", final_key)
+            if final_summary is not None:
+                print("Summary loaded from the cache.", cache.hit_rates())
+                report(1.0, "Summary ready")
+                return final_summary
+
+        # imported here so that starting the app does not load the PDF parsers
+        from langchain_community.document_loaders import PyPDFLoader
+
+        usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
         docs = []
         docs.extend(PyPDFLoader(file_dir).load())
         print(f"Document length: {len(docs)}")
         max_final_token = int(max_final_token)
-        max_summarizer_output_token = int(max_final_token / len(docs)) - token_threshold
-        full_summary = ""
-        counter = 1
+        # with many pages the per-page share gets tiny; the reduce tree takes care of the total length
+        max_summarizer_output_token = max(MIN_PAGE_SUMMARY_TOKENS, int(max_final_token / len(docs)) - token_threshold)
         print("Generating the summary..")
 
         # If the document has more than one pages
         if len(docs) > 1:
+            prompts = []
             for i in range(len(docs)):
                 # NOTE: This part can be optimized by considering a better technique for creating the prompt. (e.g: lanchain "chunksize" and "chunkoverlap" arguments.)
 
@@ -63,29 +104,110 @@ class Summarizer:
 
                 else: # for the Last page
                     prompt = docs[i-1].page_content[-character_overlap: ] + docs[i].page_content
-
-                summarizer_llm_system_role = summarizer_llm_system_role.format(max_summarizer_output_token)
-                full_summary += Summarizer.get_llm_response(
-                    gpt_model,
-                    temperature,
-                    summarizer_llm_system_role,
-                    prompt=prompt)
+                prompts.append(prompt)
+
+            page_role = summarizer_llm_system_role.format(max_summarizer_output_token)
+            summaries = Summarizer.__map(prompts, gpt_model, temperature, page_role, max_concurrency,
+                                         lambda done: report(0.9 * done / len(prompts), f"Page {done}/{len(prompts)} summarized"),
+                                         cache=cache, usage=usage)
+            summaries = Summarizer.__reduce_tree(summaries, gpt_model, temperature, summarizer_llm_system_role,
+                                                 max_concurrency, reduce_token_budget, report, cache, usage)
+            full_summary = "\n\n".join(summaries)
         else:   # If the document has only one page
             full_summary = docs[0].page_content
 
-            print(F"Page {counter} was summarized. ", end = "")
-            counter += 1
-        print("\nFull summary token length: ", count_num_tokens(full_summary, model = gpt_model))
+            print("Page 1 was summarized. ", end = "")
+        full_summary_tokens = count_tokens(full_summary, gpt_model)
+        print("\nFull summary token length: ", full_summary_tokens)
 
+        report(0.95, "Writing the final summary")
         final_summary = Summarizer.get_llm_response(
             gpt_model,
             temperature, 
             final_summarizer_llm_system_role,
             prompt = full_summary
         )
+        usage["requests"] += 1
+        usage["prompt_tokens"] += count_tokens(final_summarizer_llm_system_role, gpt_model) + full_summary_tokens
+        usage["completion_tokens"] += count_tokens(final_summary, gpt_model)
+        print(f"Token usage for {os.path.basename(file_dir)}: {usage['prompt_tokens']} prompt + "
+              f"{usage['completion_tokens']} completion tokens in {usage['requests']} requests")
+        if cache is not None:
+            cache.put("final", final_key, final_summary)
+            print(cache.hit_rates())
+        report(1.0, "Summary ready")
 
         return final_summary
 
+    @staticmethod
+    def __map(prompts: List[str], gpt_model: str, temperature: float, llm_system_role: str,
+              max_concurrency: int, on_done: Callable[[int], None], label: str = "Page",
+              cache: Optional[SummaryCache] = None, usage: Optional[Dict] = None) -> List[str]:
+        """
+        Summarize the prompts concurrently and return the summaries in the order of the prompts.
+        Prompts already summarized with the same model, role and temperature come from the cache.
+        The tokens of the requests actually sent are added to `usage`.
+        """
+        summaries = [None] * len(prompts)
+        keys = [SummaryCache.key(prompt, gpt_model, llm_system_role, temperature) for prompt in prompts]
+        done = 0
+        if cache is not None:
+            for i, key in enumerate(keys):
+                summaries[i] = cache.get("page", key)
+                if summaries[i] is not None:
+                    done += 1
+                    on_done(done)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            futures = {executor.submit(Summarizer.get_llm_response, gpt_model, temperature, llm_system_role, prompt): i
+                       for i, prompt in enumerate(prompts) if summaries[i] is None}
+            for future in as_completed(futures):
+                i = futures[future]
+                summaries[i] = future.result()
+                if cache is not None:
+                    cache.put("page", keys[i], summaries[i])
+                print(f"{label} {i + 1} was summarized. ", end="")
+                done += 1
+                on_done(done)
+
+        requested = sorted(futures.values())
+        if usage is not None and requested:
+            role_tokens = count_tokens(llm_system_role, gpt_model)
+            usage["requests"] += len(requested)
+            usage["prompt_tokens"] += len(requested) * role_tokens + sum(
+                count_tokens_batch([prompts[i] for i in requested], gpt_model))
+            usage["completion_tokens"] += sum(count_tokens_batch([summaries[i] for i in requested], gpt_model))
+        return summaries
+
+    @staticmethod
+    def __reduce_tree(summaries: List[str], gpt_model: str, temperature: float, summarizer_llm_system_role: str,
+                      max_concurrency: int, reduce_token_budget: int, report: Callable[[float, str], None],
+                      cache: Optional[SummaryCache] = None, usage: Optional[Dict] = None) -> List[str]:
+        """
+        Summarize groups of consecutive summaries until they fit in one reduce call.
+        """
+        for level in range(1, MAX_REDUCE_LEVELS + 1):
+            token_counts = count_tokens_batch(summaries, gpt_model)
+            if sum(token_counts) <= reduce_token_budget or len(summaries) == 1:
+                break
+
+            groups, current, current_tokens = [], [], 0
+            for summary, num_tokens in zip(summaries, token_counts):
+                if current and current_tokens + num_tokens > reduce_token_budget:
+                    groups.append(current)
+                    current, current_tokens = [], 0
+                current.append(summary)
+                current_tokens += num_tokens
+            groups.append(current)
+
+            # each level must shrink the total enough to fit the budget at the next one
+            group_role = summarizer_llm_system_role.format(max(MIN_PAGE_SUMMARY_TOKENS, reduce_token_budget // (2 * len(groups))))
+            print(f"\nReduce level {level}: {len(summaries)} summaries in {len(groups)} groups")
+            report(0.9, f"Combining summaries (level {level})")
+            summaries = Summarizer.__map(["\n\n".join(group) for group in groups], gpt_model, temperature,
+                                         group_role, max_concurrency, lambda done: None, label="Group", cache=cache,
+                                         usage=usage)
+        return summaries
 
     @staticmethod
     def get_llm_response(gpt_model: str, temperature: float, llm_system_role: str, prompt:str):
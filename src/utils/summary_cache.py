@@ -0,0 +1,101 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class SummaryCache:
+    """
+    A persistent two-level cache of LLM summaries, stored in SQLite.
+
+    - Page level: summaries of single page prompts, keyed by the prompt text, model, system role
+      and temperature. An edited PDF only re-summarizes the pages whose text changed.
+    - Document level: final summaries, keyed by the PDF content hash and all summarizer settings.
+
+    Each level keeps at most `max_entries` rows and evicts the least recently used ones.
+
+    Parameters:
+        db_path (str): The path of the SQLite database.
+        max_entries (int): The maximum number of rows per level.
+    """
+
+    LEVELS = ("page", "final")
+
+    def __init__(self, db_path: str, max_entries: int) -> None:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        for level in self.LEVELS:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {level}_summaries "
+                               "(key TEXT PRIMARY KEY, summary TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._conn.commit()
+        self.hits = {level: 0 for level in self.LEVELS}
+        self.misses = {level: 0 for level in self.LEVELS}
+
+    @staticmethod
+    def key(*parts) -> str:
+        """
+        Builds a cache key from the given parts.
+
+        Args:
+            parts: Strings or numbers identifying the summary.
+
+        Returns:
+            str: The sha256 hex digest of the parts.
+        """
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+    def get(self, level: str, key: str) -> Optional[str]:
+        """
+        Returns the cached summary for a key, or None on a miss.
+
+        Args:
+            level (str): "page" or "final".
+            key (str): The cache key.
+
+        Returns:
+            Optional[str]: The cached summary.
+        """
+        with self._lock:
+            row = self._conn.execute(f"SELECT summary FROM {level}_summaries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses[level] += 1
+                return None
+            self.hits[level] += 1
+            self._conn.execute(f"UPDATE {level}_summaries SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, level: str, key: str, summary: str) -> None:
+        """
+        Stores a summary, evicting the least recently used rows of the level if it is full.
+
+        Args:
+            level (str): "page" or "final".
+            key (str): The cache key.
+            summary (str): The summary to store.
+        """
+        with self._lock:
+            self._conn.execute(f"INSERT OR REPLACE INTO {level}_summaries (key, summary, last_used) VALUES (?, ?, ?)",
+                               (key, summary, time.time()))
+            self._conn.execute(f"DELETE FROM {level}_summaries WHERE key IN (SELECT key FROM {level}_summaries "
+                               "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._conn.commit()
+
+    def hit_rates(self) -> str:
+        """
+        Formats the hit counts and rates of both levels since the cache was opened.
+
+        Returns:
+            str: A one-line report.
+        """
+        parts = []
+        for level in self.LEVELS:
+            total = self.hits[level] + self.misses[level]
+            rate = self.hits[level] / total if total else 0.0
+            parts.append(f"{level} {self.hits[level]}/{total} hits ({rate:.0%})")
+        return "Summary cache: " + ", ".join(parts)
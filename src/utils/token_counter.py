@@ -0,0 +1,82 @@
+import functools
+from typing import List
+import tiktoken
+
+# Average number of characters per token of English text with the OpenAI BPE encodings
+APPROX_CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str) -> tiktoken.Encoding:
+    """
+    Return the tiktoken encoding of a model, loading it only once per model.
+
+    Models unknown to tiktoken fall back to the cl100k_base encoding.
+
+    Args:
+        model (str): The name of the OpenAI model.
+
+    Returns:
+        tiktoken.Encoding: The shared encoding of the model.
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def approximate_num_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text from its length, without tokenizing it.
+
+    Good enough for hot-path decisions such as batching or early budget checks; use
+    `count_tokens` wherever a limit must be respected exactly.
+
+    Args:
+        text (str): The text to estimate.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    return -(-len(text) // APPROX_CHARS_PER_TOKEN)
+
+
+def count_tokens(text: str, model: str, approximate: bool = False) -> int:
+    """
+    Return the number of tokens of a text for the given model.
+
+    Args:
+        text (str): The text to count tokens in.
+        model (str): The name of the OpenAI model.
+        approximate (bool): Estimate from the text length instead of tokenizing.
+
+    Returns:
+        int: The number of tokens in the text.
+    """
+    if approximate:
+        return approximate_num_tokens(text)
+    return len(get_encoding(model).encode_ordinary(text))
+
+
+def count_tokens_batch(texts: List[str], model: str, num_threads: int = 8, approximate: bool = False) -> List[int]:
+    """
+    Return the number of tokens of many texts in one call.
+
+    The texts are tokenized by tiktoken's `encode_ordinary_batch`, which spreads them over
+    `num_threads` threads (the tokenizer releases the GIL).
+
+    Args:
+        texts (List[str]): The texts to count tokens in.
+        model (str): The name of the OpenAI model.
+        num_threads (int): The number of tokenizer threads.
+        approximate (bool): Estimate from the text lengths instead of tokenizing.
+
+    Returns:
+        List[int]: The number of tokens of each text, in order.
+    """
+    if approximate:
+        return [approximate_num_tokens(text) for text in texts]
+    if not texts:
+        return []
+    return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(texts, num_threads=num_threads)]
@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Trace:
+    """
+    The spans of one request (a chat turn, an API query, the startup).
+
+    Spans are timed with `span`, or added with `add_span` when the duration was measured
+    elsewhere. Attributes such as token counts and cache hit flags are attached to the trace
+    with `set` or to a span as keyword arguments. `finish` hands the trace to its tracer.
+
+    Parameters:
+        tracer (Tracer): The tracer that records the trace.
+        name (str): The kind of request, e.g. "chat".
+        always_log (bool): Log the trace whatever the sample rate.
+        start (float, optional): The `time.perf_counter()` value at the start of the request; now by default.
+        attributes: The attributes of the trace.
+    """
+
+    def __init__(self, tracer: "Tracer", name: str, always_log: bool = False, start: Optional[float] = None,
+                 **attributes) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.always_log = always_log
+        self.attributes = attributes
+        self.trace_id = uuid.uuid4().hex[:16]
+        self._start = time.perf_counter() if start is None else start
+        self.started = time.time() - (time.perf_counter() - self._start)
+        self.duration_ms: Optional[float] = None
+        self.spans: List[Dict] = []
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Dict]:
+        """
+        Times the enclosed block as a span.
+
+        Args:
+            name (str): The name of the stage.
+            attributes: The attributes of the span.
+
+        Yields:
+            Dict: The attributes of the span, which the block may add to.
+        """
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.add_span(name, (time.perf_counter() - start) * 1000, start, **attributes)
+
+    def add_span(self, name: str, duration_ms: float, start: Optional[float] = None, **attributes) -> None:
+        """
+        Adds a span measured elsewhere.
+
+        Args:
+            name (str): The name of the stage.
+            duration_ms (float): The duration of the stage, in milliseconds.
+            start (float, optional): The `time.perf_counter()` value at the start of the stage.
+            attributes: The attributes of the span.
+        """
+        offset = (start - self._start) * 1000 if start is not None else None
+        self.spans.append({"name": name, "start_ms": offset, "duration_ms": duration_ms, **attributes})
+
+    def set(self, **attributes) -> None:
+        """
+        Sets attributes of the trace.
+        """
+        self.attributes.update(attributes)
+
+    def finish(self) -> None:
+        """
+        Ends the trace and records it; calling it again does nothing.
+        """
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._start) * 1000
+            self.tracer.record(self)
+
+    def to_dict(self) -> Dict:
+        return {"trace_id": self.trace_id, "name": self.name,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.started)),
+                "duration_ms": round(self.duration_ms, 2), "attributes": self.attributes,
+                "spans": [{key: round(value, 2) if isinstance(value, float) else value for key, value in span.items()}
+                          for span in self.spans]}
+
+
+class Tracer:
+    """
+    Records request traces as latency metrics and as JSON logs.
+
+    Every finished trace updates in-memory histograms of its duration and of each of its spans,
+    with counters of the boolean span attributes (e.g. cache hits) and of the attributes ending
+    in "_tokens"; `metrics_text` renders them in the Prometheus text format. Traces are written
+    as one JSON line each to a rotating log file, but only a `sample_rate` fraction of them, plus
+    every trace slower than `slow_trace_ms`. Spans are a few clock reads and a dict each, so the
+    tracer can stay on in production.
+
+    Parameters:
+        enabled (bool): Whether traces are recorded at all.
+        sample_rate (float): The fraction of traces written to the log, from 0 to 1.
+        slow_trace_ms (float): Traces slower than this are always written to the log.
+        log_path (str, optional): The JSON lines log file; None to only keep metrics.
+        max_bytes (int): The size at which the log file is rotated.
+        backup_count (int): The number of rotated log files kept.
+    """
+
+    def __init__(self, enabled: bool = True, sample_rate: float = 0.1, slow_trace_ms: float = 5000,
+                 log_path: Optional[str] = None, max_bytes: int = 10 << 20, backup_count: int = 5) -> None:
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_trace_ms = slow_trace_ms
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, ...], List[float]] = {}
+        self._counters: Dict[Tuple[str, ...], float] = {}
+        self.logger = logging.getLogger(f"raggpt.traces.{id(self)}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if enabled and log_path is not None:
+            os.makedirs(os.path.dirname(log_path), exist_ok=True)
+            handler = RotatingFileHandler(log_path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def start(self, name: str, always_log: bool = False, start: Optional[float] = None, **attributes) -> Trace:
+        """
+        Starts a trace.
+
+        Args:
+            name (str): The kind of request, e.g. "chat".
+            always_log (bool): Log the trace whatever the sample rate, e.g. for the startup.
+            start (float, optional): The `time.perf_counter()` value at the start of the request; now by default.
+            attributes: The attributes of the trace.
+
+        Returns:
+            Trace: The trace; call its `finish` method at the end of the request.
+        """
+        return Trace(self, name, always_log, start, **attributes)
+
+    def record(self, trace: Trace) -> None:
+        """
+        Adds a finished trace to the metrics and writes it to the log if it is sampled.
+
+        Args:
+            trace (Trace): The finished trace.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.__observe(("raggpt_trace_duration_seconds", trace.name, ""), trace.duration_ms / 1000)
+            for span in trace.spans:
+                self.__observe(("raggpt_span_duration_seconds", trace.name, span["name"]), span["duration_ms"] / 1000)
+                for key, value in span.items():
+                    if isinstance(value, bool):
+                        counter = ("raggpt_span_flag_total", trace.name, span["name"], key)
+                        self._counters[counter] = self._counters.get(counter, 0) + value
+                    elif key.endswith("_tokens") and isinstance(value, (int, float)):
+                        counter = ("raggpt_tokens_total", trace.name, span["name"], key)
+                        self._counters[counter] = self._counters.get(counter, 0) + value
+        if self.logger.handlers and (trace.always_log or trace.duration_ms >= self.slow_trace_ms
+                                     or random.random() < self.sample_rate):
+            self.logger.info(json.dumps(trace.to_dict(), default=str))
+
+    def __observe(self, key: Tuple[str, ...], seconds: float) -> None:
+        # bucket counts, then the sum and the count of the observations
+        histogram = self._histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+    def metrics_text(self) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        for metric, description in (("raggpt_trace_duration_seconds", "Duration of the requests."),
+                                    ("raggpt_span_duration_seconds", "Duration of the stages of the requests.")):
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} histogram"]
+            for (name, trace, span), histogram in histograms:
+                if name != metric:
+                    continue
+                labels = f'trace="{trace}"' + (f',span="{span}"' if span else "")
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram[-1]}')
+                lines.append(f"{metric}_sum{{{labels}}} {histogram[-2]:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram[-1]}")
+        for metric, label, description in (("raggpt_span_flag_total", "flag", "Spans with a flag set, e.g. cache hits."),
+                                           ("raggpt_tokens_total", "kind", "Tokens counted by the stages of the requests.")):
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} counter"]
+            for (name, trace, span, key), value in counters:
+                if name == metric:
+                    lines.append(f'{metric}{{trace="{trace}",span="{span}",{label}="{key}"}} {value:g}')
+        return "\n".join(lines) + "\n"
@@ -1,9 +1,17 @@
+import gradio as gr
 from utils.prepare_vectordb import PrepareVectorDB
-from typing import List, Tuple
-from utils.load_config import LoadConfig
+from typing import Dict, List, Tuple
+from utils.load_config import get_config
 from utils.summarizer import Summarizer
+from utils.summary_cache import SummaryCache
+from utils.chatbot import SESSION_INDEXES
+from utils.ingest_jobs import IngestJobQueue, JobProgress
 
-APPCFG = LoadConfig()
+APPCFG = get_config()
+SUMMARY_CACHE = SummaryCache(APPCFG.summary_cache_path, APPCFG.summary_cache_max_entries)
+INGEST_JOBS = IngestJobQueue(APPCFG.ingest_jobs_path, APPCFG.ingest_job_workers, APPCFG.ingest_job_poll_seconds)
+# the index of a session is kept while its uploads are still being ingested
+SESSION_INDEXES.pinned = INGEST_JOBS.has_active_jobs
 
 
 class UploadFile:
@@ -17,27 +25,32 @@ class UploadFile:
     """
 
     @staticmethod
-    def process_uploaded_files(files_dir: List, chatbot: List, rag_with_dropdown:str) -> Tuple:
+    def process_uploaded_files(files_dir: List, chatbot: List, rag_with_dropdown:str, request: gr.Request = None,
+                               progress=gr.Progress()) -> Tuple:
         """
         Processes uploaded files to prepare them for building a Vector Database (VectorDB).
 
+        Files for RAG are only queued here: an ingestion job indexes them in the background, so the
+        upload returns right away and the job's progress is shown while it runs.
+
         Args:
             files_dir (List): List of file paths for the uploaded files.
             chatbot: The chatbot instance used for showing messages or updates.
+            rag_with_dropdown (str): The action selected in the "RAG with" dropdown.
+            request (gr.Request): The request injected by Gradio; files for RAG are indexed in the
+                in-memory index of its session, by a background ingestion job.
+            progress (gr.Progress): Progress tracker injected by Gradio, updated while summarizing.
 
         Returns:
             Tuple: Returns an empty string and the updated chatbot instance.
         """
 
         if rag_with_dropdown == "Upload doc: Process for RAG":
-            prepare_vectordb_instance = PrepareVectorDB(data_directory=files_dir,
-                                                        persist_directory=APPCFG.custom_persist_directory,
-                                                        embedding_model_engine=APPCFG.embedding_model_engine,
-                                                        chunk_size=APPCFG.chunk_size,
-                                                        chunk_overlap=APPCFG.chunk_overlap)
-            
-            prepare_vectordb_instance.perpare_and_save_vectordb()
-            chatbot.append((" ", "Upload files are ready. Please ask your question"))
+            job_id = INGEST_JOBS.submit("session", {"files": list(files_dir)}, session_id=request.session_hash,
+                                        files_total=len(files_dir))
+            chatbot.append((" ", f"Indexing {len(files_dir)} file(s) in the background (job {job_id}). "
+                                 "Follow its progress under 'Ingestion jobs'; questions about the upload will "
+                                 "cover the files indexed so far."))
 
         elif rag_with_dropdown == "Upload doc: Give Full Summary":
             final_summary = Summarizer.summarize_the_pdf(file_dir=files_dir[0],
@@ -47,7 +60,11 @@ class UploadFile:
                                                          temperature=APPCFG.temperature,
                                                          summarizer_llm_system_role=APPCFG.summarizer_llm_system_role,
                                                          final_summarizer_llm_system_role=APPCFG.final_summarizer_llm_system_role,
-                                                         character_overlap=APPCFG.character_overlap)
+                                                         character_overlap=APPCFG.character_overlap,
+                                                         max_concurrency=APPCFG.summarizer_max_concurrency,
+                                                         reduce_token_budget=APPCFG.reduce_token_budget,
+                                                         progress_callback=lambda fraction, desc: progress(fraction, desc=desc),
+                                                         cache=SUMMARY_CACHE)
             chatbot.append(
                 (" ", final_summary)
             )
@@ -57,4 +74,71 @@ class UploadFile:
                 (" ", "If you would like to upload a PDF, please select your desired action in 'RAG with' dropdown.")
             )
 
-        return "", chatbot
\ No newline at end of file
+        return "", chatbot
+    @staticmethod
+    def index_session_files(job: Dict, progress: JobProgress) -> None:
+        """
+        Runs a "session" ingestion job: indexes uploaded files in the in-memory index of their session.
+
+        Args:
+            job (Dict): The job; its payload holds the file paths.
+            progress (JobProgress): The progress counters of the job.
+        """
+        prepare_vectordb_instance = PrepareVectorDB(data_directory=job["payload"]["files"],
+                                                    persist_directory=None,
+                                                    embedding_model_engine=APPCFG.embedding_model_engine,
+                                                    chunk_size=APPCFG.chunk_size,
+                                                    chunk_overlap=APPCFG.chunk_overlap,
+                                                    embedding_cache_directory=APPCFG.embedding_cache_directory,
+                                                    embedding_cache_max_entries=APPCFG.embedding_cache_max_entries,
+                                                    num_workers=APPCFG.num_workers,
+                                                    batch_size=APPCFG.ingestion_batch_size,
+                                                    max_memory_mb=APPCFG.ingestion_max_memory_mb,
+                                                    embedding=APPCFG.embedding_model,
+                                                    progress_callback=progress.add)
+        session_index = SESSION_INDEXES.get_or_create(job["session_id"], APPCFG.embedding_model)
+        prepare_vectordb_instance.add_to_vectordb(session_index)
+        # evicts idle sessions if this upload took the session indexes over their memory budget
+        SESSION_INDEXES.get(job["session_id"])
+
+    @staticmethod
+    def jobs_markdown(request: gr.Request) -> str:
+        """
+        Returns the ingestion jobs of the session as a Markdown table, for the polling status panel.
+
+        Args:
+            request (gr.Request): The request injected by Gradio, which identifies the session.
+
+        Returns:
+            str: The Markdown table.
+        """
+        return IngestJobQueue.format_markdown(INGEST_JOBS.list(session_id=request.session_hash, limit=5))
+
+    @staticmethod
+    def cancel_session_jobs(request: gr.Request) -> str:
+        """
+        Cancels the queued and running ingestion jobs of the session.
+
+        Args:
+            request (gr.Request): The request injected by Gradio, which identifies the session.
+
+        Returns:
+            str: The updated Markdown table of the session's jobs.
+        """
+        for job in INGEST_JOBS.list(session_id=request.session_hash):
+            if job["status"] in IngestJobQueue.ACTIVE:
+                INGEST_JOBS.cancel(job["id"])
+        return UploadFile.jobs_markdown(request)
+
+    @staticmethod
+    def end_session(request: gr.Request) -> None:
+        """
+        Cancels the ingestion jobs and drops the upload index of a session whose browser tab was closed.
+
+        Args:
+            request (gr.Request): The request injected by Gradio, which identifies the session.
+        """
+        for job in INGEST_JOBS.list(session_id=request.session_hash):
+            if job["status"] in IngestJobQueue.ACTIVE:
+                INGEST_JOBS.cancel(job["id"])
+        SESSION_INDEXES.drop(request.session_hash)
@@ -1,10 +1,24 @@
-import tiktoken
+import html
+import os
+import re
+import sys
+from utils.token_counter import count_tokens
+
+# Common mojibake left by PDF extraction (UTF-8 bytes decoded as latin-1), replaced in one pass.
+# Only full byte sequences are listed, so genuine accented text ("château", "SÃO") is left alone.
+_SYMBOL_FIXES = {"â\x80\x93": "-", "â\x88\x88": "∈", "Ã\x97": "×", "ï¬\x81": "fi", "ï¬\x82": "fl", "Â·": "·"}
+_SYMBOL_FIXES_RE = re.compile("|".join(sorted(map(re.escape, _SYMBOL_FIXES), key=len, reverse=True)))
+_SPECIAL_TOKENS_RE = re.compile(r"\s*<EOS>\s*<pad>\s*")
+_WHITESPACE_RE = re.compile(r"\s+")
+_MOJIBAKE_HINTS = ("Ã", "Â", "â", "ï")
 
 def count_num_tokens(text: str, model: str) -> int:
 
     """
     Return the number of token in the given text.
 
+    Kept for existing callers; the encoding is loaded once per model by `utils.token_counter`.
+
     Args:
         text (str): The text to count tokens in.
         model (str, optional): The name of the GPT model to use. Defaults to the model specified in the app config. 
@@ -13,5 +27,53 @@ def count_num_tokens(text: str, model: str) -> int:
         int: The number of tokens in the text. 
     """
 
-    encoding = tiktoken.encoding_for_model(model)
-    return len(encoding.encode(text=text))
\ No newline at end of file
+    return count_tokens(text, model)
+
+def normalize_text(text: str) -> str:
+
+    """
+    Clean up the text of a chunk for display.
+
+    Removes special tokens, collapses whitespace, decodes HTML entities, repairs UTF-8 text that
+    was decoded as latin-1 and replaces the remaining broken symbols. This runs once per chunk
+    at ingestion time, and the result is stored as the chunk content.
+
+    Args:
+        text (str): The raw chunk text.
+
+    Returns:
+        str: The normalized text.
+    """
+
+    text = _SPECIAL_TOKENS_RE.sub(" ", text)
+    text = _WHITESPACE_RE.sub(" ", text).strip()
+    text = html.unescape(text)
+    if any(hint in text for hint in _MOJIBAKE_HINTS):
+        try:
+            text = text.encode("latin1").decode("utf-8")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass  # not mojibake, or mixed with genuine non-latin-1 characters
+    return _SYMBOL_FIXES_RE.sub(lambda match: _SYMBOL_FIXES[match.group(0)], text)
+
+
+def current_rss_mb() -> float:
+
+    """
+    Return the resident memory of the current process in megabytes.
+
+    Reads /proc/self/statm where available (Linux) and falls back to the peak resident size
+    reported by `resource` on other platforms.
+
+    Returns:
+        float: The resident set size in MB.
+    """
+
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
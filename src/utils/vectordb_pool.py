@@ -0,0 +1,109 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from utils.bm25_index import BM25Index
+from utils.vector_store import VectorStore, get_vector_store
+
+
+class VectorDBPool:
+    """
+    Process-wide registry of open vector stores, keyed by persist directory.
+
+    Opening a vector store reopens its SQLite file and reloads its index (the HNSW segment of
+    Chroma, the memory maps of the numpy backend), which is the largest fixed cost of a chat
+    turn. The pool opens each persist directory once and hands the same read handle to every
+    caller. A handle is only dropped (and reopened on next use) when the directory is rebuilt
+    through `invalidate`.
+
+    Methods:
+        get(persist_directory, embedding_function, backend, **options):
+            Return the shared handle for a persist directory, opening it on first use.
+        get_keyword_index(persist_directory):
+            Return the shared BM25 index of a persist directory, if it has one.
+        invalidate(persist_directory):
+            Drop the handle of a rebuilt persist directory.
+        generation(persist_directory):
+            Return how many times a persist directory has been invalidated.
+    """
+
+    _lock = threading.Lock()
+    _handles: Dict[str, Tuple[VectorStore, int]] = {}
+    _keyword_indexes: Dict[str, Tuple[BM25Index, int]] = {}
+    _generations: Dict[str, int] = {}
+
+    @staticmethod
+    def _key(persist_directory: str) -> str:
+        return os.path.normcase(os.path.abspath(persist_directory))
+
+    @classmethod
+    def get(cls, persist_directory: str, embedding_function, backend: str = "chroma", **options) -> VectorStore:
+        """
+        Returns the shared vector store handle for the given persist directory.
+
+        Args:
+            persist_directory (str): The directory of the persisted vector store.
+            embedding_function: The embedding function used to embed queries.
+            backend (str): The vector store backend, "chroma" or "numpy".
+            **options: The index options of the backend, see `get_vector_store`.
+
+        Returns:
+            VectorStore: The shared vector store handle.
+        """
+        key = cls._key(persist_directory)
+        with cls._lock:
+            entry = cls._handles.get(key)
+            if entry is not None and entry[1] == cls._generations.get(key, 0):
+                return entry[0]
+            vectordb = get_vector_store(persist_directory, embedding_function, backend, **options)
+            cls._handles[key] = (vectordb, cls._generations.get(key, 0))
+            return vectordb
+
+    @classmethod
+    def get_keyword_index(cls, persist_directory: str) -> Optional[BM25Index]:
+        """
+        Returns the shared BM25 index of the given persist directory.
+
+        Args:
+            persist_directory (str): The directory of the persisted vector store.
+
+        Returns:
+            Optional[BM25Index]: The shared index, or None for stores built without one.
+        """
+        key = cls._key(persist_directory)
+        with cls._lock:
+            entry = cls._keyword_indexes.get(key)
+            if entry is not None and entry[1] == cls._generations.get(key, 0):
+                return entry[0]
+            if not BM25Index.exists(persist_directory):
+                return None
+            index = BM25Index(str(persist_directory))
+            cls._keyword_indexes[key] = (index, cls._generations.get(key, 0))
+            return index
+
+    @classmethod
+    def invalidate(cls, persist_directory: str) -> None:
+        """
+        Drops the cached handle of a persist directory so the next `get` reopens it.
+
+        Args:
+            persist_directory (str): The directory that was rebuilt.
+        """
+        key = cls._key(persist_directory)
+        with cls._lock:
+            cls._handles.pop(key, None)
+            cls._keyword_indexes.pop(key, None)
+            cls._generations[key] = cls._generations.get(key, 0) + 1
+
+    @classmethod
+    def generation(cls, persist_directory: str) -> int:
+        """
+        Returns the number of times the persist directory has been invalidated.
+
+        Args:
+            persist_directory (str): The directory of the persisted vector store.
+
+        Returns:
+            int: The invalidation counter of the directory.
+        """
+        with cls._lock:
+            return cls._generations.get(cls._key(persist_directory), 0)
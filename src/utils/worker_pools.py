@@ -0,0 +1,177 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+import gradio as gr
+
+
+class WorkerPool:
+    """
+    A bounded worker pool with admission control for Gradio handlers.
+
+    At most `max_concurrency` jobs run at once and at most `max_queue_size` wait for a slot;
+    further requests are rejected right away instead of piling up. Blocking jobs run on the
+    pool's own threads, so a pool busy with long uploads cannot take threads away from another
+    pool. Queue depth and wait times are tracked for the status panel.
+
+    Parameters:
+        name (str): The name shown in the status panel.
+        max_concurrency (int): The number of jobs that may run at once.
+        max_queue_size (int): The number of jobs that may wait for a slot.
+    """
+
+    _registry: List["WorkerPool"] = []
+
+    def __init__(self, name: str, max_concurrency: int, max_queue_size: int) -> None:
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue_size = max_queue_size
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"{name}-worker")
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=500)
+        WorkerPool._registry.append(self)
+
+    def __semaphore(self) -> asyncio.Semaphore:
+        # created lazily, inside the event loop of the Gradio server
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def __admit(self) -> float:
+        with self._lock:
+            if self.waiting >= self.max_queue_size:
+                self.rejected += 1
+                raise gr.Error(f"The {self.name} queue is full, please try again in a moment.")
+            self.waiting += 1
+        return time.perf_counter()
+
+    def __started(self, arrival: float) -> None:
+        with self._lock:
+            self.waiting -= 1
+            self.active += 1
+            self._wait_times.append(time.perf_counter() - arrival)
+
+    def __finished(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        """
+        Runs a blocking function on the pool's threads once a slot is free.
+
+        The function runs in a copy of the caller's context, like `asyncio.to_thread`, so context
+        variables such as Gradio's progress tracker stay visible on the worker thread.
+
+        Args:
+            fn (Callable): The function to run.
+            args, kwargs: The arguments of the function.
+
+        Returns:
+            The return value of the function.
+        """
+        arrival = self.__admit()
+        try:
+            await self.__semaphore().acquire()
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+        self.__started(arrival)
+        try:
+            loop = asyncio.get_running_loop()
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.executor, functools.partial(context.run, fn, *args, **kwargs))
+        finally:
+            self.__finished()
+            self.__semaphore().release()
+
+    async def stream(self, fn: Callable, *args, **kwargs):
+        """
+        Runs an async generator function once a slot is free and re-yields its items.
+
+        Args:
+            fn (Callable): The async generator function to run.
+            args, kwargs: The arguments of the function.
+
+        Yields:
+            The items produced by the generator.
+        """
+        arrival = self.__admit()
+        try:
+            await self.__semaphore().acquire()
+        except BaseException:
+            with self._lock:
+                self.waiting -= 1
+            raise
+        self.__started(arrival)
+        try:
+            async for item in fn(*args, **kwargs):
+                yield item
+        finally:
+            self.__finished()
+            self.__semaphore().release()
+
+    def wrap(self, fn: Callable) -> Callable:
+        """
+        Returns a Gradio handler that runs a blocking function through the pool.
+        """
+        @functools.wraps(fn)
+        async def handler(*args, **kwargs):
+            return await self.run(fn, *args, **kwargs)
+        return handler
+
+    def wrap_stream(self, fn: Callable) -> Callable:
+        """
+        Returns a Gradio handler that runs an async generator function through the pool.
+        """
+        @functools.wraps(fn)
+        async def handler(*args, **kwargs):
+            async for item in self.stream(fn, *args, **kwargs):
+                yield item
+        return handler
+
+    def stats(self) -> Dict:
+        """
+        Returns the current queue depth, running jobs and wait time statistics of the pool.
+
+        Returns:
+            Dict: The pool statistics; wait times are in seconds.
+        """
+        with self._lock:
+            wait_times = sorted(self._wait_times)
+            return {
+                "name": self.name,
+                "active": self.active,
+                "max_concurrency": self.max_concurrency,
+                "waiting": self.waiting,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait": sum(wait_times) / len(wait_times) if wait_times else 0.0,
+                "p95_wait": wait_times[int(len(wait_times) * 0.95)] if wait_times else 0.0,
+            }
+
+    @classmethod
+    def status_markdown(cls) -> str:
+        """
+        Formats the statistics of every pool as a Markdown table for the UI.
+
+        Returns:
+            str: The Markdown status table.
+        """
+        rows = ["| Pool | Running | Waiting | Avg wait | p95 wait | Done | Rejected |",
+                "|---|---|---|---|---|---|---|"]
+        for pool in cls._registry:
+            s = pool.stats()
+            rows.append(f"| {s['name']} | {s['active']}/{s['max_concurrency']} | {s['waiting']} | "
+                        f"{s['avg_wait']:.2f}s | {s['p95_wait']:.2f}s | {s['completed']} | {s['rejected']} |")
+        return "\n".join(rows)
@@ -0,0 +1,15 @@
+from utils.bm25_index import BM25Index
+
+
+def test_removed_rows_are_not_reused(tmp_path):
+    index = BM25Index(str(tmp_path))
+    index.add([f"filler{i}" for i in range(20)], [f"filler{i} text" for i in range(20)])
+    index.add(["a"], ["delta alpha"])
+    index.add(["c"], ["delta gamma"])
+    index.remove(["c"])
+    index.add(["d"], ["epsilon omega"])
+    # the postings of the removed chunk must not be scored against the new one
+    assert [chunk_id for chunk_id, _ in index.search("delta", 3)] == ["a"]
+    index.optimize()
+    assert [chunk_id for chunk_id, _ in index.search("delta", 3)] == ["a"]
+    assert [chunk_id for chunk_id, _ in index.search("omega", 3)] == ["d"]
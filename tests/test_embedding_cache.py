@@ -0,0 +1,44 @@
+import threading
+from utils.embedding_cache import EmbeddingCache
+
+
+def vector(i):
+    return [float(i), float(i) + 0.5]
+
+
+def test_caches_of_one_directory_never_share_rows(tmp_path):
+    # two instances stand for two processes filling the same cache directory
+    first = EmbeddingCache(str(tmp_path), "model", max_entries=64)
+    second = EmbeddingCache(str(tmp_path), "model", max_entries=64)
+
+    def fill(cache, offset):
+        for i in range(offset, offset + 40, 4):
+            texts = [f"chunk {j}" for j in range(i, i + 4)]
+            cache.put(texts, [vector(j) for j in range(i, i + 4)])
+
+    threads = [threading.Thread(target=fill, args=(first, 0)), threading.Thread(target=fill, args=(second, 100))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    texts = [f"chunk {j}" for j in list(range(0, 40)) + list(range(100, 140))]
+    for cache in (first, second, EmbeddingCache(str(tmp_path), "model", max_entries=64)):
+        hits = [(text, found) for text, found in zip(texts, cache.get(texts)) if found is not None]
+        assert len(hits) == 64
+        assert all(found == vector(int(text.split()[1])) for text, found in hits)
+
+
+def test_evicts_the_least_recently_used_entries(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model", max_entries=4)
+    cache.put(["a", "b", "c", "d"], [vector(i) for i in range(4)])
+    cache.get(["a"])
+    cache.put(["e"], [vector(4)])
+    assert cache.get(["a", "b", "e"]) == [vector(0), None, vector(4)]
+    assert len(cache) == 4
+
+
+def test_shared_returns_one_instance_per_directory(tmp_path):
+    cache = EmbeddingCache.shared(str(tmp_path), "model", 8)
+    assert EmbeddingCache.shared(str(tmp_path / "."), "model", 8) is cache
+    assert EmbeddingCache.shared(str(tmp_path), "other-model", 8) is not cache
@@ -0,0 +1,26 @@
+import time
+from utils.ingest_jobs import IngestJobQueue
+
+
+def wait_for(queue, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while queue.get(job_id)["status"] in IngestJobQueue.ACTIVE and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return queue.get(job_id)
+
+
+def test_a_job_cancelled_after_its_work_is_done(tmp_path):
+    queue = IngestJobQueue(str(tmp_path / "jobs.sqlite3"), poll_seconds=0.05)
+
+    def handler(job, progress):
+        progress.add("files_loaded")
+        # the cancellation arrives after the last progress report
+        queue.cancel(job["id"])
+        progress.counters["vectors_written"] += 3
+
+    queue.register("build", handler)
+    job_id = queue.submit("build", {})
+    queue.start()
+    job = wait_for(queue, job_id)
+    assert job["status"] == "done"
+    assert job["vectors_written"] == 3
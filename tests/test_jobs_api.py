@@ -0,0 +1,31 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from utils.ingest_jobs import IngestJobQueue
+from utils.jobs_api import create_jobs_router
+
+
+def make_clients(tmp_path):
+    queue = IngestJobQueue(str(tmp_path / "jobs.sqlite3"))
+    app = FastAPI()
+    app.include_router(create_jobs_router(queue))
+    return queue, TestClient(app), TestClient(app, client=("127.0.0.1", 50000))
+
+
+def test_jobs_are_scoped_to_their_session(tmp_path):
+    queue, remote, local = make_clients(tmp_path)
+    session_job = queue.submit("session", {"files": ["/uploads/a.pdf"]}, session_id="session-1")
+    build_job = queue.submit("build", {})
+
+    assert remote.get("/jobs").status_code == 403
+    jobs = remote.get("/jobs", params={"session_id": "session-1"}).json()
+    assert [job["id"] for job in jobs] == [session_job]
+    assert "session_id" not in jobs[0] and "payload" not in jobs[0]
+    assert "session_id" not in remote.get(f"/jobs/{session_job}").json()
+
+    assert remote.post(f"/jobs/{session_job}/cancel").status_code == 403
+    assert remote.post(f"/jobs/{session_job}/cancel", params={"session_id": "session-2"}).status_code == 403
+    assert remote.post(f"/jobs/{build_job}/cancel").status_code == 403
+    assert remote.post(f"/jobs/{session_job}/cancel", params={"session_id": "session-1"}).json()["cancelled"]
+
+    assert len(local.get("/jobs").json()) == 2
+    assert local.post(f"/jobs/{build_job}/cancel").json()["cancelled"]
@@ -0,0 +1,45 @@
+import asyncio
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from utils.bm25_index import BM25Index
+from utils.embedding_cache import QueryEmbeddingCache
+from utils.reranker import CosineReranker
+from utils.retriever import Retriever
+from utils.vector_store import NumpyVectorStore
+
+VECTORS = {"query": [1.0, 0.0], "near": [0.9, 0.1], "close": [0.8, 0.2], "keyword": [0.1, 0.9]}
+
+
+class TableEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [VECTORS[text.split()[0]] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_reranking_keeps_the_keyword_signal_of_hybrid_search(tmp_path):
+    embedding = TableEmbeddings()
+    store = NumpyVectorStore(str(tmp_path), embedding)
+    texts = {"near": "near chunk", "close": "close chunk", "keyword": "keyword chunk about xk-42"}
+    store.add_documents([Document(page_content=text) for text in texts.values()], list(texts))
+    keyword_index = BM25Index(str(tmp_path))
+    keyword_index.add(list(texts), list(texts.values()))
+    retriever = Retriever(embedding, QueryEmbeddingCache("test", 10), fetch_k=3, reranker=CosineReranker())
+
+    # the only keyword hit is also the third vector hit: fused, it ranks first, and cosine alone drops it
+    docs = asyncio.run(retriever.asearch(store, keyword_index, "query xk-42", VECTORS["query"], 2))
+    assert "keyword" in [doc.id for doc in docs]
+    docs = asyncio.run(retriever.asearch(store, None, "query xk-42", VECTORS["query"], 2))
+    assert [doc.id for doc in docs] == ["near", "close"]
+
+
+def test_merge_overlapping_does_not_repeat_the_shared_text():
+    page = {"source": "a.pdf", "page": 0}
+    first = Document(page_content="alpha beta gamma delta", metadata={**page, "start_index": 0, "end_index": 22}, id="1")
+    # normalization changed the overlapping text, so it cannot be matched
+    second = Document(page_content="GAMMA DELTA epsilon", metadata={**page, "start_index": 11, "end_index": 30}, id="2")
+    spans = Retriever.merge_overlapping([first, second])
+    assert [span.page_content for span in spans] == ["alpha beta gamma delta epsilon"]
+    assert spans[0].metadata["end_index"] == 30
@@ -0,0 +1,19 @@
+import time
+from utils.session_indexes import SessionIndexes
+
+
+def test_indexes_with_active_jobs_are_not_evicted():
+    busy = {"session-1"}
+    indexes = SessionIndexes(ttl_seconds=0.01, max_memory_mb=16, pinned=lambda session_id: session_id in busy)
+    first = indexes.get_or_create("session-1", embedding=None)
+    indexes.get_or_create("session-2", embedding=None)
+    time.sleep(0.05)
+
+    assert indexes.get("session-3") is None
+    assert indexes.get("session-2") is None
+    assert indexes.get("session-1") is first
+
+    busy.clear()
+    time.sleep(0.05)
+    assert indexes.get("session-3") is None
+    assert indexes.get("session-1") is None
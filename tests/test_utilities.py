@@ -0,0 +1,19 @@
+from utils.utilities import normalize_text
+
+
+def test_normalize_text_keeps_accented_text():
+    assert normalize_text("Le château de SÃO Paulo, à côté") == "Le château de SÃO Paulo, à côté"
+
+
+def test_normalize_text_decodes_mojibake():
+    assert normalize_text("a â\x80\x93 b, ï¬\x82ow") == "a – b, ﬂow"
+
+
+def test_normalize_text_replaces_mojibake_sequences():
+    # the euro sign is not latin-1, so the text cannot be re-decoded as a whole
+    assert normalize_text("€ a â\x80\x93 b, x â\x88\x88 A, 2 Ã\x97 3") == "€ a - b, x ∈ A, 2 × 3"
+    assert normalize_text("€ ï¬\x81ne ï¬\x82ow Â· château") == "€ fine flow · château"
+
+
+def test_normalize_text_collapses_whitespace_and_special_tokens():
+    assert normalize_text("  a <EOS><pad> b\n\nc  ") == "a b c"
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from utils.vector_store import FanOutVectorStore, MemoryVectorStore, NumpyVectorStore, VectorStore
+
+
+class HashEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        return [np.random.default_rng(abs(hash(text)) % 2**32).standard_normal(8).tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def test_search_after_optimizing_an_emptied_store(tmp_path):
+    embedding = HashEmbeddings()
+    store = NumpyVectorStore(str(tmp_path), embedding)
+    store.add_documents([Document(page_content="first"), Document(page_content="second")], ["a", "b"])
+    store.delete(["a", "b"])
+    store.optimize()
+    assert store.search_by_vectors([embedding.embed_query("first")], 2) == [[]]
+
+    store.add_documents([Document(page_content="third")], ["c"])
+    assert [doc.id for doc in store.search_by_vectors([embedding.embed_query("third")], 2)[0]] == ["c"]
+    assert store.get_embeddings(["c"]).shape == (1, 8)
+
+
+def test_fan_out_store_is_read_only():
+    embedding = HashEmbeddings()
+    first, second = MemoryVectorStore(embedding), MemoryVectorStore(embedding)
+    first.add_documents([Document(page_content="first")], ["a"])
+    second.add_documents([Document(page_content="second"), Document(page_content="third")], ["b", "c"])
+    store = FanOutVectorStore([first, second])
+
+    assert store.get_texts(2, 0) == (["a", "b"], ["first", "second"])
+    assert store.get_texts(5, 2) == (["c"], ["third"])
+    with pytest.raises(TypeError):
+        store.add_documents([Document(page_content="fourth")], ["d"])
+    with pytest.raises(TypeError):
+        store.delete(["a"])
+    with pytest.raises(TypeError):
+        VectorStore(embedding)
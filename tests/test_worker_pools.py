@@ -0,0 +1,16 @@
+import asyncio
+import contextvars
+from utils.worker_pools import WorkerPool
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_pooled_function_sees_the_caller_context():
+    pool = WorkerPool("test", max_concurrency=1, max_queue_size=1)
+
+    async def call():
+        request_id.set("request-1")
+        return await pool.run(request_id.get)
+
+    assert asyncio.run(call()) == "request-1"
+    assert pool.stats()["completed"] == 1